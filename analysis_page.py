@@ -5,7 +5,8 @@ from chart import generate_streamlit_chart
 from load_data import load_data
 from prompt.prompt_model import BeautyAnalyticsPrompts
 from prompt.prompt_model_en import BeautyAnalyticsPromptsEn
-from sql import process_user_query, process_user_query_orchestrator
+from jobs import JOB_POLL_INTERVAL_SECONDS, cancel_job, is_job_finished
+from sql import process_user_query, process_user_query_orchestrator, cancel_session_queries
 from dotenv import load_dotenv
 
 from utils import show_history_panel
@@ -235,6 +236,7 @@ TEXT_CONTENT = {
         "historical_chart": "历史图表",
         "ai_data_insights": "🤖 AI 数据洞察 (历史):",
         "query_no_data": "查询成功执行，但没有返回数据 (历史)。",
+        "result_truncated": "结果共 {total} 行，仅保留前 {shown} 行。",
         "historical_recommendations": "💡 历史分析建议:",
     },
     'en': {
@@ -278,6 +280,7 @@ TEXT_CONTENT = {
         "historical_chart": "Historical Chart",
         "ai_data_insights": "🤖 AI Data Insights (Historical):",
         "query_no_data": "Query executed successfully but returned no data (Historical).",
+        "result_truncated": "The result has {total} rows; only the first {shown} were kept.",
         "historical_recommendations": "💡 Historical Analysis Recommendations:",
     }
 }
@@ -317,9 +320,19 @@ def render_analysis_job():
     texts = TEXT_CONTENT.get(st.session_state.get('lang', 'zh'), TEXT_CONTENT['zh'])
 
     # 在处理过程中显示状态更新
-    if status not in ["DONE", "FAILED"]:
+    if not is_job_finished(job):
         default_processing_text = "正在处理中..." if st.session_state.get('lang', 'zh') == 'zh' else "Processing..."
+        if job.get("stage_info"):
+            st.caption(job["stage_info"])
         st.info(f"⚙️ {message or default_processing_text}")
+        plan = job.get("stages", {}).get("stage2_plan", [])
+        progress = job.get("stages", {}).get("stage3_progress", {})
+        for i, step in enumerate(plan):
+            icon = {"done": "✅", "failed": "❌"}.get(progress.get(f"evidence_{i + 1}"), "⏳")
+            st.markdown(f"{icon} {i + 1}/{len(plan)}: {step.get('purpose')}")
+
+    if status == "CANCELLED":
+        st.warning(message)
 
     # 如果分析失败，显示错误信息
     if status == "FAILED":
@@ -379,6 +392,17 @@ def render_analysis_job():
             st.markdown("未生成明确的策略建议。")
 
 
+def render_running_analysis_job():
+    """
+    任务运行期间以 fragment 形式定时轮询刷新，只重绘进度区域而不是整个页面；
+    检测到任务结束后触发一次整页重跑，以渲染最终报告并停止轮询。
+    """
+    job = st.session_state.get("current_analysis_job")
+    if job and is_job_finished(job):
+        st.rerun()
+    render_analysis_job()
+
+
 def init_session_state():
     """初始化会话状态"""
     if 'page' not in st.session_state:
@@ -494,9 +518,11 @@ def show_analysis_page():
             st.session_state.selected_analysis_prompt_display_name = selected_key
 
         if st.button(texts["clear_history"], key="sidebar_clear_history_button"):
+            cancel_session_queries()
             st.session_state.llm_conversation_history = []
             st.session_state.ui_messages = []
             if "current_analysis_job" in st.session_state:
+                cancel_job(st.session_state.current_analysis_job["job_id"])
                 del st.session_state["current_analysis_job"]
             st.rerun()
 
@@ -526,7 +552,10 @@ def show_analysis_page():
     # 主内容区
     if st.session_state.get('smart_report_mode', False):
         if "current_analysis_job" in st.session_state:
-            render_analysis_job()
+            if is_job_finished(st.session_state.current_analysis_job):
+                render_analysis_job()
+            else:
+                st.fragment(render_running_analysis_job, run_every=JOB_POLL_INTERVAL_SECONDS)()
         else:
             # 智能报告模式的欢迎界面
             st.markdown(
@@ -628,6 +657,10 @@ def show_analysis_page():
                                 chart_key=f"history_chart_{i}_{history_chart_title.replace(' ', '_')}",
                                 lang=st.session_state.lang
                             )
+                            if msg_info["query_result_df"].attrs.get("truncated"):
+                                st.caption(texts['result_truncated'].format(
+                                    total=msg_info["query_result_df"].attrs.get("total_rows") or "?",
+                                    shown=msg_info["query_result_df"].attrs.get("returned_rows")))
 
                             if msg_info.get("data_analysis_text"):
                                 st.markdown('<hr class="divider">', unsafe_allow_html=True)
@@ -663,23 +696,17 @@ def show_analysis_page():
 
     # 2. 如果有新输入，则启动一个新任务
     if input_for_processing:
+        # 开始新问题前中止本会话仍在执行的旧查询
+        cancel_session_queries()
         if st.session_state.get('smart_report_mode', False):
-            # 清理旧任务，准备开始新任务
-            if "current_analysis_job" in st.session_state:
-                del st.session_state["current_analysis_job"]
-            # 调用一次编排器来“初始化”新任务
+            # 在后台启动新任务（旧任务会被取消），重跑一次页面以开始轮询进度
             process_user_query_orchestrator(input_for_processing, df_data, lang=st.session_state.lang)
+            st.rerun()
         else:
             # 标准模式的逻辑不变
             process_user_query(input_for_processing, df_data, st.session_state.active_analysis_framework_prompt,
                                lang=st.session_state.lang)
 
-    # 3. 【新增】如果当前有正在进行的智能报告任务，则持续调用编排器以推进状态
-    job = st.session_state.get("current_analysis_job")
-    if job and job.get("job_status") not in ["DONE", "FAILED", None]:
-        # 只要任务没结束，就调用编排器让它继续跑
-        process_user_query_orchestrator(job["original_query"], df_data, lang=st.session_state.lang)
-
 def go_to_home_page():
     st.session_state.page = 'home'
     # st.session_state.should_rerun = True
@@ -0,0 +1,215 @@
+import json
+import os
+import threading
+import time
+
+from db import ConnectionPool, get_connection_pool, get_data_version
+
+# 数据概况：每个数据集版本统计一次（日期范围、行数、去重数、维度高频取值、空值率、数值分布），
+# 写入 LLM Call 1 与智能报告规划阶段的提示词，使模型无需额外的探索性查询即可了解数据
+DATA_PROFILE_ENABLED = os.getenv("DATA_PROFILE_ENABLED", "1") == "1"
+_CACHE_DIR = os.getenv("BEAUTYYTICS_CACHE_DIR", ".cache")
+DATA_PROFILE_PATH = os.getenv("DATA_PROFILE_PATH", os.path.join(_CACHE_DIR, "data_profile.json"))
+# 每个维度列写入提示词的高频取值个数
+DATA_PROFILE_TOP_VALUES = int(os.getenv("DATA_PROFILE_TOP_VALUES", "5"))
+# 空值率低于该值的列不在提示词中列出
+DATA_PROFILE_MIN_NULL_RATE = float(os.getenv("DATA_PROFILE_MIN_NULL_RATE", "0.01"))
+
+DATE_COLUMNS = ("order_date", "first_order_date")
+NUMERIC_COLUMNS = ("sales", "item_qty", "item_price")
+DIMENSION_COLUMNS = ("order_type", "channel", "subchannel", "province_name", "line_city_level", "material_type",
+                     "brand_code", "tier_code", "terminal_region", "default_flag")
+# 只统计去重数、不列出取值的高基数列
+ENTITY_COLUMNS = ("order_no", "merged_c_code", "material_code", "material_name_cn", "store_no", "ba_code",
+                  "line_city_name", "terminal_name")
+QUANTILES = (0.05, 0.25, 0.5, 0.75, 0.95)
+
+
+def _json_value(value):
+    if value is None or isinstance(value, (int, float, str, bool)):
+        return value
+    return str(value)
+
+
+def compute_profile(cursor) -> dict:
+    """在 cursor 可见的 df_data 上统计数据概况；除维度高频取值外只需扫描一次全表"""
+    columns = [d[0] for d in cursor.execute('SELECT * FROM "df_data" LIMIT 0').description]
+    date_columns = [c for c in DATE_COLUMNS if c in columns]
+    numeric_columns = [c for c in NUMERIC_COLUMNS if c in columns]
+
+    selects = ["COUNT(*)"]
+    selects += [f'COUNT("{c}")' for c in columns]
+    selects += [f'approx_count_distinct("{c}")' for c in columns]
+    selects += [f'CAST(MIN("{c}") AS VARCHAR), CAST(MAX("{c}") AS VARCHAR)' for c in date_columns]
+    quantile_list = ", ".join(str(q) for q in QUANTILES)
+    selects += [f'MIN("{c}"), MAX("{c}"), AVG("{c}"), approx_quantile("{c}", [{quantile_list}])'
+                for c in numeric_columns]
+    row = cursor.execute(f'SELECT {", ".join(selects)} FROM "df_data"').fetchone()
+
+    row_count = row[0]
+    pos = 1
+    null_counts = dict(zip(columns, row[pos:pos + len(columns)]))
+    pos += len(columns)
+    distinct_counts = dict(zip(columns, row[pos:pos + len(columns)]))
+    pos += len(columns)
+    date_ranges = {}
+    for c in date_columns:
+        date_ranges[c] = [row[pos], row[pos + 1]]
+        pos += 2
+    numeric = {}
+    for c in numeric_columns:
+        low, high, mean, quantiles = row[pos:pos + 4]
+        pos += 4
+        numeric[c] = {"min": _json_value(low), "max": _json_value(high), "avg": _json_value(mean),
+                      **{f"p{int(q * 100):02d}": _json_value(v) for q, v in zip(QUANTILES, quantiles or [])}}
+
+    top_values = {}
+    for c in DIMENSION_COLUMNS:
+        if c in columns:
+            rows = cursor.execute(
+                f'SELECT CAST("{c}" AS VARCHAR), COUNT(*) AS n FROM "df_data" GROUP BY 1 '
+                f'ORDER BY n DESC LIMIT {DATA_PROFILE_TOP_VALUES}').fetchall()
+            top_values[c] = [[value, count] for value, count in rows]
+
+    return {
+        "row_count": row_count,
+        "date_ranges": date_ranges,
+        "null_rates": {c: (1 - null_counts[c] / row_count) if row_count else 0.0 for c in columns},
+        "distinct_counts": distinct_counts,
+        "numeric": numeric,
+        "top_values": top_values,
+    }
+
+
+_profiles = {}
+_profiles_lock = threading.Lock()
+
+
+def _read_cached_profile(data_version: str):
+    try:
+        with open(DATA_PROFILE_PATH, "r", encoding="utf-8") as f:
+            profile = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return profile if profile.get("data_version") == data_version else None
+
+
+def _write_cached_profile(profile: dict):
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(DATA_PROFILE_PATH)), exist_ok=True)
+        tmp_path = f"{DATA_PROFILE_PATH}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(profile, f, ensure_ascii=False)
+        os.replace(tmp_path, DATA_PROFILE_PATH)
+    except OSError as e:
+        print(f"[DataProfile] 写入数据概况缓存失败（不影响使用）: {e}")
+
+
+def build_data_profile(data_source) -> dict:
+    """
+    返回数据源（DataFrame 或连接池）当前版本的数据概况并登记供 get_data_profile 使用。
+    同一版本的概况缓存在磁盘上，重启后无需重新扫描。
+    """
+    data_version = get_data_version(data_source)
+    profile = _read_cached_profile(data_version) if data_version else None
+    if profile is not None:
+        print(f"[DataProfile] 数据概况从缓存加载 ({profile['row_count']} 行)")
+    else:
+        started = time.perf_counter()
+        if isinstance(data_source, ConnectionPool):
+            cursor = data_source.cursor()
+        else:
+            cursor = get_connection_pool().cursor(data_source)
+        profile = {"data_version": data_version, **compute_profile(cursor)}
+        print(f"[DataProfile] 数据概况统计完成 ({time.perf_counter() - started:.2f}s, {profile['row_count']} 行)")
+        if data_version:
+            _write_cached_profile(profile)
+    with _profiles_lock:
+        _profiles.clear()
+        _profiles[data_version] = profile
+    return profile
+
+
+def get_data_profile(data_source):
+    """返回数据源当前版本的数据概况；尚未统计时返回 None"""
+    if not DATA_PROFILE_ENABLED:
+        return None
+    with _profiles_lock:
+        return _profiles.get(get_data_version(data_source))
+
+
+_PROFILE_TEXT = {
+    'zh': {
+        "header": "【数据概况】以下为 \"df_data\" 的预先统计结果，可直接使用，无需为了解数据另行查询：",
+        "rows": "- 总行数：{rows}",
+        "dates": "- 日期范围：{ranges}",
+        "relative": "- 数据截止到 {latest}。相对日期（如“上个月”“最近30天”“今年”）请以 DATE '{latest}' 作为当前日期计算，"
+                    "不要使用 CURRENT_DATE 或 NOW()，也无需向用户询问当前日期。",
+        "numeric": "- 数值分布：{items}",
+        "numeric_item": "\"{column}\" 最小 {min} / P25 {p25} / 中位数 {p50} / P75 {p75} / 最大 {max} / 均值 {avg}",
+        "top": "- 维度高频取值（括号内为行数占比）：",
+        "top_item": "  - \"{column}\"（共 {distinct} 个）：{values}",
+        "distinct": "- 去重数（近似）：{items}",
+        "nulls": "- 空值率：{items}",
+    },
+    'en': {
+        "header": "[Data profile] Precomputed statistics of \"df_data\"; use them directly instead of running exploratory queries:",
+        "rows": "- Row count: {rows}",
+        "dates": "- Date ranges: {ranges}",
+        "relative": "- The data ends on {latest}. Resolve relative dates (e.g. \"last month\", \"last 30 days\", \"this year\") "
+                    "against DATE '{latest}' as the current date; do not use CURRENT_DATE or NOW(), and do not ask the user for the date.",
+        "numeric": "- Numeric distributions: {items}",
+        "numeric_item": "\"{column}\" min {min} / P25 {p25} / median {p50} / P75 {p75} / max {max} / mean {avg}",
+        "top": "- Most frequent dimension values (share of rows in brackets):",
+        "top_item": "  - \"{column}\" ({distinct} distinct): {values}",
+        "distinct": "- Distinct counts (approximate): {items}",
+        "nulls": "- Null rates: {items}",
+    },
+}
+
+
+def _fmt_number(value) -> str:
+    if value is None:
+        return "-"
+    if isinstance(value, float) and not value.is_integer():
+        return f"{value:,.2f}"
+    return f"{int(value):,}"
+
+
+def format_data_profile(profile: dict, lang: str = 'zh') -> str:
+    """把数据概况格式化为写入提示词的紧凑文本；profile 为 None 时返回空字符串"""
+    if not profile:
+        return ""
+    texts = _PROFILE_TEXT[lang]
+    rows = profile["row_count"]
+    lines = [texts["header"], texts["rows"].format(rows=_fmt_number(rows))]
+
+    date_ranges = {c: r for c, r in profile["date_ranges"].items() if r[1]}
+    if date_ranges:
+        lines.append(texts["dates"].format(
+            ranges="; ".join(f'"{c}" {r[0][:10]} ~ {r[1][:10]}' for c, r in date_ranges.items())))
+        latest = date_ranges.get("order_date", next(iter(date_ranges.values())))[1][:10]
+        lines.append(texts["relative"].format(latest=latest))
+
+    if profile["numeric"]:
+        lines.append(texts["numeric"].format(items="; ".join(
+            texts["numeric_item"].format(column=c, **{k: _fmt_number(stats.get(k))
+                                                     for k in ("min", "p25", "p50", "p75", "max", "avg")})
+            for c, stats in profile["numeric"].items())))
+
+    if profile["top_values"]:
+        lines.append(texts["top"])
+        for c, values in profile["top_values"].items():
+            shown = ", ".join(f"'{value}'({count / rows:.0%})" if rows else f"'{value}'"
+                              for value, count in values)
+            lines.append(texts["top_item"].format(column=c, distinct=_fmt_number(profile["distinct_counts"].get(c)),
+                                                  values=shown))
+
+    entity_counts = [(c, profile["distinct_counts"][c]) for c in ENTITY_COLUMNS if c in profile["distinct_counts"]]
+    if entity_counts:
+        lines.append(texts["distinct"].format(items=", ".join(f'"{c}" {_fmt_number(n)}' for c, n in entity_counts)))
+
+    nulls = [(c, rate) for c, rate in profile["null_rates"].items() if rate >= DATA_PROFILE_MIN_NULL_RATE]
+    if nulls:
+        lines.append(texts["nulls"].format(items=", ".join(f'"{c}" {rate:.0%}' for c, rate in nulls)))
+    return "\n".join(lines)
@@ -0,0 +1,274 @@
+import itertools
+import os
+import threading
+import time
+
+import duckdb
+import pandas as pd
+import pyarrow as pa
+
+# DuckDB 运行参数统一在此配置（为空或 0 时使用 DuckDB 默认值）
+DUCKDB_THREADS = int(os.getenv("DUCKDB_THREADS", "0"))
+DUCKDB_MEMORY_LIMIT = os.getenv("DUCKDB_MEMORY_LIMIT", "")
+DUCKDB_TEMP_DIRECTORY = os.getenv("DUCKDB_TEMP_DIRECTORY", "")
+# 单次查询结果的行数/字节上限，超过后只保留预览并统计精确总行数
+SQL_RESULT_MAX_ROWS = int(os.getenv("SQL_RESULT_MAX_ROWS", "100000"))
+SQL_RESULT_MAX_BYTES = int(os.getenv("SQL_RESULT_MAX_BYTES", str(64 * 1024 * 1024)))
+SQL_FETCH_BATCH_ROWS = int(os.getenv("SQL_FETCH_BATCH_ROWS", "16384"))
+
+
+def get_duckdb_config() -> dict:
+    config = {}
+    if DUCKDB_THREADS > 0:
+        config["threads"] = DUCKDB_THREADS
+    if DUCKDB_MEMORY_LIMIT:
+        config["memory_limit"] = DUCKDB_MEMORY_LIMIT
+    if DUCKDB_TEMP_DIRECTORY:
+        config["temp_directory"] = DUCKDB_TEMP_DIRECTORY
+    return config
+
+
+def connect_duckdb(database: str = ':memory:', read_only: bool = False) -> duckdb.DuckDBPyConnection:
+    """以统一配置打开 DuckDB 连接。同一进程内打开同一文件时配置必须一致，因此所有连接都应经由此处创建。"""
+    return duckdb.connect(database=database, read_only=read_only, config=get_duckdb_config())
+
+
+class ConnectionPool:
+    """
+    进程级的 DuckDB 连接管理器：每个数据库只保留一个连接，
+    每个线程（Streamlit 脚本线程、工作线程）从它派生并复用自己的游标。
+    """
+
+    def __init__(self, database: str = ':memory:', read_only: bool = False):
+        self.database = database
+        self.read_only = read_only
+        self.data_version = None
+        # 当前数据版本可用的汇总表（见 rollup.py）
+        self.rollups = []
+        self._con = connect_duckdb(database, read_only)
+        self._lock = threading.Lock()
+        # thread ident -> [cursor, 已注册 DataFrame 的版本]
+        self._cursors = {}
+        self._stats = {"cursors_created": 0, "cursors_reused": 0, "cursors_closed": 0,
+                       "frame_registrations": 0}
+
+    @property
+    def connection(self) -> duckdb.DuckDBPyConnection:
+        """主连接，仅用于建表等管理操作；查询请使用 cursor()"""
+        return self._con
+
+    def _prune_dead_threads(self):
+        alive = {t.ident for t in threading.enumerate()}
+        for ident in [i for i in self._cursors if i not in alive]:
+            cursor, _ = self._cursors.pop(ident)
+            try:
+                cursor.close()
+            except duckdb.Error:
+                pass
+            self._stats["cursors_closed"] += 1
+
+    def cursor(self, frame: pd.DataFrame = None) -> duckdb.DuckDBPyConnection:
+        """返回当前线程的游标；传入 frame 时确保其已注册为 df_data（同一版本只注册一次）"""
+        ident = threading.get_ident()
+        with self._lock:
+            entry = self._cursors.get(ident)
+            if entry is None:
+                self._prune_dead_threads()
+                entry = [self._con.cursor(), None]
+                self._cursors[ident] = entry
+                self._stats["cursors_created"] += 1
+            else:
+                self._stats["cursors_reused"] += 1
+
+        if frame is not None:
+            frame_version = (id(frame), frame.attrs.get("data_version"))
+            if entry[1] != frame_version:
+                entry[0].register('df_data', frame)
+                entry[1] = frame_version
+                with self._lock:
+                    self._stats["frame_registrations"] += 1
+        return entry[0]
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._prune_dead_threads()
+            return {
+                "database": self.database,
+                "read_only": self.read_only,
+                "data_version": self.data_version,
+                "open_cursors": len(self._cursors),
+                **self._stats,
+            }
+
+    def close(self):
+        with self._lock:
+            for cursor, _ in self._cursors.values():
+                try:
+                    cursor.close()
+                except duckdb.Error:
+                    pass
+            self._cursors.clear()
+            self._con.close()
+
+
+def arrow_to_frame(table: pa.Table) -> pd.DataFrame:
+    """Arrow 表转 DataFrame，数值与日期类型与 fetchdf() 的结果保持一致（DECIMAL/HUGEINT 转 float64）"""
+    for i, field in enumerate(table.schema):
+        if pa.types.is_decimal(field.type):
+            table = table.set_column(i, field.name, table.column(i).cast(pa.float64()))
+    return table.to_pandas(date_as_object=False)
+
+
+def fetch_bounded_result(cursor: duckdb.DuckDBPyConnection, sql_query: str,
+                         max_rows: int = None, max_bytes: int = None) -> pd.DataFrame:
+    """
+    以 Arrow record batch 流式读取查询结果，达到行数或字节上限即停止读取，
+    因此无论 SQL 返回多少行，单次查询的峰值内存都是有界的。
+    被截断时额外执行一次 COUNT(*) 得到精确总行数，并记录在 df.attrs 中：
+    truncated / total_rows / returned_rows。
+    """
+    max_rows = max_rows or SQL_RESULT_MAX_ROWS
+    max_bytes = max_bytes or SQL_RESULT_MAX_BYTES
+    reader = cursor.execute(sql_query).fetch_record_batch(min(SQL_FETCH_BATCH_ROWS, max_rows))
+    batches, rows, nbytes, truncated = [], 0, 0, False
+    for batch in reader:
+        if rows >= max_rows or nbytes >= max_bytes:
+            truncated = True
+            break
+        if rows + batch.num_rows > max_rows:
+            batch = batch.slice(0, max_rows - rows)
+            truncated = True
+        batches.append(batch)
+        rows += batch.num_rows
+        nbytes += batch.nbytes
+        if truncated:
+            break
+
+    result_df = arrow_to_frame(pa.Table.from_batches(batches, schema=reader.schema))
+    total_rows = rows
+    if truncated:
+        inner_sql = sql_query.strip().rstrip(";")
+        try:
+            total_rows = cursor.execute(f"SELECT COUNT(*) FROM ({inner_sql}) AS _bounded_result").fetchone()[0]
+        except duckdb.Error as e:
+            print(f"[DB] 统计截断结果的总行数失败: {e}")
+            total_rows = None
+    result_df.attrs.update({"truncated": truncated, "total_rows": total_rows, "returned_rows": rows})
+    if truncated:
+        print(f"[DB] 查询结果已截断: 返回 {rows} 行 / 共 {total_rows} 行")
+    return result_df
+
+
+class QueryWatchdog:
+    """
+    单个守护线程监视所有正在执行的查询：超过截止时间或被取消时调用游标的 interrupt()。
+    owner 通常为 Streamlit 会话 ID，可通过 cancel(owner) 取消该会话的全部查询；
+    设置 is_owner_alive 后，所属会话已断开的查询也会被中止。
+    """
+
+    poll_interval = 0.5
+
+    def __init__(self):
+        self.is_owner_alive = None
+        self._active = {}
+        self._tokens = itertools.count(1)
+        self._cond = threading.Condition()
+        self._thread = None
+
+    def _ensure_thread(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name="duckdb-query-watchdog", daemon=True)
+            self._thread.start()
+
+    def start_query(self, cursor: duckdb.DuckDBPyConnection, timeout: float = None, owner: str = None) -> int:
+        with self._cond:
+            token = next(self._tokens)
+            deadline = time.monotonic() + timeout if timeout and timeout > 0 else None
+            self._active[token] = {"cursor": cursor, "owner": owner, "deadline": deadline, "reason": None}
+            self._ensure_thread()
+            self._cond.notify()
+            return token
+
+    def finish_query(self, token: int) -> str:
+        """登记查询结束，返回其被中止的原因（'timeout' / 'cancelled'），正常结束时返回 None"""
+        with self._cond:
+            entry = self._active.pop(token, None)
+        return entry["reason"] if entry else None
+
+    def cancel(self, owner: str) -> int:
+        """中止指定 owner 正在执行的全部查询，返回中止的数量"""
+        with self._cond:
+            entries = [e for e in self._active.values() if e["owner"] == owner and e["reason"] is None]
+            for entry in entries:
+                self._interrupt(entry, "cancelled")
+        return len(entries)
+
+    def active_count(self) -> int:
+        with self._cond:
+            return len(self._active)
+
+    @staticmethod
+    def _interrupt(entry: dict, reason: str):
+        entry["reason"] = reason
+        try:
+            entry["cursor"].interrupt()
+        except duckdb.Error as e:
+            print(f"[DB] 中止查询失败: {e}")
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                for entry in self._active.values():
+                    if entry["reason"] is not None:
+                        continue
+                    if entry["deadline"] is not None and now >= entry["deadline"]:
+                        self._interrupt(entry, "timeout")
+                    elif entry["owner"] and self.is_owner_alive and not self.is_owner_alive(entry["owner"]):
+                        self._interrupt(entry, "cancelled")
+                deadlines = [e["deadline"] for e in self._active.values()
+                             if e["reason"] is None and e["deadline"] is not None]
+                wait = self.poll_interval
+                if deadlines:
+                    wait = min(wait, max(0.0, min(deadlines) - now))
+                self._cond.wait(wait if self._active else None)
+
+
+query_watchdog = QueryWatchdog()
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_connection_pool(database: str = ':memory:', read_only: bool = False) -> ConnectionPool:
+    """获取（必要时创建）指定数据库的进程级连接池"""
+    with _pools_lock:
+        pool = _pools.get(database)
+        if pool is None:
+            pool = ConnectionPool(database, read_only)
+            _pools[database] = pool
+            print(f"[DB] 已创建连接池: {database} (read_only={read_only}, config={get_duckdb_config()})")
+        return pool
+
+
+def close_connection_pool(database: str):
+    """关闭并移除连接池（例如数据库文件被重建后需要重新打开）"""
+    with _pools_lock:
+        pool = _pools.pop(database, None)
+    if pool is not None:
+        pool.close()
+
+
+def get_pool_stats() -> list:
+    with _pools_lock:
+        pools = list(_pools.values())
+    return [pool.stats() for pool in pools]
+
+
+def get_data_version(data_source) -> str:
+    """返回数据源（DataFrame 或连接池）的数据集版本号（源文件指纹），未知时返回 None"""
+    if isinstance(data_source, ConnectionPool):
+        return data_source.data_version
+    if isinstance(data_source, pd.DataFrame):
+        return data_source.attrs.get("data_version")
+    return None
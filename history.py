@@ -0,0 +1,74 @@
+import json
+import os
+
+from serialize import estimate_tokens
+
+# 发送给 LLM Call 1 的对话历史 token 预算；最近 N 轮保持原样，更早的轮次压缩为“问题 → SQL”
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "3000"))
+HISTORY_KEEP_RECENT_TURNS = int(os.getenv("HISTORY_KEEP_RECENT_TURNS", "2"))
+
+
+def _split_turns(history: list) -> list:
+    """按用户消息切分轮次，每轮为 [user, assistant, ...]"""
+    turns = []
+    for message in history:
+        if message.get("role") == "user" or not turns:
+            turns.append([])
+        turns[-1].append(message)
+    return turns
+
+
+def _compact_assistant(content: str) -> str:
+    """只保留 Call 1 结果中的 sql_query，去掉 explanation / recommended_analyses 等文本"""
+    try:
+        data = json.loads(content)
+    except (TypeError, ValueError):
+        return content if len(content) <= 200 else content[:200] + "..."
+    if isinstance(data, dict) and data.get("sql_query"):
+        return json.dumps({"sql_query": data["sql_query"]}, ensure_ascii=False)
+    return json.dumps({"sql_query": None}, ensure_ascii=False)
+
+
+def _count_tokens(messages: list) -> int:
+    return sum(estimate_tokens(str(m.get("content", ""))) for m in messages)
+
+
+def compact_history(history: list, token_budget: int = None, keep_recent_turns: int = None):
+    """
+    返回 (压缩后的消息列表, 统计信息)。原始历史不会被修改。
+    最近 keep_recent_turns 轮原样保留；更早的轮次压缩为用户问题加 {"sql_query": ...}；
+    若仍超出预算，从最早的压缩轮次开始丢弃（当前问题所在的最后一轮始终保留）。
+    """
+    token_budget = token_budget or HISTORY_TOKEN_BUDGET
+    keep_recent_turns = HISTORY_KEEP_RECENT_TURNS if keep_recent_turns is None else keep_recent_turns
+    turns = _split_turns(history)
+    recent_start = max(0, len(turns) - max(1, keep_recent_turns))
+
+    compacted_turns = []
+    for i, turn in enumerate(turns):
+        if i >= recent_start:
+            compacted_turns.append(turn)
+        else:
+            compacted_turns.append([
+                m if m.get("role") != "assistant" else {"role": "assistant", "content": _compact_assistant(m.get("content"))}
+                for m in turn
+            ])
+
+    dropped_turns = 0
+    while len(compacted_turns) > 1 and _count_tokens([m for t in compacted_turns for m in t]) > token_budget \
+            and dropped_turns < recent_start:
+        compacted_turns.pop(0)
+        dropped_turns += 1
+
+    messages = [m for turn in compacted_turns for m in turn]
+    original_tokens = _count_tokens(history)
+    compacted_tokens = _count_tokens(messages)
+    stats = {
+        "turns": len(turns),
+        "compacted_turns": recent_start - dropped_turns,
+        "dropped_turns": dropped_turns,
+        "original_tokens": original_tokens,
+        "prompt_tokens": compacted_tokens,
+        "tokens_saved": original_tokens - compacted_tokens,
+    }
+    return messages, stats
@@ -0,0 +1,92 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from db import query_watchdog
+
+# 后台任务（智能报告）的并发数与已结束任务的保留时间
+JOB_MAX_WORKERS = int(os.getenv("JOB_MAX_WORKERS", "4"))
+JOB_RETENTION_SECONDS = int(os.getenv("JOB_RETENTION_SECONDS", "3600"))
+# UI 轮询任务状态的间隔（秒）
+JOB_POLL_INTERVAL_SECONDS = float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1.0"))
+
+FINISHED_STATUSES = ("DONE", "FAILED", "CANCELLED")
+
+_executor = ThreadPoolExecutor(max_workers=JOB_MAX_WORKERS, thread_name_prefix="analysis-job")
+_jobs = {}
+_jobs_lock = threading.Lock()
+
+
+def create_job(original_query: str, lang: str = 'zh', **fields) -> dict:
+    """创建并登记一个任务。任务以字典形式保存，工作线程更新它，Streamlit 脚本线程只读取它。"""
+    _prune_finished_jobs()
+    job = {
+        "job_id": uuid.uuid4().hex,
+        "job_status": "STARTED",
+        "original_query": original_query,
+        "lang": lang,
+        "stages": {},
+        "status_message": "智能报告任务已启动..." if lang == 'zh' else "Smart Report task initiated...",
+        "stage_info": "阶段 1/4：准备中..." if lang == 'zh' else "Stage 1/4: Preparing...",
+        "cancel_requested": False,
+        "created_at": time.time(),
+        "updated_at": time.time(),
+        **fields,
+    }
+    with _jobs_lock:
+        _jobs[job["job_id"]] = job
+    return job
+
+
+def submit_job(job: dict, target, *args):
+    """在进程级线程池中执行 target(job, *args)；未捕获的异常会把任务标记为 FAILED"""
+    def run():
+        try:
+            target(job, *args)
+        except Exception as e:
+            print(f"[Jobs] 任务 {job['job_id']} 异常终止: {e}")
+            update_job(job, job_status="FAILED", status_message=str(e))
+
+    _executor.submit(run)
+    print(f"[Jobs] 已提交任务 {job['job_id']}: {job['original_query']}")
+    return job
+
+
+def update_job(job: dict, **fields):
+    with _jobs_lock:
+        job.update(fields)
+        job["updated_at"] = time.time()
+
+
+def get_job(job_id: str) -> dict:
+    with _jobs_lock:
+        return _jobs.get(job_id)
+
+
+def is_job_finished(job: dict) -> bool:
+    return job.get("job_status") in FINISHED_STATUSES
+
+
+def is_cancel_requested(job_id: str) -> bool:
+    job = get_job(job_id)
+    return bool(job and job.get("cancel_requested"))
+
+
+def cancel_job(job_id: str) -> bool:
+    """请求取消任务：工作线程在阶段之间检查该标记，正在执行的 SQL 会被立即中止"""
+    job = get_job(job_id)
+    if job is None or is_job_finished(job):
+        return False
+    update_job(job, cancel_requested=True)
+    query_watchdog.cancel(job_id)
+    print(f"[Jobs] 已请求取消任务 {job_id}")
+    return True
+
+
+def _prune_finished_jobs():
+    cutoff = time.time() - JOB_RETENTION_SECONDS
+    with _jobs_lock:
+        for job_id in [i for i, j in _jobs.items() if is_job_finished(j) and j["updated_at"] < cutoff]:
+            del _jobs[job_id]
@@ -0,0 +1,121 @@
+import json
+import re
+
+_INCOMPLETE_ESCAPE = re.compile(r'\\u[0-9a-fA-F]{0,3}$')
+
+
+class IncrementalJSONParser:
+    """
+    增量解析流式输出的 JSON 对象：每次 feed 一段文本，返回其中新完成的顶层字段 [(key, value), ...]。
+    顶层对象之前/之后的内容（如 ```json 代码块标记）会被忽略。
+    正在输出中的顶层字符串值可通过 partial_string() 获取，用于边生成边显示。
+    """
+
+    def __init__(self):
+        self.buffer = ""
+        self.fields = {}
+        self.done = False
+        self._pos = 0
+        self._depth = 0
+        self._started = False
+        self._in_string = False
+        self._escape = False
+        # 顶层状态：key -> key_string -> colon -> value -> in_value -> comma -> key ...
+        self._expect = "key"
+        self._key = None
+        self._key_start = None
+        self._value_start = None
+        self._value_kind = None
+
+    def feed(self, chunk: str) -> list:
+        self.buffer += chunk
+        completed = []
+        buf = self.buffer
+        while self._pos < len(buf) and not self.done:
+            i = self._pos
+            ch = buf[i]
+            self._pos += 1
+
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._depth == 1 and self._expect == "key_string":
+                        self._key = self._loads(buf[self._key_start:i + 1])
+                        self._expect = "colon"
+                    elif self._depth == 1 and self._expect == "in_value" and self._value_kind == "string":
+                        self._emit(buf[self._value_start:i + 1], completed)
+                continue
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._expect == "key":
+                    self._key_start = i
+                    self._expect = "key_string"
+                elif self._depth == 1 and self._expect == "value":
+                    self._start_value(i, "string")
+            elif ch in "{[":
+                if self._depth == 1 and self._expect == "value":
+                    self._start_value(i, "container")
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 1 and self._expect == "in_value" and self._value_kind == "container":
+                    self._emit(buf[self._value_start:i + 1], completed)
+                elif self._depth == 0:
+                    if self._expect == "in_value" and self._value_kind == "scalar":
+                        self._emit(buf[self._value_start:i], completed)
+                    self.done = True
+            elif self._depth == 1:
+                if ch == ":" and self._expect == "colon":
+                    self._expect = "value"
+                elif ch == ",":
+                    if self._expect == "in_value" and self._value_kind == "scalar":
+                        self._emit(buf[self._value_start:i], completed)
+                    self._expect = "key"
+                elif not ch.isspace() and self._expect == "value":
+                    self._start_value(i, "scalar")
+        return completed
+
+    def partial_string(self):
+        """若当前正在输出一个顶层字符串值，返回 (key, 已输出的文本)，否则返回 None"""
+        if not (self._in_string and self._expect == "in_value" and self._value_kind == "string"):
+            return None
+        raw = self.buffer[self._value_start:]
+        if self._escape:
+            raw = raw[:-1]
+        raw = _INCOMPLETE_ESCAPE.sub("", raw)
+        try:
+            return self._key, json.loads(raw + '"')
+        except ValueError:
+            return None
+
+    def _start_value(self, index: int, kind: str):
+        self._value_start = index
+        self._value_kind = kind
+        self._expect = "in_value"
+
+    def _emit(self, text: str, completed: list):
+        self._expect = "comma"
+        try:
+            value = json.loads(text.strip())
+        except ValueError:
+            return
+        self.fields[self._key] = value
+        completed.append((self._key, value))
+
+    @staticmethod
+    def _loads(text: str):
+        try:
+            return json.loads(text)
+        except ValueError:
+            return text.strip('"')
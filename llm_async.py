@@ -0,0 +1,61 @@
+import asyncio
+import concurrent.futures
+import queue
+import threading
+
+_loop = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop() -> asyncio.AbstractEventLoop:
+    """进程级的后台事件循环，运行在独立的守护线程中；所有异步 LLM 调用都在这里执行"""
+    global _loop
+    if _loop is None:
+        with _loop_lock:
+            if _loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="llm-event-loop", daemon=True).start()
+                _loop = loop
+    return _loop
+
+
+def run_sync(coro, timeout: float = None):
+    """在后台事件循环中执行协程并阻塞等待结果（供同步代码调用，不能在事件循环线程内调用）"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop()).result(timeout)
+
+
+def submit(coro) -> concurrent.futures.Future:
+    """把协程提交到后台事件循环后立即返回 Future，可在任意线程中等待或取消；用于让多个独立的 LLM 调用并发执行"""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+
+def run_sync_with_events(coro_factory, poll_interval: float = 0.05):
+    """
+    与 run_sync 相同，但协程可以通过 emit(callback, *args) 请求回调；
+    回调在调用线程（例如 Streamlit 脚本线程）中依次执行，因此回调里可以安全地更新 UI。
+    coro_factory 接收 emit 并返回协程。
+    """
+    events = queue.Queue()
+
+    def emit(callback, *args):
+        events.put((callback, args))
+
+    future = asyncio.run_coroutine_threadsafe(coro_factory(emit), get_event_loop())
+    while True:
+        try:
+            callback, args = events.get(timeout=poll_interval)
+            callback(*args)
+        except queue.Empty:
+            if future.done():
+                break
+    while not events.empty():
+        callback, args = events.get_nowait()
+        callback(*args)
+    return future.result()
+
+
+def bridge(emit, callback):
+    """把调用线程中的回调包装成可在事件循环中调用的函数（回调为 None 时返回 None）"""
+    if callback is None:
+        return None
+    return lambda *args: emit(callback, *args)
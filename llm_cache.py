@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+# LLM 响应缓存（SQLite），按模型、温度、完整消息列表与 response_format 寻址
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1") == "1"
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH",
+                           os.path.join(os.getenv("BEAUTYYTICS_CACHE_DIR", ".cache"), "llm_cache.sqlite"))
+LLM_CACHE_TTL_SECONDS = int(os.getenv("LLM_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", str(100 * 1024 * 1024)))
+# 启用缓存的调用类型：call1（生成 SQL）、call2（数据分析）、planner、synthesizer
+LLM_CACHE_CALL_TYPES = {t.strip() for t in os.getenv("LLM_CACHE_CALL_TYPES", "call1,call2,planner,synthesizer").split(",")
+                        if t.strip()}
+
+# 参与寻址的请求参数；其余参数（如 stream）不影响响应内容
+_KEY_FIELDS = ("model", "temperature", "messages", "response_format", "extra_body")
+
+
+def make_llm_cache_key(request_kwargs: dict) -> str:
+    payload = {field: request_kwargs.get(field) for field in _KEY_FIELDS}
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str)
+                          .encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """
+    进程间共享的持久化 LLM 响应缓存。条目超过 TTL 即失效，
+    总大小超过上限时按最近访问时间淘汰（LRU）。命中率按调用类型分别统计。
+    """
+
+    def __init__(self, path: str, ttl_seconds: int, max_bytes: int, call_types: set):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self.call_types = call_types
+        self._con = None
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._con is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._con = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+            self._con.execute("PRAGMA journal_mode=WAL")
+            self._con.execute("""
+                CREATE TABLE IF NOT EXISTS llm_cache (
+                    key TEXT PRIMARY KEY, call_type TEXT, response TEXT,
+                    size INTEGER, created_at REAL, last_access REAL)
+            """)
+            self._con.execute("CREATE INDEX IF NOT EXISTS idx_llm_cache_access ON llm_cache (last_access)")
+            self._con.commit()
+        return self._con
+
+    def _count(self, call_type: str, name: str):
+        stats = self._stats.setdefault(call_type, {"hits": 0, "misses": 0, "stores": 0, "evictions": 0})
+        stats[name] += 1
+
+    def is_enabled(self, call_type: str) -> bool:
+        return LLM_CACHE_ENABLED and call_type in self.call_types
+
+    def get(self, call_type: str, key: str):
+        if not self.is_enabled(call_type):
+            return None
+        with self._lock:
+            try:
+                con = self._connection()
+                row = con.execute("SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if row and time.time() - row[1] <= self.ttl_seconds:
+                    con.execute("UPDATE llm_cache SET last_access = ? WHERE key = ?", (time.time(), key))
+                    con.commit()
+                    self._count(call_type, "hits")
+                    return row[0]
+                if row:
+                    con.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                    con.commit()
+            except sqlite3.Error as e:
+                print(f"[LLMCache] 读取缓存失败: {e}")
+            self._count(call_type, "misses")
+            return None
+
+    def put(self, call_type: str, key: str, response: str):
+        if not self.is_enabled(call_type) or not response:
+            return
+        size = len(response.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            try:
+                con = self._connection()
+                now = time.time()
+                con.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?, ?, ?, ?)",
+                            (key, call_type, response, size, now, now))
+                self._count(call_type, "stores")
+                self._evict(con)
+                con.commit()
+            except sqlite3.Error as e:
+                print(f"[LLMCache] 写入缓存失败: {e}")
+
+    def _evict(self, con: sqlite3.Connection):
+        con.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl_seconds,))
+        total = con.execute("SELECT COALESCE(SUM(size), 0) FROM llm_cache").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, call_type, size in con.execute(
+                "SELECT key, call_type, size FROM llm_cache ORDER BY last_access").fetchall():
+            if total <= self.max_bytes:
+                break
+            con.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+            total -= size
+            self._count(call_type, "evictions")
+
+    def stats(self) -> dict:
+        with self._lock:
+            result = {}
+            for call_type, stats in self._stats.items():
+                lookups = stats["hits"] + stats["misses"]
+                result[call_type] = {**stats, "hit_rate": stats["hits"] / lookups if lookups else 0.0}
+            try:
+                entries, total = self._connection().execute(
+                    "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM llm_cache").fetchone()
+                result["_storage"] = {"entries": entries, "bytes": total, "max_bytes": self.max_bytes}
+            except sqlite3.Error:
+                pass
+            return result
+
+    def clear(self):
+        with self._lock:
+            self._connection().execute("DELETE FROM llm_cache")
+            self._connection().commit()
+
+
+llm_response_cache = LLMResponseCache(LLM_CACHE_PATH, LLM_CACHE_TTL_SECONDS, LLM_CACHE_MAX_BYTES, LLM_CACHE_CALL_TYPES)
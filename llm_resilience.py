@@ -0,0 +1,176 @@
+import asyncio
+import os
+import random
+import threading
+import time
+
+import httpx
+import openai
+
+# 重试：对可重试错误做带抖动的指数退避
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_BACKOFF_BASE_SECONDS = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+LLM_BACKOFF_MAX_SECONDS = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+# 单次 LLM 调用（含全部重试）的总截止时间，0 表示不限制
+LLM_CALL_DEADLINE_SECONDS = float(os.getenv("LLM_CALL_DEADLINE_SECONDS", "120"))
+# 对冲请求：首个请求超过该时长仍未返回时再发一个相同请求，先返回者胜出；0 表示关闭
+LLM_HEDGE_AFTER_SECONDS = float(os.getenv("LLM_HEDGE_AFTER_SECONDS", "0"))
+# 熔断：连续失败达到阈值后在冷却期内直接失败，冷却结束后放行一个试探请求
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+_RETRYABLE_ERRORS = (
+    openai.APIConnectionError,  # 包含 APITimeoutError
+    openai.RateLimitError,
+    openai.InternalServerError,
+    httpx.TransportError,
+    asyncio.TimeoutError,
+)
+
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求未发出即失败"""
+
+
+class CircuitBreaker:
+    """closed -> open（连续失败达到阈值）-> half_open（冷却结束，放行一个试探请求）-> closed / open"""
+
+    def __init__(self, failure_threshold: int, reset_seconds: float):
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+        self._stats = {"opened": 0, "rejected": 0}
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._trial_in_flight = False
+            if self.state == "closed":
+                return True
+            if self.state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            self._stats["rejected"] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self.state = "closed"
+            self._trial_in_flight = False
+
+    def record_neutral(self):
+        """请求本身有误（如 400/401）：既不说明服务健康也不说明不健康，只释放试探名额"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self.state == "half_open" or self._failures >= self.failure_threshold:
+                if self.state != "open":
+                    self._stats["opened"] += 1
+                    print(f"[LLM Resilience] 熔断器打开，{self.reset_seconds:g} 秒内 LLM 请求将直接失败")
+                self.state = "open"
+                self._opened_at = time.monotonic()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"state": self.state, "consecutive_failures": self._failures, **self._stats}
+
+
+llm_circuit_breaker = CircuitBreaker(LLM_BREAKER_FAILURE_THRESHOLD, LLM_BREAKER_RESET_SECONDS)
+_stats = {"calls": 0, "retries": 0, "hedges": 0, "hedge_wins": 0, "failures": 0, "deadline_exceeded": 0}
+
+
+def is_retryable(error: Exception) -> bool:
+    return isinstance(error, _RETRYABLE_ERRORS)
+
+
+def backoff_delay(attempt: int) -> float:
+    """全抖动指数退避：在 [0, min(上限, 基数 * 2^attempt)] 内均匀取值"""
+    return random.uniform(0, min(LLM_BACKOFF_MAX_SECONDS, LLM_BACKOFF_BASE_SECONDS * (2 ** attempt)))
+
+
+async def _hedged(request_fn):
+    first = asyncio.ensure_future(request_fn())
+    done, _ = await asyncio.wait({first}, timeout=LLM_HEDGE_AFTER_SECONDS)
+    if done:
+        return first.result()
+    _stats["hedges"] += 1
+    second = asyncio.ensure_future(request_fn())
+    pending, error = {first, second}, None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                for other in pending:
+                    other.cancel()
+                if task is second:
+                    _stats["hedge_wins"] += 1
+                return task.result()
+            error = task.exception()
+    raise error
+
+
+async def call_with_resilience(request_fn, hedge: bool = True, retry_if=None, label: str = "LLM",
+                               deadline: float = None):
+    """
+    执行 request_fn()（返回协程的无参函数），失败时按退避策略重试，整体受截止时间限制，
+    并经过熔断器。hedge=False 用于不可重复的流式请求；retry_if() 返回 False 时不再重试
+    （例如流式输出已经开始推送给 UI）。
+    """
+    deadline = LLM_CALL_DEADLINE_SECONDS if deadline is None else deadline
+    _stats["calls"] += 1
+
+    async def attempts():
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            if not llm_circuit_breaker.allow():
+                raise CircuitOpenError(f"{label}: circuit breaker is open")
+            try:
+                if hedge and LLM_HEDGE_AFTER_SECONDS > 0:
+                    result = await _hedged(request_fn)
+                else:
+                    result = await request_fn()
+            except BaseException as e:
+                if isinstance(e, Exception) and not is_retryable(e):
+                    # 请求本身有误（如 400/401），不说明服务是否健康
+                    llm_circuit_breaker.record_neutral()
+                    raise
+                # 包括超过截止时间被 wait_for 取消（CancelledError）：必须记录失败，
+                # 否则半开状态的试探名额永远不会释放，之后的请求将全部被拒绝
+                llm_circuit_breaker.record_failure()
+                if not isinstance(e, Exception):
+                    raise
+                if attempt >= LLM_MAX_RETRIES or (retry_if is not None and not retry_if()):
+                    raise
+                delay = backoff_delay(attempt)
+                _stats["retries"] += 1
+                print(f"[LLM Resilience] {label} 第 {attempt + 1} 次请求失败 ({type(e).__name__}: {e})，"
+                      f"{delay:.2f} 秒后重试")
+                await asyncio.sleep(delay)
+                continue
+            llm_circuit_breaker.record_success()
+            return result
+
+    try:
+        if deadline and deadline > 0:
+            return await asyncio.wait_for(attempts(), deadline)
+        return await attempts()
+    except asyncio.TimeoutError:
+        _stats["deadline_exceeded"] += 1
+        _stats["failures"] += 1
+        raise
+    except Exception:
+        _stats["failures"] += 1
+        raise
+
+
+def get_resilience_stats() -> dict:
+    return {**_stats, "circuit_breaker": llm_circuit_breaker.stats()}
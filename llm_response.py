@@ -1,14 +1,25 @@
-from asyncio import base_events
+import asyncio
 import json
 import os
 import pandas as pd
 import streamlit as st
-from openai import OpenAI, OpenAIError
-
+import threading
+
+import httpx
+from openai import AsyncOpenAI
+
+from json_stream import IncrementalJSONParser
+from llm_async import bridge, run_sync, run_sync_with_events, submit
+from llm_cache import llm_response_cache, make_llm_cache_key
+from llm_resilience import call_with_resilience
+from llm_scheduler import DEFAULT_PRIORITIES, LLM_EXPECTED_COMPLETION_TOKENS, PRIORITY_INTERACTIVE, llm_scheduler
+from serialize import estimate_tokens, serialize_frame
+from singleflight import AsyncSingleFlight
+from summarize import summarize_result
 from prompt.prompt import DATABASE_SCHEMA_DESCRIPTION, FULL_SYSTEM_PROMPT
 from prompt.prompt_en import DATABASE_SCHEMA_DESCRIPTION_EN
 
-global_base_url = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+global_base_url = os.getenv("LLM_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
 global_model_name = "qwen3-30b-a3b"
 
 api_key = os.getenv("DASHSCOPE_API_KEY")
@@ -18,36 +29,165 @@ if not api_key and hasattr(st, 'secrets') and "DASHSCOPE_API_KEY" in st.secrets:
 if not api_key:
     raise ValueError("No DASHSCOPE_API_KEY found. Please configure it in environment variables or Streamlit secrets.")
 
-client = OpenAI(
-    api_key=api_key,
-    base_url=global_base_url,
-)
+# HTTP connection pool and timeouts shared by every LLM call in the process
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))
+LLM_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("LLM_MAX_KEEPALIVE_CONNECTIONS", "10"))
+LLM_KEEPALIVE_EXPIRY_SECONDS = float(os.getenv("LLM_KEEPALIVE_EXPIRY_SECONDS", "60"))
+LLM_CONNECT_TIMEOUT_SECONDS = float(os.getenv("LLM_CONNECT_TIMEOUT_SECONDS", "10"))
+LLM_READ_TIMEOUT_SECONDS = float(os.getenv("LLM_READ_TIMEOUT_SECONDS", "120"))
+
+_async_client = None
+_client_lock = threading.Lock()
+
+
+def _http_limits() -> httpx.Limits:
+    return httpx.Limits(max_connections=LLM_MAX_CONNECTIONS,
+                        max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+                        keepalive_expiry=LLM_KEEPALIVE_EXPIRY_SECONDS)
+
+
+def _http_timeout() -> httpx.Timeout:
+    return httpx.Timeout(LLM_READ_TIMEOUT_SECONDS, connect=LLM_CONNECT_TIMEOUT_SECONDS)
+
+
+def get_async_llm_client() -> AsyncOpenAI:
+    """
+    Process-wide AsyncOpenAI client used by the async pipeline. The underlying httpx pool keeps
+    connections alive, so calls after the first one skip the TCP/TLS handshake. It must only be used
+    on the background event loop (see llm_async.get_event_loop), which all LLM calls are scheduled on.
+    """
+    global _async_client
+    if _async_client is None:
+        with _client_lock:
+            if _async_client is None:
+                http_client = httpx.AsyncClient(limits=_http_limits(), timeout=_http_timeout())
+                # Retries are handled by llm_resilience, so the SDK's own retries are disabled
+                _async_client = AsyncOpenAI(api_key=api_key, base_url=global_base_url, http_client=http_client,
+                                            max_retries=0)
+                print(f"[LLM] Created shared async client for {global_base_url} "
+                      f"(max_connections={LLM_MAX_CONNECTIONS}, keepalive={LLM_MAX_KEEPALIVE_CONNECTIONS})")
+    return _async_client
+
+# Upper bound for the evidence JSON sent to the synthesizer (data samples plus digests)
+SYNTHESIZER_EVIDENCE_MAX_CHARS = int(os.getenv("SYNTHESIZER_EVIDENCE_MAX_CHARS", "16000"))
+
+llm_singleflight = AsyncSingleFlight("llm")
+
+# Stream completions (stream=True) when the caller asks for progressive field callbacks
+LLM_STREAMING_ENABLED = os.getenv("LLM_STREAMING_ENABLED", "1") == "1"
 
 
-def get_llm_response_structured(conversation_history_for_llm: list,
+async def acreate_completion_text(call_type: str = None, on_field=None, on_partial=None,
+                                  priority: int = None, user: str = None, **request_kwargs) -> str:
+    """
+    Run a chat completion on the background event loop and return the raw response text.
+    When on_field/on_partial are given (and streaming is enabled) the response is streamed and parsed
+    incrementally: on_field(key, value) fires as soon as a top-level JSON field is complete,
+    on_partial(key, text) fires while a top-level string value is still being generated.
+    call_type ('call1', 'call2', 'planner', 'synthesizer') selects the response cache bucket;
+    a cache hit skips the network and replays the fields to on_field.
+    Requests are admitted by the process-wide llm_scheduler (concurrency cap, requests/tokens per minute,
+    priority classes and per-user round robin); priority defaults by call_type and user is usually the
+    Streamlit session ID. Every request goes through the retry / deadline / hedging / circuit breaker
+    policy in llm_resilience.
+    """
+    cache_key = make_llm_cache_key(request_kwargs) if call_type and llm_response_cache.is_enabled(call_type) else None
+    if cache_key:
+        cached_text = await asyncio.to_thread(llm_response_cache.get, call_type, cache_key)
+        if cached_text is not None:
+            print(f"[LLM Cache] Hit for {call_type}")
+            if on_field:
+                for key, value in IncrementalJSONParser().feed(cached_text):
+                    on_field(key, value)
+            return cached_text
+
+    llm_client = get_async_llm_client()
+    streaming = LLM_STREAMING_ENABLED and (on_field is not None or on_partial is not None)
+    progress = {"streamed": False}
+    if priority is None:
+        priority = DEFAULT_PRIORITIES.get(call_type, PRIORITY_INTERACTIVE)
+    estimated_tokens = LLM_EXPECTED_COMPLETION_TOKENS + sum(
+        estimate_tokens(str(m.get("content", ""))) for m in request_kwargs.get("messages", []))
+
+    async def request():
+        parser = IncrementalJSONParser()
+        async with llm_scheduler.slot(priority, user, estimated_tokens) as grant:
+            if not streaming:
+                completion = await llm_client.chat.completions.create(**request_kwargs)
+                if getattr(completion, "usage", None) is not None:
+                    grant["actual_tokens"] = completion.usage.total_tokens
+                response_text = completion.choices[0].message.content.strip()
+                parser.feed(response_text)
+                return response_text, parser
+            stream = await llm_client.chat.completions.create(stream=True, **request_kwargs)
+            async for chunk in stream:
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if not delta:
+                    continue
+                progress["streamed"] = True
+                for key, value in parser.feed(delta):
+                    if on_field:
+                        on_field(key, value)
+                if on_partial:
+                    partial = parser.partial_string()
+                    if partial:
+                        on_partial(*partial)
+            return parser.buffer.strip(), parser
+
+    async def execute():
+        # Streams are not hedged, and are only retried before any output has reached the callbacks
+        response_text, parser = await call_with_resilience(
+            request, hedge=not streaming, retry_if=lambda: not progress["streamed"], label=call_type or "LLM")
+        # Only complete JSON objects are cached, so a malformed response is retried next time
+        if cache_key and parser.done:
+            await asyncio.to_thread(llm_response_cache.put, call_type, cache_key, response_text)
+        return response_text
+
+    # Identical requests already in flight share one upstream call; followers get the fields replayed
+    flight_key = f"{call_type}:{cache_key or make_llm_cache_key(request_kwargs)}"
+    response_text, shared = await llm_singleflight.do(flight_key, execute)
+    if shared:
+        print(f"[LLM] Coalesced with an identical in-flight {call_type or 'LLM'} request")
+        if on_field:
+            for key, value in IncrementalJSONParser().feed(response_text):
+                on_field(key, value)
+    return response_text
+
+
+def create_completion_text(call_type: str = None, on_field=None, on_partial=None, **request_kwargs) -> str:
+    """Synchronous wrapper around acreate_completion_text; callbacks run on the calling thread."""
+    return run_sync_with_events(lambda emit: acreate_completion_text(
+        call_type, on_field=bridge(emit, on_field), on_partial=bridge(emit, on_partial), **request_kwargs))
+
+
+def clean_sql_query(sql_query: str) -> str:
+    """Strip surrounding whitespace and ```sql fences from a generated query."""
+    sql_query = sql_query.strip()
+    if sql_query.startswith("```sql"):
+        sql_query = sql_query[len("```sql"):].strip()
+    if sql_query.endswith("```"):
+        sql_query = sql_query[:-len("```")].strip()
+    return sql_query
+
+
+async def get_llm_response_structured_async(conversation_history_for_llm: list,
                                 system_prompt_content: str,
                                 model_name: str = global_model_name,
                                 active_analysis_framework_prompt: str = None,
-                                lang: str = 'zh'):
+                                lang: str = 'zh',
+                                on_field=None,
+                                priority: int = None,
+                                user: str = None):
     """
     Get structured response from LLM with language support
     Args:
         lang: 'zh' for Chinese, 'en' for English
+        on_field: optional callback fired as each top-level field is streamed, e.g. to start
+                  running `sql_query` before the rest of the response has been generated
+        priority / user: scheduling class and fairness key, see acreate_completion_text
     """
-    api_key = os.getenv("DASHSCOPE_API_KEY")
-    if not api_key and hasattr(st, 'secrets') and "DASHSCOPE_API_KEY" in st.secrets:
-        api_key = st.secrets["DASHSCOPE_API_KEY"]
-
-    if not api_key:
-        print(
-            "Error: [LLM Call 1] DASHSCOPE_API_KEY not found. Please configure it in environment variables or Streamlit secrets.")
-        return None
-
-    client = OpenAI(
-        api_key=api_key,
-        base_url=global_base_url,
-    )
-
     messages_for_api = [
         {"role": "system", "content": system_prompt_content}
     ]
@@ -87,14 +227,16 @@ def get_llm_response_structured(conversation_history_for_llm: list,
 
     try:
         print(f"Sending request to LLM ({model_name}) (LLM Call 1 - expecting SQL and preliminary suggestions)...")
-        completion = client.chat.completions.create(
+        raw_response_content = await acreate_completion_text(
+            call_type="call1",
+            priority=priority,
+            user=user,
+            on_field=on_field,
             model=model_name,
             messages=messages_for_api,
             temperature=0.0,
             extra_body={"enable_thinking": False},
         )
-
-        raw_response_content = completion.choices[0].message.content.strip()
         print(f"[LLM Call 1] LLM raw response: {raw_response_content}")
 
         cleaned_response_content = raw_response_content
@@ -132,13 +274,7 @@ def get_llm_response_structured(conversation_history_for_llm: list,
             return None
 
         if "sql_query" in llm_output and isinstance(llm_output["sql_query"], str):
-            sql_query = llm_output["sql_query"].strip()
-
-            if sql_query.startswith("```sql"):
-                sql_query = sql_query[len("```sql"):].strip()
-            if sql_query.endswith("```"):
-                sql_query = sql_query[:-len("```")].strip()
-            llm_output["sql_query"] = sql_query
+            llm_output["sql_query"] = clean_sql_query(llm_output["sql_query"])
 
         return llm_output
 
@@ -150,15 +286,19 @@ def get_llm_response_structured(conversation_history_for_llm: list,
         return None
 
 
-def get_final_analysis_and_chart_details(
+async def get_final_analysis_and_chart_details_async(
         data_df: pd.DataFrame,
         user_query_for_analysis: str,
         active_analysis_framework_prompt: str = None,
         base_data_analysis_prompt_template: str = None,
         data_caveats_instructions: str = None,
         model_name: str = global_model_name,
-        max_tokens_data_representation: int = 4000,
-        lang: str = 'zh'
+        max_tokens_data_representation: int = None,
+        lang: str = 'zh',
+        on_field=None,
+        on_partial=None,
+        priority: int = None,
+        user: str = None
 ):
     print(f"\nLanguage for analysis: {lang}\n")
 
@@ -166,28 +306,17 @@ def get_final_analysis_and_chart_details(
     Perform second LLM call with language support
     Args:
         lang: 'zh' for Chinese, 'en' for English
+        on_field / on_partial: optional streaming callbacks, see acreate_completion_text
+        priority / user: scheduling class and fairness key, see acreate_completion_text
     """
 
+    analysis_prefix = ""
     try:
-        analysis_prefix = ""
-        # if data_df.shape[0] > 50:
-        #     df_for_analysis = data_df.head(50)
-        #     analysis_prefix = f"Note: The original data result contains {data_df.shape[0]} rows. For analysis efficiency, only the first 50 rows are used here.\n\n" if lang == 'en' else f"注意：原始数据结果包含 {data_df.shape[0]} 行，为提高分析效率，此处仅基于前50行数据进行分析。\n\n"
-        # else:
-        #     df_for_analysis = data_df
-        df_for_analysis = data_df
-
-        data_string = df_for_analysis.to_markdown(index=False)
-        current_length = len(data_string)
-        if current_length > max_tokens_data_representation:
-            cutoff_point = data_string.rfind('\n', 0, max_tokens_data_representation)
-            data_string = data_string[:cutoff_point if cutoff_point != -1 else max_tokens_data_representation]
-            data_string += "\n... (data truncated due to length limit)" if lang == 'en' else "\n... (数据因长度限制被截断)"
-            print(f"Warning: [LLM Call 2] Data for LLM analysis was truncated. Original length: {current_length}")
+        # Compact CSV within a token budget; large results become column statistics plus a row sample
+        data_string = serialize_frame(data_df, max_tokens_data_representation, lang=lang)
     except Exception as e:
-        print(f"Error: [LLM Call 2] Error converting DataFrame to markdown: {e}")
-        data_string = str(
-            data_df.head()) if 'data_df' in locals() else "Data conversion failed" if lang == 'en' else "数据转换失败"
+        print(f"Error: [LLM Call 2] Error serializing DataFrame: {e}")
+        data_string = str(data_df.head()) if data_df is not None else "Data conversion failed" if lang == 'en' else "数据转换失败"
 
     if lang == 'zh':
         system_message_for_call2 = (
@@ -235,7 +364,7 @@ def get_final_analysis_and_chart_details(
             analysis_guidance_section = "Please strictly follow the requirements of the above analysis framework and analyze the actual data below to prepare the report section."
     elif base_data_analysis_prompt_template:
         analysis_guidance_section = (
-                base_data_analysis_prompt_template.replace("{data_format}", "markdown table")
+                base_data_analysis_prompt_template.replace("{data_format}", "CSV")
                 .replace("{data_string}", "")
                 .replace("This is the data content:", "")
                 .replace("Please provide your analysis:", "").strip()
@@ -252,11 +381,26 @@ def get_final_analysis_and_chart_details(
             prompt_sections.append(
                 "【General Analysis Guidance】\nPlease provide a concise English text analysis and interpretation of the actual data provided below, focusing on key insights, trends, or findings valuable to business users.")
 
+    truncation_note = ""
+    if data_df.attrs.get("truncated"):
+        total_rows = data_df.attrs.get("total_rows") or "?"
+        returned_rows = data_df.attrs.get("returned_rows", len(data_df))
+        truncation_note = (f"注意：完整查询结果共 {total_rows} 行，超出结果上限，以下数据仅为前 {returned_rows} 行，分析结论需说明这一点。\n"
+                           if lang == 'zh' else
+                           f"Note: the full query result has {total_rows} rows and exceeded the result limit; the data below is only the first {returned_rows} rows. Mention this in your analysis.\n")
+
+    # Digest computed locally over every returned row; its size does not depend on the row count
+    digest_text = summarize_result(data_df)
+    if digest_text:
+        prompt_sections.append(
+            f"【数据摘要（基于全部结果行计算，包含合计、趋势、集中度与异常值）】\n{digest_text}" if lang == 'zh' else
+            f"【Data Digest (computed over all result rows: totals, trends, concentration, outliers)】\n{digest_text}")
+
     if lang == 'zh':
-        prompt_sections.append(f"【实际查询数据】\n以下是根据用户先前请求查询得到的数据（Markdown格式）:\n{data_string}")
+        prompt_sections.append(f"【实际查询数据】\n{truncation_note}以下是根据用户先前请求查询得到的数据（CSV格式，结果较大时附带基于全部数据的列统计）:\n{data_string}")
     else:
         prompt_sections.append(
-            f"【Actual Queried Data】\nHere is the data obtained from the user's previous request (in Markdown format):\n{data_string}")
+            f"【Actual Queried Data】\n{truncation_note}Here is the data obtained from the user's previous request (CSV; large results include column statistics over all rows):\n{data_string}")
 
     if data_caveats_instructions:
         prompt_sections.append(
@@ -306,13 +450,17 @@ def get_final_analysis_and_chart_details(
 
     try:
         print(f"Sending data to LLM ({model_name}) for analysis and final chart recommendations (LLM Call 2)...")
-        completion = client.chat.completions.create(
+        raw_response_content = await acreate_completion_text(
+            call_type="call2",
+            priority=priority,
+            user=user,
+            on_field=on_field,
+            on_partial=on_partial,
             model=model_name,
             messages=messages_for_api,
             temperature=0.3,
             extra_body={"enable_thinking": False},
         )
-        raw_response_content = completion.choices[0].message.content.strip()
         print(f"[LLM Call 2] LLM raw response: {raw_response_content}")
 
         cleaned_response_content = raw_response_content
@@ -379,7 +527,7 @@ PLANNER_PROMPT_ZH = """
 
 ## Background
 The user posed a question based on the database schema: “{original_query}”.
-An initial query has been executed, and the following is the returned data summary (in Markdown format):
+An initial query has been executed, and the following is the returned data summary (CSV, with column statistics over all rows when the result is large):
 {data_summary}
 
 ## Goals
@@ -431,7 +579,7 @@ Based on the schema and rules provided above, your new task is to act as a senio
 
 # Context
 The user has asked a general question: "{original_query}".
-An initial query has been run, and here is a summary of the data returned (in markdown format):
+An initial query has been run, and here is a summary of the data returned (CSV, with column statistics over all rows when the result is large):
 {data_summary}
 
 # Goal
@@ -475,7 +623,7 @@ SYNTHESIZER_PROMPT_ZH = """
 - Proficient in organizing structured output using Markdown and chart parameters.
 
 ## Background
-The user initially proposed a business goal: "{original_query}". To achieve this, a series of data analyses were conducted. Below is all the collected data evidence during the analysis process (provided in JSON format, each evidence includes its analytical purpose and data content in Markdown format).
+The user initially proposed a business goal: "{original_query}". To achieve this, a series of data analyses were conducted. Below is all the collected data evidence during the analysis process (provided in JSON format, each evidence includes its analytical purpose and data content as compact CSV, with column statistics when the result is large).
 
 ## Data Evidence
 {evidence_json}
@@ -540,7 +688,7 @@ You are a master data storyteller and business strategist. Your job is to synthe
 
 # Context
 The user's original objective was: "{original_query}".
-To answer this, a multi-step analysis was conducted. You have been provided with all the data evidence collected. Each piece of data is keyed and contains its original purpose and the data itself in markdown format.
+To answer this, a multi-step analysis was conducted. You have been provided with all the data evidence collected. Each piece of data is keyed and contains its original purpose and the data itself as compact CSV (with column statistics when the result is large).
 
 # Data Evidence
 {evidence_json}
@@ -588,7 +736,8 @@ Your entire output must be a single, valid JSON object that represents the final
 """
 
 
-def get_analysis_plan(original_query: str, data_summary_df: pd.DataFrame, full_system_prompt: str, lang: str = 'en'):
+async def get_analysis_plan_async(original_query: str, data_summary_df: pd.DataFrame, full_system_prompt: str, lang: str = 'en',
+                                  priority: int = None, user: str = None):
     print("Requesting analysis plan from LLM (Stage 2)...")
 
     if lang == 'zh':
@@ -596,10 +745,7 @@ def get_analysis_plan(original_query: str, data_summary_df: pd.DataFrame, full_s
     else:
         prompt_template = PLANNER_PROMPT_EN
 
-    data_summary_str = data_summary_df.to_markdown(index=False)
-
-    if len(data_summary_str) > 4000:
-        data_summary_str = data_summary_str[:4000] + "\n... (data truncated)"
+    data_summary_str = serialize_frame(data_summary_df, lang=lang)
 
     # print(f"[LLM Planner] Data summary length: {len(data_summary_str)} characters")
     # print(f"full_system_prompt:{full_system_prompt}\n original_query:{original_query}\n data_summary_str:{data_summary_str}")
@@ -613,14 +759,16 @@ def get_analysis_plan(original_query: str, data_summary_df: pd.DataFrame, full_s
 
     raw_response = ""
     try:
-        completion = client.chat.completions.create(
+        raw_response = await acreate_completion_text(
+            call_type="planner",
+            priority=priority,
+            user=user,
             model=global_model_name,
             messages=messages_for_api,
             temperature=0.1,
             response_format={"type": "json_object"},
             extra_body={"enable_thinking": False},
         )
-        raw_response = completion.choices[0].message.content.strip()
         print(f"[LLM Planner] Raw response: {raw_response}")
 
         cleaned_response = raw_response
@@ -636,14 +784,15 @@ def get_analysis_plan(original_query: str, data_summary_df: pd.DataFrame, full_s
         return None
 
 
-def get_synthesized_report(original_query: str, evidence_data_map: dict, lang: str = 'en'):
+async def get_synthesized_report_async(original_query: str, evidence_data_map: dict, lang: str = 'en',
+                                       priority: int = None, user: str = None):
     """
     Calls the LLM to synthesize a final report from multiple pieces of evidence.
 
     Args:
         original_query (str): The user's initial question.
         evidence_data_map (dict): A dictionary where keys are evidence IDs and values
-                                  are dicts containing purpose and markdown data.
+                                  are dicts containing purpose and serialized data (data_text).
     """
     print("Requesting synthesized report from LLM (Stage 4)...")
     if lang == 'zh':
@@ -652,14 +801,16 @@ def get_synthesized_report(original_query: str, evidence_data_map: dict, lang: s
         prompt_template = SYNTHESIZER_PROMPT_EN
 
     evidence_for_prompt = {
-        key: {"purpose": value["purpose"], "data": value.get("data_markdown", "No data available.")}
+        key: {"purpose": value["purpose"], "data": value.get("data_text", "No data available."),
+              **({"digest": value["digest"]} if value.get("digest") else {}),
+              **({"analysis": value["analysis"]} if value.get("analysis") else {})}
         for key, value in evidence_data_map.items()
     }
     evidence_json_str = json.dumps(evidence_for_prompt, indent=2, ensure_ascii=False)
 
-    if len(evidence_json_str) > 8000:
+    if len(evidence_json_str) > SYNTHESIZER_EVIDENCE_MAX_CHARS:
         print(f"Warning: Evidence data is very long ({len(evidence_json_str)} chars) and may be truncated.")
-        evidence_json_str = evidence_json_str[:8000] + "\n... (evidence truncated)"
+        evidence_json_str = evidence_json_str[:SYNTHESIZER_EVIDENCE_MAX_CHARS] + "\n... (evidence truncated)"
 
     all_columns = set()
     for evidence in evidence_data_map.values():
@@ -676,17 +827,49 @@ def get_synthesized_report(original_query: str, evidence_data_map: dict, lang: s
 
     raw_response = ""
     try:
-        completion = client.chat.completions.create(
+        raw_response = await acreate_completion_text(
+            call_type="synthesizer",
+            priority=priority,
+            user=user,
             model=global_model_name,
             messages=messages_for_api,
             temperature=0.3,
             response_format={"type": "json_object"},
             extra_body={"enable_thinking": False},
         )
-        raw_response = completion.choices[0].message.content.strip()
         print(f"[LLM Synthesizer] Raw response: {raw_response}")
         return json.loads(raw_response)
     except Exception as e:
         print(f"Error getting synthesized report from LLM: {e}")
         print(f"Problematic raw response: {raw_response}")
-        return None
\ No newline at end of file
+        return None
+
+
+# Synchronous entry points: thin wrappers that run the async implementations on the
+# background event loop. Streaming callbacks are delivered on the calling thread.
+
+def get_llm_response_structured(*args, on_field=None, **kwargs):
+    return run_sync_with_events(lambda emit: get_llm_response_structured_async(
+        *args, on_field=bridge(emit, on_field), **kwargs))
+
+
+def get_final_analysis_and_chart_details(*args, on_field=None, on_partial=None, **kwargs):
+    return run_sync_with_events(lambda emit: get_final_analysis_and_chart_details_async(
+        *args, on_field=bridge(emit, on_field), on_partial=bridge(emit, on_partial), **kwargs))
+
+
+def start_final_analysis(*args, **kwargs):
+    """
+    Start Call 2 on the background event loop without waiting and return a concurrent.futures.Future.
+    Several analyses started this way run concurrently (bounded by llm_scheduler), so the caller waits
+    roughly as long as the slowest one instead of their sum. No streaming callbacks.
+    """
+    return submit(get_final_analysis_and_chart_details_async(*args, **kwargs))
+
+
+def get_analysis_plan(*args, **kwargs):
+    return run_sync(get_analysis_plan_async(*args, **kwargs))
+
+
+def get_synthesized_report(*args, **kwargs):
+    return run_sync(get_synthesized_report_async(*args, **kwargs))
@@ -0,0 +1,181 @@
+import asyncio
+import contextlib
+import os
+import time
+from collections import OrderedDict, deque
+
+# 进程级 LLM 调度：并发上限 + 每分钟请求数/令牌数的令牌桶（0 表示不限制）
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_REQUESTS_PER_MINUTE = int(os.getenv("LLM_REQUESTS_PER_MINUTE", "60"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "100000"))
+# 估算单次调用令牌数时为输出预留的量
+LLM_EXPECTED_COMPLETION_TOKENS = int(os.getenv("LLM_EXPECTED_COMPLETION_TOKENS", "800"))
+
+# 优先级：数值越小越优先。交互式问答（Call 1 / Call 2）优先于智能报告的各阶段
+PRIORITY_INTERACTIVE = 0
+PRIORITY_REPORT = 1
+PRIORITY_NAMES = {PRIORITY_INTERACTIVE: "interactive", PRIORITY_REPORT: "report"}
+DEFAULT_PRIORITIES = {"call1": PRIORITY_INTERACTIVE, "call2": PRIORITY_INTERACTIVE,
+                      "planner": PRIORITY_REPORT, "synthesizer": PRIORITY_REPORT}
+
+
+class TokenBucket:
+    """容量为每分钟额度、按秒匀速补充的令牌桶；rate_per_minute 为 0 时不限制"""
+
+    def __init__(self, rate_per_minute: int):
+        self.capacity = float(rate_per_minute)
+        self.level = float(rate_per_minute)
+        self.rate_per_second = rate_per_minute / 60.0
+        self._updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self._updated) * self.rate_per_second)
+        self._updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """距离可以取出 amount 个令牌还需等待的秒数（超过容量的请求按容量计算，避免永远等待）"""
+        if self.capacity <= 0:
+            return 0.0
+        self._refill()
+        amount = min(amount, self.capacity)
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate_per_second
+
+    def consume(self, amount: float):
+        if self.capacity > 0:
+            self._refill()
+            self.level -= min(amount, self.capacity)
+
+    def adjust(self, delta: float):
+        """按实际用量修正（delta 为实际值减估算值，可为负；余额允许暂时为负）"""
+        if self.capacity > 0:
+            self.level = min(self.capacity, self.level - delta)
+
+
+class LLMScheduler:
+    """
+    运行在 LLM 事件循环中的调度器。请求按优先级出队；同一优先级内按用户轮转，
+    避免单个用户的大量请求（如多个智能报告）占满额度。出队还需满足并发上限与两个令牌桶。
+    """
+
+    def __init__(self, max_concurrency: int, requests_per_minute: int, tokens_per_minute: int):
+        self.max_concurrency = max_concurrency
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+        # priority -> OrderedDict(user -> deque[(future, tokens, enqueued_at)])
+        self._queues = {}
+        self._in_flight = 0
+        self._wakeup = None
+        self._dispatcher = None
+        self._stats = {}
+
+    def _priority_stats(self, priority: int) -> dict:
+        return self._stats.setdefault(PRIORITY_NAMES.get(priority, str(priority)),
+                                      {"admitted": 0, "total_wait_seconds": 0.0, "max_wait_seconds": 0.0,
+                                       "max_queue_depth": 0})
+
+    def _ensure_dispatcher(self):
+        if self._wakeup is None:
+            self._wakeup = asyncio.Event()
+        if self._dispatcher is None or self._dispatcher.done():
+            self._dispatcher = asyncio.ensure_future(self._dispatch())
+
+    def _queue_depth(self, priority: int) -> int:
+        return sum(len(q) for q in self._queues.get(priority, {}).values())
+
+    @contextlib.asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_INTERACTIVE, user: str = None, estimated_tokens: int = 0):
+        """async with scheduler.slot(...) as grant: —— 排队直到被放行，退出时释放并发名额"""
+        self._ensure_dispatcher()
+        future = asyncio.get_running_loop().create_future()
+        entry = (future, estimated_tokens, time.monotonic())
+        users = self._queues.setdefault(priority, OrderedDict())
+        users.setdefault(user or "anonymous", deque()).append(entry)
+        stats = self._priority_stats(priority)
+        stats["max_queue_depth"] = max(stats["max_queue_depth"], self._queue_depth(priority))
+        self._wakeup.set()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()
+            else:
+                self._remove(priority, user or "anonymous", entry)
+            raise
+        grant = {"estimated_tokens": estimated_tokens}
+        try:
+            yield grant
+        finally:
+            if grant.get("actual_tokens") is not None:
+                self.token_bucket.adjust(grant["actual_tokens"] - estimated_tokens)
+            self._release()
+
+    def _remove(self, priority: int, user: str, entry):
+        queue = self._queues.get(priority, {}).get(user)
+        if queue and entry in queue:
+            queue.remove(entry)
+            if not queue:
+                del self._queues[priority][user]
+
+    def _release(self):
+        self._in_flight -= 1
+        self._wakeup.set()
+
+    def _next_entry(self):
+        for priority in sorted(self._queues):
+            users = self._queues[priority]
+            if users:
+                user = next(iter(users))
+                return priority, user, users[user][0]
+        return None
+
+    async def _dispatch(self):
+        while True:
+            self._wakeup.clear()
+            candidate = self._next_entry()
+            if candidate is None or self._in_flight >= self.max_concurrency:
+                await self._wakeup.wait()
+                continue
+            priority, user, (future, tokens, enqueued_at) = candidate
+            wait = max(self.request_bucket.wait_time(1), self.token_bucket.wait_time(tokens))
+            if wait > 0:
+                # 等待令牌补充；期间有更高优先级请求到达或名额释放时提前重新选择
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                continue
+
+            users = self._queues[priority]
+            users[user].popleft()
+            # 轮转：当前用户移到队尾
+            if users[user]:
+                users.move_to_end(user)
+            else:
+                del users[user]
+            if future.done():
+                continue
+            self.request_bucket.consume(1)
+            self.token_bucket.consume(tokens)
+            self._in_flight += 1
+            waited = time.monotonic() - enqueued_at
+            stats = self._priority_stats(priority)
+            stats["admitted"] += 1
+            stats["total_wait_seconds"] += waited
+            stats["max_wait_seconds"] = max(stats["max_wait_seconds"], waited)
+            future.set_result(True)
+
+    def stats(self) -> dict:
+        """队列深度与等待时间指标（在任意线程读取均可，数值为近似快照）"""
+        result = {"in_flight": self._in_flight, "max_concurrency": self.max_concurrency,
+                  "request_tokens_available": round(self.request_bucket.level, 1),
+                  "llm_tokens_available": round(self.token_bucket.level, 1)}
+        for priority in sorted(set(self._queues) | set(PRIORITY_NAMES)):
+            name = PRIORITY_NAMES.get(priority, str(priority))
+            stats = dict(self._priority_stats(priority))
+            stats["queue_depth"] = self._queue_depth(priority)
+            stats["waiting_users"] = len(self._queues.get(priority, {}))
+            stats["avg_wait_seconds"] = stats["total_wait_seconds"] / stats["admitted"] if stats["admitted"] else 0.0
+            result[name] = stats
+        return result
+
+
+llm_scheduler = LLMScheduler(LLM_MAX_CONCURRENCY, LLM_REQUESTS_PER_MINUTE, LLM_TOKENS_PER_MINUTE)
@@ -1,45 +1,368 @@
+import hashlib
+import json
+import os
+import re
+
+import duckdb
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
 import altair as alt
 from typing import List, Dict, Union
 
+from data_profile import DATA_PROFILE_ENABLED, build_data_profile
+from db import close_connection_pool, connect_duckdb, get_connection_pool
+from prompt.prompt import DATABASE_SCHEMA_DESCRIPTION
+from rollup import ROLLUP_ENABLED, build_rollups, load_rollups
+from value_index import VALUE_INDEX_ENABLED, build_value_index
 
-@st.cache_data
-def load_data():
-    CSV_COLUMN_NAMES = [
-        "order_no", "order_time", "order_date", "brand_code", "program_code",
-        "order_type", "sales", "item_qty", "item_price", "channel",
-        "subchannel", "sub_subchannel", "material_code", "material_name_cn",
-        "material_type", "merged_c_code", "tier_code", "first_order_date",
-        "is_mtd_active_member_flag", "ytd_active_arr", "r12_active_arr",
-        "manager_counter_code", "ba_code", "province_name", "line_city_name",
-        "line_city_level", "store_no", "terminal_name", "terminal_code",
-        "terminal_region", "default_flag"
-    ]
-    try:
-        df = pd.read_csv(
-            "random_order_data.csv", sep=";", encoding='gbk',
-            header=None, names=CSV_COLUMN_NAMES
-        )
-        df.columns = [col.lower() for col in df.columns]
-
-        if 'order_time' in df.columns:
-            df['order_time'] = pd.to_datetime(df['order_time'], errors='coerce')
-        if 'order_date' in df.columns:
-            df['order_date'] = pd.to_datetime(df['order_date'], errors='coerce')
-
-        numeric_cols = ['sales', 'item_qty', 'item_price']
-        for col in numeric_cols:
-            if col in df.columns:
-                df[col] = pd.to_numeric(df[col].astype(str).str.replace(',', '.'), errors='coerce')
-
-        print(f"数据加载完成。列名: {df.columns.tolist()}")
-        return df
-    except FileNotFoundError:
-        st.error("错误: CSV数据文件 'random_order_data.csv' 未找到。请确保文件路径正确。")
+CSV_PATH = "random_order_data.csv"
+CACHE_DIR = os.getenv("BEAUTYYTICS_CACHE_DIR", ".cache")
+# 'pandas': pandas 解析 + 列式缓存；'duckdb': 由 DuckDB 并行 read_csv 直接入库，不保留 pandas 副本；
+# 'duckdb_file': 构建持久化的 .duckdb 文件，查询通过只读连接执行，可被多个 Streamlit 进程共享
+DATA_LOAD_MODE = os.getenv("BEAUTYYTICS_LOAD_MODE", "pandas").lower()
+DUCKDB_DATABASE_PATH = os.getenv("BEAUTYYTICS_DUCKDB_PATH", os.path.join(CACHE_DIR, "random_order_data.duckdb"))
+
+CSV_COLUMN_NAMES = [
+    "order_no", "order_time", "order_date", "brand_code", "program_code",
+    "order_type", "sales", "item_qty", "item_price", "channel",
+    "subchannel", "sub_subchannel", "material_code", "material_name_cn",
+    "material_type", "merged_c_code", "tier_code", "first_order_date",
+    "is_mtd_active_member_flag", "ytd_active_arr", "r12_active_arr",
+    "manager_counter_code", "ba_code", "province_name", "line_city_name",
+    "line_city_level", "store_no", "terminal_name", "terminal_code",
+    "terminal_region", "default_flag"
+]
+
+# 指纹只哈希文件首尾各 1MB，避免每次启动都完整读取数 GB 的 CSV
+_FINGERPRINT_SAMPLE_BYTES = 1 << 20
+_fingerprint_memo = {}
+
+
+def get_source_fingerprint(path: str = CSV_PATH) -> str:
+    """根据文件大小、修改时间和首尾内容哈希生成数据源指纹（即数据集版本号）"""
+    stat = os.stat(path)
+    stat_key = (os.path.abspath(path), stat.st_size, stat.st_mtime_ns)
+    if stat_key in _fingerprint_memo:
+        return _fingerprint_memo[stat_key]
+
+    digest = hashlib.sha1(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    with open(path, "rb") as f:
+        digest.update(f.read(_FINGERPRINT_SAMPLE_BYTES))
+        if stat.st_size > _FINGERPRINT_SAMPLE_BYTES:
+            f.seek(max(_FINGERPRINT_SAMPLE_BYTES, stat.st_size - _FINGERPRINT_SAMPLE_BYTES))
+            digest.update(f.read(_FINGERPRINT_SAMPLE_BYTES))
+    fingerprint = digest.hexdigest()
+    _fingerprint_memo[stat_key] = fingerprint
+    return fingerprint
+
+
+# DATABASE_SCHEMA_DESCRIPTION 中的类型 -> DuckDB 类型
+_DUCKDB_TYPE_MAP = {
+    "TEXT": "VARCHAR",
+    "TIMESTAMP": "TIMESTAMP",
+    "DATE": "DATE",
+    "DECIMAL": "DOUBLE",
+    "INTEGER": "BIGINT",
+}
+META_TABLE = "_dataset_meta"
+
+
+def get_duckdb_schema() -> Dict[str, str]:
+    """由 CSV_COLUMN_NAMES 和 DATABASE_SCHEMA_DESCRIPTION 中声明的类型构建显式的 DuckDB 表结构"""
+    declared = dict(re.findall(r'^- "(\w+)" \((\w+)\)', DATABASE_SCHEMA_DESCRIPTION, re.MULTILINE))
+    return {col: _DUCKDB_TYPE_MAP.get(declared.get(col, "TEXT"), "VARCHAR") for col in CSV_COLUMN_NAMES}
+
+
+def _sql_literal(value: str) -> str:
+    return "'" + str(value).replace("'", "''") + "'"
+
+
+class EncodingsExtensionError(RuntimeError):
+    """DuckDB 的 encodings 扩展无法安装或加载（通常是离线环境无法下载），无法按 GBK 解码 CSV"""
+
+
+def ingest_csv_duckdb(con: duckdb.DuckDBPyConnection, path: str = CSV_PATH, table: str = "df_data",
+                      order_by: str = None):
+    """
+    使用 DuckDB 的并行 read_csv 直接把 CSV 解析为原生表。
+    所有列先按 VARCHAR 读入，再按显式类型 TRY_CAST（与 pandas 路径的 errors='coerce' 一致），
+    数值列中的小数逗号替换为小数点。GBK 解码由 encodings 扩展提供，
+    扩展无法安装或加载时抛出 EncodingsExtensionError。
+    指定 order_by 时按该列排序写入，使行组的 min/max 统计（zone map）可用于裁剪范围过滤。
+    """
+    try:
+        con.execute("INSTALL encodings; LOAD encodings;")
+    except duckdb.Error as e:
+        raise EncodingsExtensionError(
+            f"无法安装或加载 DuckDB encodings 扩展（首次使用需联网下载），无法按 GBK 解码 CSV: {e}") from e
+
+    projections = []
+    for col, col_type in get_duckdb_schema().items():
+        if col_type == "VARCHAR":
+            projections.append(f'"{col}"')
+        elif col_type == "DOUBLE":
+            projections.append(f'TRY_CAST(REPLACE("{col}", \',\', \'.\') AS DOUBLE) AS "{col}"')
+        elif col_type == "BIGINT":
+            projections.append(f'TRY_CAST(TRY_CAST(REPLACE("{col}", \',\', \'.\') AS DOUBLE) AS BIGINT) AS "{col}"')
+        else:
+            projections.append(f'TRY_CAST("{col}" AS {col_type}) AS "{col}"')
+    raw_columns = ", ".join(f"'{col}': 'VARCHAR'" for col in CSV_COLUMN_NAMES)
+    order_clause = f'ORDER BY "{order_by}"' if order_by else ""
+
+    con.execute(f"""
+        CREATE OR REPLACE TABLE "{table}" AS
+        SELECT {", ".join(projections)}
+        FROM read_csv({_sql_literal(path)}, delim=';', header=false, encoding='gbk',
+                      quote='"', columns={{{raw_columns}}}, parallel=true)
+        {order_clause}
+    """)
+
+
+def _write_dataset_meta(con: duckdb.DuckDBPyConnection, fingerprint: str):
+    con.execute(f'CREATE OR REPLACE TABLE "{META_TABLE}" (fingerprint VARCHAR, row_count BIGINT)')
+    con.execute(f'INSERT INTO "{META_TABLE}" SELECT ?, COUNT(*) FROM "df_data"', [fingerprint])
+
+
+def _read_dataset_fingerprint(db_path: str):
+    """读取持久化数据库中记录的数据源指纹；文件不存在或损坏时返回 None"""
+    if not os.path.exists(db_path):
         return None
+    try:
+        con = connect_duckdb(db_path, read_only=True)
+        try:
+            row = con.execute(f'SELECT fingerprint FROM "{META_TABLE}"').fetchone()
+        finally:
+            con.close()
+        return row[0] if row else None
+    except duckdb.Error:
+        return None
+
+
+def build_duckdb_database(db_path: str, fingerprint: str, path: str = CSV_PATH):
+    """
+    构建持久化的 .duckdb 文件：df_data 为按 order_date 排序的原生表，并收集统计信息。
+    先写入临时文件再原子替换，已打开旧文件的只读连接不受影响。
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    tmp_path = f"{db_path}.{os.getpid()}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    con = connect_duckdb(tmp_path, read_only=False)
+    try:
+        ingest_csv_duckdb(con, path, order_by="order_date")
+        _write_dataset_meta(con, fingerprint)
+        if ROLLUP_ENABLED:
+            build_rollups(con, fingerprint)
+        try:
+            con.execute('ANALYZE "df_data"')
+        except duckdb.Error as e:
+            print(f"[load_data] ANALYZE 失败（不影响查询）: {e}")
+        con.execute("CHECKPOINT")
+    finally:
+        con.close()
+    os.replace(tmp_path, db_path)
+    print(f"[load_data] 已构建持久化 DuckDB 数据库: {db_path}")
+
+
+def _cache_paths(path: str):
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return (os.path.join(CACHE_DIR, f"{stem}.arrow"),
+            os.path.join(CACHE_DIR, f"{stem}.meta.json"))
+
+
+def _read_csv_frame(path: str) -> pd.DataFrame:
+    # 文本列统一按 str 读入：分块推断类型时同一列可能混入 int 与 str，Arrow 无法写出这样的列
+    text_columns = [col for col, col_type in get_duckdb_schema().items() if col_type == "VARCHAR"]
+    df = pd.read_csv(
+        path, sep=";", encoding='gbk',
+        header=None, names=CSV_COLUMN_NAMES,
+        dtype={col: str for col in text_columns}
+    )
+    df.columns = [col.lower() for col in df.columns]
+
+    if 'order_time' in df.columns:
+        df['order_time'] = pd.to_datetime(df['order_time'], errors='coerce')
+    if 'order_date' in df.columns:
+        df['order_date'] = pd.to_datetime(df['order_date'], errors='coerce')
+
+    numeric_cols = ['sales', 'item_qty', 'item_price']
+    for col in numeric_cols:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col].astype(str).str.replace(',', '.'), errors='coerce')
+    return df
+
+
+def _arrow_string_dtype(arrow_type):
+    if pa.types.is_string(arrow_type) or pa.types.is_large_string(arrow_type):
+        return pd.ArrowDtype(arrow_type)
+    return None
+
+
+def _read_columnar_cache(path: str, fingerprint: str):
+    """缓存存在且指纹一致时，以内存映射方式读取 Arrow IPC 缓存；否则返回 None"""
+    cache_file, meta_file = _cache_paths(path)
+    try:
+        with open(meta_file, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if meta.get("fingerprint") != fingerprint or not os.path.exists(cache_file):
+        return None
+    try:
+        table = feather.read_table(cache_file, memory_map=True)
+        # 文本列保持为 Arrow 支持的 ArrowDtype，直接引用内存映射的缓冲区，不逐行转换为 Python 字符串对象
+        return table.to_pandas(split_blocks=True, types_mapper=_arrow_string_dtype)
+    except Exception as e:
+        print(f"[load_data] 列式缓存读取失败，将重新解析 CSV: {e}")
+        return None
+
+
+def _write_columnar_cache(path: str, fingerprint: str, df: pd.DataFrame):
+    """将清洗后的数据写为未压缩的 Arrow IPC 文件（可直接 mmap），并写入指纹元数据"""
+    cache_file, meta_file = _cache_paths(path)
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        tmp_file = f"{cache_file}.tmp"
+        feather.write_feather(df, tmp_file, compression="uncompressed")
+        os.replace(tmp_file, cache_file)
+        tmp_meta = f"{meta_file}.tmp"
+        with open(tmp_meta, "w", encoding="utf-8") as f:
+            json.dump({"source": os.path.abspath(path), "fingerprint": fingerprint, "rows": len(df)}, f)
+        os.replace(tmp_meta, meta_file)
+    except Exception as e:
+        print(f"[load_data] 写入列式缓存失败（不影响本次加载）: {e}")
+
+
+def _build_frame_rollups(df: pd.DataFrame, fingerprint: str):
+    """pandas 模式下在默认连接池的数据库中为该 DataFrame 构建汇总表"""
+    pool = get_connection_pool()
+    try:
+        pool.connection.register('df_data', df)
+        pool.rollups = build_rollups(pool.connection, fingerprint)
+    except Exception as e:
+        print(f"[load_data] 构建汇总表失败，查询将直接使用 df_data: {e}")
+    finally:
+        pool.connection.unregister('df_data')
+
+
+def _build_data_profile(data_source):
+    """统计写入提示词的数据概况；失败时提示词中不含数据概况，不影响数据加载"""
+    try:
+        build_data_profile(data_source)
+    except Exception as e:
+        print(f"[load_data] 统计数据概况失败，提示词中将不包含数据概况: {e}")
+
+
+def _build_value_index(data_source):
+    """构建问题取值匹配所用的索引；失败时只影响取值匹配，不影响数据加载"""
+    try:
+        build_value_index(data_source)
+    except Exception as e:
+        print(f"[load_data] 构建取值索引失败，问题中的取值将不做匹配: {e}")
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _load_order_frame(fingerprint: str):
+    try:
+        df = _read_columnar_cache(CSV_PATH, fingerprint)
+        if df is not None:
+            print(f"数据从列式缓存加载完成 ({len(df)} 行)。")
+        else:
+            df = _read_csv_frame(CSV_PATH)
+            _write_columnar_cache(CSV_PATH, fingerprint, df)
+            # 写入成功后改用内存映射的缓存，首次加载与之后的冷启动得到相同的列类型
+            cached_df = _read_columnar_cache(CSV_PATH, fingerprint)
+            if cached_df is not None:
+                df = cached_df
+            print(f"数据加载完成。列名: {df.columns.tolist()}")
+        df.attrs["data_version"] = fingerprint
+        if ROLLUP_ENABLED:
+            _build_frame_rollups(df, fingerprint)
+        if VALUE_INDEX_ENABLED:
+            _build_value_index(df)
+        if DATA_PROFILE_ENABLED:
+            _build_data_profile(df)
+        return df
     except Exception as e:
         st.error(f"加载数据时发生未知错误: {e}")
         return None
 
 
+def _fall_back_to_frame(fingerprint: str, error: Exception):
+    """
+    DuckDB 无法解码 CSV 时改用 pandas 加载，保证离线环境仍可使用。
+    返回 (DataFrame, 提示信息)；提示由 load_data 在缓存函数之外显示，每个会话都能看到。
+    """
+    print(f"[load_data] {error}；改用 pandas 加载数据")
+    return _load_order_frame(fingerprint), f"{error}。已改用 pandas 加载数据。"
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _load_order_database(fingerprint: str):
+    try:
+        pool = get_connection_pool(':memory:')
+        ingest_csv_duckdb(pool.connection, CSV_PATH)
+        _write_dataset_meta(pool.connection, fingerprint)
+        if ROLLUP_ENABLED:
+            pool.rollups = build_rollups(pool.connection, fingerprint)
+        pool.data_version = fingerprint
+        if VALUE_INDEX_ENABLED:
+            _build_value_index(pool)
+        if DATA_PROFILE_ENABLED:
+            _build_data_profile(pool)
+        print("数据已由 DuckDB 直接加载为原生表 df_data。")
+        return pool, None
+    except EncodingsExtensionError as e:
+        return _fall_back_to_frame(fingerprint, e)
+    except Exception as e:
+        st.error(f"DuckDB 加载数据时发生未知错误: {e}")
+        return None, None
+
+
+@st.cache_resource(max_entries=1, show_spinner=False)
+def _open_order_database_file(fingerprint: str):
+    try:
+        if _read_dataset_fingerprint(DUCKDB_DATABASE_PATH) != fingerprint:
+            # 先释放旧文件上的连接，重建后重新打开
+            close_connection_pool(DUCKDB_DATABASE_PATH)
+            build_duckdb_database(DUCKDB_DATABASE_PATH, fingerprint)
+        pool = get_connection_pool(DUCKDB_DATABASE_PATH, read_only=True)
+        pool.rollups = load_rollups(pool.connection) if ROLLUP_ENABLED else []
+        pool.data_version = fingerprint
+        if VALUE_INDEX_ENABLED:
+            _build_value_index(pool)
+        if DATA_PROFILE_ENABLED:
+            _build_data_profile(pool)
+        print(f"数据库文件已以只读方式打开: {DUCKDB_DATABASE_PATH}")
+        return pool, None
+    except EncodingsExtensionError as e:
+        return _fall_back_to_frame(fingerprint, e)
+    except Exception as e:
+        st.error(f"打开 DuckDB 数据库文件时发生未知错误: {e}")
+        return None, None
+
+
+def load_data():
+    """
+    加载订单数据。
+    - pandas 模式（默认）：首次解析 CSV 后会把清洗好的数据写入列式缓存，
+      之后的冷启动直接内存映射缓存文件；CSV 发生变化时缓存自动重建。返回 DataFrame。
+    - duckdb 模式：由 DuckDB 并行解析 CSV 为原生表 df_data，返回持有该表的连接池（ConnectionPool）。
+    - duckdb_file 模式：CSV 变化时重建持久化 .duckdb 文件，返回该文件上长期存活的只读连接池。
+    - 两种 duckdb 模式下 encodings 扩展不可用（如离线）时回退到 pandas 模式。
+    """
+    try:
+        fingerprint = get_source_fingerprint(CSV_PATH)
+    except FileNotFoundError:
+        st.error("错误: CSV数据文件 'random_order_data.csv' 未找到。请确保文件路径正确。")
+        return None
+    if DATA_LOAD_MODE in ("duckdb", "duckdb_file"):
+        loader = _load_order_database if DATA_LOAD_MODE == "duckdb" else _open_order_database_file
+        # 两个 DuckDB 加载函数返回 (数据, 回退提示)：缓存命中时函数体不会执行，提示必须在这里显示
+        data, fallback_warning = loader(fingerprint)
+        if fallback_warning:
+            st.warning(fallback_warning)
+        return data
+    return _load_order_frame(fingerprint)
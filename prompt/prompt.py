@@ -115,8 +115,8 @@ DATABASE_SCHEMA_DESCRIPTION = """
 - 根据自然语言问题，生成针对 "df_data" 表的 DuckDB 兼容SQL查询。
 - 使用双引号包裹列名，表名始终为 "df_data"。
 - 涉及日期时，尽量使用标准日期函数或 ISO 8601 格式 (YYYY-MM-DD)。
-- 对“上个月”“本周”等相对日期，优先使用 DuckDB 支持的函数（如 NOW()、CURRENT_DATE）计算日期范围。
-- 如无法确定当前日期，请生成带参数的SQL，或提示需提供当前日期信息。
+- 对“上个月”“本周”等相对日期，以数据的最新日期作为当前日期计算日期范围：提示中有【数据概况】时直接使用其中的截止日期（写成 DATE 'YYYY-MM-DD'），否则使用子查询 (SELECT MAX("order_date") FROM "df_data")。
+- 不要使用 NOW()、CURRENT_DATE 等系统当前日期，也无需向用户询问当前日期。
 """
 
 
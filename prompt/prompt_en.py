@@ -117,8 +117,8 @@ Guidelines:
 - Generate DuckDB-compatible SQL queries on the "df_data" table based on natural language questions.
 - Always wrap column names in double quotes and fix table name as "df_data".
 - Use standard date functions or ISO 8601 format (YYYY-MM-DD) for date-related filters.
-- For relative dates like "last month" or "this week", prioritize DuckDB functions such as NOW(), CURRENT_DATE.
-- If current date is unknown, generate parameterized SQL or prompt for the current date.
+- For relative dates like "last month" or "this week", treat the latest date in the data as the current date: use the end date from the [Data profile] when one is provided (as DATE 'YYYY-MM-DD'), otherwise the subquery (SELECT MAX("order_date") FROM "df_data").
+- Do not use NOW(), CURRENT_DATE or other system dates, and do not ask the user for the current date.
 """
 
 
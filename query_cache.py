@@ -0,0 +1,217 @@
+import hashlib
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+QUERY_CACHE_ENABLED = os.getenv("QUERY_CACHE_ENABLED", "1") == "1"
+QUERY_CACHE_MAX_BYTES = int(os.getenv("QUERY_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+# 磁盘层为可选项，目录为空时不启用
+QUERY_CACHE_DIR = os.getenv("QUERY_CACHE_DIR", "")
+QUERY_CACHE_DISK_MAX_BYTES = int(os.getenv("QUERY_CACHE_DISK_MAX_BYTES", str(2 * 1024 * 1024 * 1024)))
+
+# 结果随时间或随机变化的查询不缓存
+_NON_DETERMINISTIC = re.compile(
+    r"\b(now|current_date|current_timestamp|current_time|today|random|uuid|gen_random_uuid|setseed)\b",
+    re.IGNORECASE)
+
+
+# 字符串字面量、带引号的标识符与注释；字面量和标识符原样保留，注释替换为空白
+_SQL_TOKEN = re.compile(r"('(?:[^']|'')*'|\"(?:[^\"]|\"\")*\")|--[^\n]*|/\*.*?\*/", re.DOTALL)
+
+
+def normalize_sql(sql_query: str) -> str:
+    """
+    去掉注释与末尾分号并压缩空白。先识别字符串字面量再去注释，字面量中的 "--" 不会被误删；
+    不改变大小写，别名（AS TotalSales）决定结果列名，大小写不同的查询不能共享缓存。
+    """
+    normalized = []
+    plain = ""
+    pos = 0
+    for match in _SQL_TOKEN.finditer(sql_query):
+        plain += sql_query[pos:match.start()]
+        pos = match.end()
+        if match.group(1):
+            normalized.append(re.sub(r"\s+", " ", plain))
+            normalized.append(match.group(1))
+            plain = ""
+        else:
+            plain += " "
+    normalized.append(re.sub(r"\s+", " ", plain + sql_query[pos:]))
+    return "".join(normalized).strip().rstrip(";").strip()
+
+
+def make_query_key(sql_query: str, data_version: str) -> str:
+    digest = hashlib.sha256(normalize_sql(sql_query).encode("utf-8")).hexdigest()
+    return f"{data_version[:16]}_{digest[:40]}"
+
+
+def is_cacheable_sql(sql_query: str) -> bool:
+    return not _NON_DETERMINISTIC.search(sql_query)
+
+
+_ATTRS_METADATA_KEY = b"beautyytics_attrs"
+
+
+def _frame_to_table(result_df: pd.DataFrame) -> pa.Table:
+    """DataFrame 转 Arrow 表，并把 df.attrs（截断标记、总行数等）写入 schema 元数据"""
+    table = pa.Table.from_pandas(result_df, preserve_index=False)
+    if result_df.attrs:
+        metadata = dict(table.schema.metadata or {})
+        metadata[_ATTRS_METADATA_KEY] = json.dumps(result_df.attrs, default=str).encode("utf-8")
+        table = table.replace_schema_metadata(metadata)
+    return table
+
+
+def _table_to_frame(table: pa.Table) -> pd.DataFrame:
+    result_df = table.to_pandas()
+    raw_attrs = (table.schema.metadata or {}).get(_ATTRS_METADATA_KEY)
+    if raw_attrs:
+        result_df.attrs.update(json.loads(raw_attrs))
+    return result_df
+
+
+class QueryResultCache:
+    """
+    进程内共享的查询结果缓存。键为规范化 SQL + 数据集版本，值以 Arrow 表保存；
+    内存层按字节数做 LRU 淘汰，可选的磁盘层保存 Arrow IPC 文件。
+    数据集版本变化时，旧版本的条目会被整体清除。
+    """
+
+    def __init__(self, max_bytes: int, disk_dir: str = "", disk_max_bytes: int = 0):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._data_version = None
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0, "stores": 0, "invalidations": 0}
+
+    def _disk_path(self, key: str) -> str:
+        return os.path.join(self.disk_dir, f"{key}.arrow")
+
+    def _switch_version(self, data_version: str):
+        """数据重新加载后清空旧版本的内存条目与磁盘文件"""
+        if self._data_version == data_version:
+            return
+        if self._data_version is not None:
+            self._entries.clear()
+            self._bytes = 0
+            self._stats["invalidations"] += 1
+            if self.disk_dir and os.path.isdir(self.disk_dir):
+                prefix = f"{data_version[:16]}_"
+                for name in os.listdir(self.disk_dir):
+                    if name.endswith(".arrow") and not name.startswith(prefix):
+                        try:
+                            os.remove(os.path.join(self.disk_dir, name))
+                        except OSError:
+                            pass
+        self._data_version = data_version
+
+    def _insert(self, key: str, table: pa.Table):
+        size = table.nbytes
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._bytes -= self._entries.pop(key).nbytes
+        self._entries[key] = table
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= evicted.nbytes
+            self._stats["evictions"] += 1
+
+    def get(self, sql_query: str, data_version: str):
+        if not data_version or not is_cacheable_sql(sql_query):
+            return None
+        key = make_query_key(sql_query, data_version)
+        with self._lock:
+            self._switch_version(data_version)
+            table = self._entries.get(key)
+            if table is not None:
+                self._entries.move_to_end(key)
+                self._stats["hits"] += 1
+                return _table_to_frame(table)
+
+        if self.disk_dir and os.path.exists(self._disk_path(key)):
+            try:
+                table = feather.read_table(self._disk_path(key), memory_map=True)
+                os.utime(self._disk_path(key))
+                with self._lock:
+                    self._insert(key, table)
+                    self._stats["disk_hits"] += 1
+                return _table_to_frame(table)
+            except Exception as e:
+                print(f"[QueryCache] 读取磁盘缓存失败: {e}")
+
+        with self._lock:
+            self._stats["misses"] += 1
+        return None
+
+    def put(self, sql_query: str, data_version: str, result_df: pd.DataFrame):
+        if not data_version or result_df is None or not is_cacheable_sql(sql_query):
+            return
+        key = make_query_key(sql_query, data_version)
+        try:
+            table = _frame_to_table(result_df)
+        except Exception as e:
+            print(f"[QueryCache] 结果无法转换为 Arrow，跳过缓存: {e}")
+            return
+        with self._lock:
+            self._switch_version(data_version)
+            self._insert(key, table)
+            self._stats["stores"] += 1
+        if self.disk_dir:
+            self._write_disk(key, table)
+
+    def _write_disk(self, key: str, table: pa.Table):
+        try:
+            os.makedirs(self.disk_dir, exist_ok=True)
+            tmp_path = f"{self._disk_path(key)}.{threading.get_ident()}.tmp"
+            feather.write_feather(table, tmp_path, compression="lz4")
+            os.replace(tmp_path, self._disk_path(key))
+            self._prune_disk()
+        except Exception as e:
+            print(f"[QueryCache] 写入磁盘缓存失败: {e}")
+
+    def _prune_disk(self):
+        files = []
+        for name in os.listdir(self.disk_dir):
+            if name.endswith(".arrow"):
+                path = os.path.join(self.disk_dir, name)
+                stat = os.stat(path)
+                files.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["disk_hits"] + self._stats["misses"]
+            return {
+                **self._stats,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "hit_rate": (self._stats["hits"] + self._stats["disk_hits"]) / lookups if lookups else 0.0,
+            }
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+
+query_result_cache = QueryResultCache(QUERY_CACHE_MAX_BYTES, QUERY_CACHE_DIR, QUERY_CACHE_DISK_MAX_BYTES)
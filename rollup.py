@@ -0,0 +1,241 @@
+import os
+import re
+
+import duckdb
+
+ROLLUP_ENABLED = os.getenv("ROLLUP_ENABLED", "1") == "1"
+ROLLUP_META_TABLE = "_rollup_meta"
+
+# 日粒度汇总表。order_level 表示所有维度都是订单级属性（一个订单只落在一行中），
+# 此时 COUNT(DISTINCT "order_no") 可以由各行 order_count 相加得到。
+ROLLUP_DEFINITIONS = [
+    {"name": "rollup_daily",
+     "dimensions": ["order_date", "order_type"], "order_level": True},
+    {"name": "rollup_daily_region_channel",
+     "dimensions": ["order_date", "order_type", "province_name", "line_city_level", "channel"], "order_level": True},
+    {"name": "rollup_daily_member_channel",
+     "dimensions": ["order_date", "order_type", "channel", "tier_code"], "order_level": True},
+    {"name": "rollup_daily_product_channel",
+     "dimensions": ["order_date", "order_type", "channel", "material_type", "brand_code"], "order_level": False},
+    {"name": "rollup_daily_all",
+     "dimensions": ["order_date", "order_type", "province_name", "line_city_level", "channel",
+                    "material_type", "brand_code", "tier_code"], "order_level": False},
+]
+
+# 汇总表中的度量列：sales / item_qty 与原表同名（存的是合计值），因此 SUM("sales") 无需改写
+ADDITIVE_MEASURES = ("sales", "item_qty")
+
+_STRING_LITERAL = re.compile(r"('(?:[^']|'')*')")
+_DF_DATA_REF = re.compile(r'(?<![\w."])("df_data"|df_data)(?![\w"])', re.IGNORECASE)
+_COUNT_DISTINCT_ORDER = re.compile(r'\bcount\s*\(\s*distinct\s+"?order_no"?\s*\)', re.IGNORECASE)
+_COUNT_ROWS = re.compile(r'\bcount\s*\(\s*(\*|1)\s*\)', re.IGNORECASE)
+# 依赖明细行、无法由汇总表还原的聚合/窗口函数
+_UNSUPPORTED = re.compile(
+    r"\b(avg|mean|median|mode|stddev\w*|var_\w+|variance|quantile\w*|percentile\w*|string_agg|list|array_agg|"
+    r"first|last|any_value|arg_max|arg_min|argmax|argmin|max_by|min_by|approx_\w+|corr|covar\w*|regr_\w+|"
+    r"product|entropy|kurtosis|skewness|histogram|bool_and|bool_or|over|join|union|intersect|except|with|"
+    r"using|qualify|sample|tablesample)\b",
+    re.IGNORECASE)
+
+
+def _rollup_select_sql(rollup: dict, source: str = '"df_data"') -> str:
+    dims = ", ".join(f'"{d}"' for d in rollup["dimensions"])
+    return f"""
+        SELECT {dims},
+               SUM("sales") AS "sales",
+               SUM("item_qty") AS "item_qty",
+               COUNT(*) AS "line_count",
+               COUNT(DISTINCT "order_no") AS "order_count"
+        FROM {source}
+        GROUP BY {dims}
+        ORDER BY "order_date"
+    """
+
+
+def build_rollups(con: duckdb.DuckDBPyConnection, data_version: str) -> list:
+    """
+    在 con 所在数据库中（要求 df_data 在该连接上可见）构建全部汇总表，
+    并把元数据写入 _rollup_meta。返回可用汇总表列表，供 rewrite_query 使用。
+    """
+    rollups = []
+    for rollup in ROLLUP_DEFINITIONS:
+        try:
+            con.execute(f'CREATE OR REPLACE TABLE "{rollup["name"]}" AS {_rollup_select_sql(rollup)}')
+            row_count = con.execute(f'SELECT COUNT(*) FROM "{rollup["name"]}"').fetchone()[0]
+            rollups.append({**rollup, "row_count": row_count, "data_version": data_version})
+        except duckdb.Error as e:
+            print(f"[Rollup] 构建汇总表 {rollup['name']} 失败: {e}")
+    con.execute(f'CREATE OR REPLACE TABLE "{ROLLUP_META_TABLE}" '
+                f'(name VARCHAR, dimensions VARCHAR[], order_level BOOLEAN, row_count BIGINT, data_version VARCHAR)')
+    for rollup in rollups:
+        con.execute(f'INSERT INTO "{ROLLUP_META_TABLE}" VALUES (?, ?, ?, ?, ?)',
+                    [rollup["name"], rollup["dimensions"], rollup["order_level"],
+                     rollup["row_count"], data_version])
+    print(f"[Rollup] 已构建 {len(rollups)} 张汇总表: "
+          + ", ".join(f"{r['name']}({r['row_count']} 行)" for r in rollups))
+    return sorted(rollups, key=lambda r: r["row_count"])
+
+
+def load_rollups(con: duckdb.DuckDBPyConnection) -> list:
+    """从 _rollup_meta 读取已构建的汇总表（用于只读打开的持久化数据库文件）"""
+    try:
+        rows = con.execute(f'SELECT name, dimensions, order_level, row_count, data_version '
+                           f'FROM "{ROLLUP_META_TABLE}" ORDER BY row_count').fetchall()
+    except duckdb.Error:
+        return []
+    return [{"name": r[0], "dimensions": list(r[1]), "order_level": r[2], "row_count": r[3],
+             "data_version": r[4]} for r in rows]
+
+
+_MEASURE_EXPR = re.compile(r'"?(sales|item_qty)"?')
+_MEASURE_NAME = re.compile(r'\b(sales|item_qty)\b')
+_CASE_KEYWORDS = re.compile(r"\b(case|when|then|else|end)\b")
+
+
+def _is_rollup_sum_argument(body: str) -> bool:
+    """
+    汇总表中的度量是预先求和的结果，SUM 只能作用在度量列本身，逐行表达式（SUM(1)、SUM("sales" - 1)、
+    SUM(ABS("sales")) 等）在汇总表上结果不同。允许的形式：
+    - 度量列本身，如 SUM("sales")
+    - CASE 条件只涉及维度列、各分支只返回同一个度量列或 0/NULL，如 SUM(CASE WHEN "order_type" = '0' THEN "sales" ELSE 0 END)
+    body 为已屏蔽字符串字面量并转为小写的参数文本。
+    """
+    body = body.strip()
+    if _MEASURE_EXPR.fullmatch(body):
+        return True
+    tokens = [t.strip() for t in _CASE_KEYWORDS.split(body) if t.strip()]
+    if len(tokens) < 5 or tokens[0] != "case" or tokens[-1] != "end":
+        return False
+    measures = set()
+
+    def is_result(expr: str) -> bool:
+        match = _MEASURE_EXPR.fullmatch(expr)
+        if match:
+            measures.add(match.group(1))
+            return True
+        return expr in ("0", "null")
+
+    i = 1
+    if tokens[i] != "when":
+        # 简单 CASE："CASE <维度表达式> WHEN ... THEN ..."
+        if _CASE_KEYWORDS.fullmatch(tokens[i]) or _MEASURE_NAME.search(tokens[i]):
+            return False
+        i += 1
+    branches = 0
+    while i + 3 < len(tokens) and tokens[i] == "when" and tokens[i + 2] == "then":
+        condition, result = tokens[i + 1], tokens[i + 3]
+        if _CASE_KEYWORDS.fullmatch(condition) or _MEASURE_NAME.search(condition) or not is_result(result):
+            return False
+        branches += 1
+        i += 4
+    if branches == 0:
+        return False
+    if tokens[i] == "else":
+        if i + 1 >= len(tokens) or not is_result(tokens[i + 1]):
+            return False
+        i += 2
+    return i == len(tokens) - 1 and len(measures) <= 1
+
+
+def _find_call_spans(masked_sql: str, function_name: str) -> list:
+    """返回 function_name(...) 调用的 (参数起始, 参数结束) 位置列表，支持嵌套括号"""
+    spans = []
+    for match in re.finditer(rf"\b{function_name}\s*\(", masked_sql, re.IGNORECASE):
+        depth, start = 1, match.end()
+        for i in range(start, len(masked_sql)):
+            if masked_sql[i] == "(":
+                depth += 1
+            elif masked_sql[i] == ")":
+                depth -= 1
+                if depth == 0:
+                    spans.append((start, i))
+                    break
+    return spans
+
+
+def _inside(position: int, spans: list) -> tuple:
+    for span in spans:
+        if span[0] <= position < span[1]:
+            return span
+    return None
+
+
+def rewrite_query(sql_query: str, rollups: list, df_columns: list, data_version: str = None):
+    """
+    若查询是对 df_data 的简单聚合，且所用列都被某张汇总表覆盖，
+    返回 (改写后的 SQL, 汇总表名)；否则返回 (None, None)，调用方应照常查询 df_data。
+    规则是保守的：只接受单个 SELECT、无 JOIN/子查询/窗口函数，度量列只能直接作为 SUM(...) 的参数
+    （或仅按维度列取舍的 CASE 分支），见 _is_rollup_sum_argument。
+    """
+    candidates = sorted((r for r in rollups if data_version is None or r.get("data_version") == data_version),
+                        key=lambda r: r["row_count"])
+    if not candidates or not sql_query:
+        return None, None
+
+    # 屏蔽字符串字面量，避免其中的内容被误识别为列名或关键字
+    masked = _STRING_LITERAL.sub(lambda m: "''", sql_query)
+    lowered = masked.lower()
+    if len(re.findall(r"\bselect\b", lowered)) != 1 or len(_DF_DATA_REF.findall(masked)) != 1:
+        return None, None
+    if _UNSUPPORTED.search(lowered):
+        return None, None
+    if not (re.search(r"\b(sum|count|min|max)\s*\(", lowered) or re.search(r"\bselect\s+distinct\b", lowered)):
+        # 明细查询，汇总表无法给出相同的行
+        return None, None
+
+    sum_spans = _find_call_spans(masked, "sum")
+    for start, end in sum_spans:
+        if not _is_rollup_sum_argument(lowered[start:end]):
+            return None, None
+    count_spans = _find_call_spans(masked, "count")
+    needs_order_count = False
+    for start, end in count_spans:
+        body = lowered[start:end].strip()
+        if body in ("*", "1"):
+            continue
+        distinct_match = re.fullmatch(r'distinct\s+"?(\w+)"?', body)
+        if not distinct_match:
+            return None, None
+        if distinct_match.group(1) == "order_no":
+            needs_order_count = True
+
+    alias_matches = list(re.finditer(r'\bas\s+"?(\w+)"?', masked, re.IGNORECASE))
+    aliases = {m.group(1).lower() for m in alias_matches}
+    alias_positions = {m.start(1) for m in alias_matches}
+    column_set = {c.lower() for c in df_columns}
+    referenced = set()
+    for match in re.finditer(r'"(\w+)"|\b([a-z_]\w*)\b', masked, re.IGNORECASE):
+        name = (match.group(1) or match.group(2)).lower()
+        name_start = match.start(1) if match.group(1) else match.start(2)
+        if name == "df_data" or name_start in alias_positions:
+            # 表名本身及别名定义（AS "xxx"）不算列引用
+            continue
+        if match.group(1) and name not in column_set and name not in aliases:
+            # 引号包裹却既不是列名也不是别名，无法判断，放弃改写
+            return None, None
+        if name not in column_set:
+            continue
+        if name in ADDITIVE_MEASURES and not _inside(match.start(), sum_spans):
+            return None, None
+        if name == "order_no":
+            span = _inside(match.start(), count_spans)
+            if not span or not lowered[span[0]:span[1]].strip().startswith("distinct"):
+                return None, None
+            continue
+        referenced.add(name)
+
+    required_dims = referenced - set(ADDITIVE_MEASURES)
+    for rollup in candidates:
+        if needs_order_count and not rollup["order_level"]:
+            continue
+        if not required_dims.issubset(rollup["dimensions"]):
+            continue
+        parts = _STRING_LITERAL.split(sql_query)
+        for i in range(0, len(parts), 2):
+            part = _DF_DATA_REF.sub(f'"{rollup["name"]}"', parts[i])
+            # SUM 在没有匹配行时返回 NULL，而 COUNT 返回 0
+            part = _COUNT_DISTINCT_ORDER.sub('COALESCE(CAST(SUM("order_count") AS BIGINT), 0)', part)
+            part = _COUNT_ROWS.sub('COALESCE(CAST(SUM("line_count") AS BIGINT), 0)', part)
+            parts[i] = part
+        return "".join(parts), rollup["name"]
+    return None, None
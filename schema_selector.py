@@ -0,0 +1,224 @@
+import os
+import re
+
+from prompt.prompt import DATABASE_SCHEMA_DESCRIPTION, MULTI_TURN_SYSTEM_PROMPT_EXTENSION
+from prompt.prompt_en import DATABASE_SCHEMA_DESCRIPTION_EN, MULTI_TURN_SYSTEM_PROMPT_EXTENSION_EN
+
+# 按问题裁剪发送给 LLM 的表结构说明：只展开相关列的描述，其余列仅列出列名
+SCHEMA_SELECTION_ENABLED = os.getenv("SCHEMA_SELECTION_ENABLED", "1") == "1"
+# 选中的列超过该比例时裁剪收益很小，直接使用完整表结构
+SCHEMA_SELECTION_MAX_RATIO = float(os.getenv("SCHEMA_SELECTION_MAX_RATIO", "0.6"))
+
+# 几乎所有问题都会用到的列，始终展开说明
+REQUIRED_COLUMNS = ("order_date", "sales", "order_type")
+
+# 智能报告的规划阶段需要从其他维度拆解问题，这些常用分析维度始终展开
+ANALYSIS_DIMENSION_COLUMNS = ("channel", "province_name", "line_city_level", "material_name_cn", "tier_code",
+                              "terminal_name")
+
+# 选中某列时一并带上的关联列（如城市通常需要结合省份筛选）
+COMPANION_COLUMNS = {
+    "line_city_name": ("province_name",),
+    "line_city_level": ("line_city_name",),
+    "subchannel": ("channel",),
+    "sub_subchannel": ("channel", "subchannel"),
+    "material_code": ("material_name_cn",),
+    "material_type": ("material_name_cn",),
+    "tier_code": ("merged_c_code",),
+    "first_order_date": ("merged_c_code",),
+    "is_mtd_active_member_flag": ("merged_c_code",),
+    "ytd_active_arr": ("merged_c_code",),
+    "r12_active_arr": ("merged_c_code",),
+    "terminal_code": ("terminal_name",),
+    "terminal_region": ("terminal_name",),
+}
+
+_PROVINCES = ["北京", "天津", "上海", "重庆", "河北", "山西", "辽宁", "吉林", "黑龙江", "江苏", "浙江", "安徽", "福建",
+              "江西", "山东", "河南", "湖北", "湖南", "广东", "海南", "四川", "贵州", "云南", "陕西", "甘肃", "青海",
+              "台湾", "内蒙古", "广西", "西藏", "宁夏", "新疆", "香港", "澳门"]
+
+# 中英文同义词索引：列名 -> 问题中可能出现的说法（英文按单词边界匹配，中文按子串匹配）
+COLUMN_SYNONYMS = {
+    "order_no": ["订单号", "订单编号", "订单数", "订单量", "单数", "笔数", "order number", "order id", "orders",
+                 "number of orders", "order count"],
+    "order_time": ["时间", "小时", "几点", "时段", "钟点", "hour", "hourly", "time of day", "timestamp"],
+    "order_date": ["日期", "每天", "按天", "每日", "按日", "日均", "每周", "按周", "星期", "月份", "月度", "每月", "按月",
+                   "季度", "年度", "每年", "按年", "趋势", "同比", "环比", "date", "day", "daily", "week", "weekly",
+                   "month", "monthly", "quarter", "year", "yearly", "trend"],
+    "brand_code": ["品牌", "brand"],
+    "program_code": ["项目", "program"],
+    "order_type": ["退单", "退货", "退款", "正单", "return", "returns", "refund", "refunds"],
+    "sales": ["销售额", "销售", "业绩", "金额", "收入", "营收", "gmv", "sales", "revenue", "amount"],
+    "item_qty": ["数量", "件数", "销量", "quantity", "units", "qty", "volume"],
+    "item_price": ["单价", "价格", "价位", "售价", "price", "prices", "unit price"],
+    "channel": ["渠道", "channel", "channels"],
+    "subchannel": ["子渠道", "二级渠道", "subchannel", "sub-channel"],
+    "sub_subchannel": ["三级渠道", "三级子渠道", "sub_subchannel", "sub-subchannel"],
+    "material_code": ["sku", "货号", "产品代码", "产品编码", "product code"],
+    "material_name_cn": ["产品", "商品", "单品", "品名", "爆款", "product", "products", "item", "items",
+                         "best-selling", "bestseller"],
+    "material_type": ["产品类型", "品类", "类别", "类目", "category", "categories", "product type"],
+    "merged_c_code": ["客户", "顾客", "消费者", "买家", "人数", "复购", "回购", "客单价", "customer", "customers",
+                      "buyer", "buyers", "repeat", "repurchase", "per customer"],
+    "tier_code": ["会员等级", "等级", "会员", "非会员", "tier", "tiers", "membership", "member level", "members"],
+    "first_order_date": ["首单", "首购", "新客", "老客", "新顾客", "老顾客", "新客户", "老客户", "first order",
+                         "first purchase", "new customer", "new customers", "returning customer",
+                         "returning customers"],
+    "is_mtd_active_member_flag": ["本月活跃", "月活跃", "活跃会员", "当月活跃", "monthly active", "mtd", "month-to-date"],
+    "ytd_active_arr": ["年度活跃", "今年活跃", "年活跃", "ytd", "year-to-date"],
+    "r12_active_arr": ["近12月", "近12个月", "近十二个月", "12个月活跃", "r12", "rolling 12", "last 12 months"],
+    "manager_counter_code": ["管理门店", "管理柜台", "manager counter", "managing store"],
+    "ba_code": ["导购", "美容顾问", "柜员", "ba", "beauty advisor", "beauty advisors", "sales assistant",
+                "sales assistants"],
+    "province_name": ["省份", "各省", "分省", "全省", "哪个省", "各地", "地域", "地区", "province", "provinces", "provincial", "region",
+                      "regions", "regional"] + _PROVINCES,
+    "line_city_name": ["城市", "各市", "地级市", "city", "cities"],
+    "line_city_level": ["城市等级", "线城市", "一线", "二线", "三线", "四线", "五线", "新一线", "city level", "city tier",
+                        "tier-1", "tier-2", "tier 1", "tier 2"],
+    "store_no": ["门店", "柜台", "店铺", "专柜", "store", "stores", "counter", "counters", "shop", "shops"],
+    "terminal_name": ["终端", "天猫", "京东", "抖音", "旗舰店", "terminal", "terminals", "tmall", "jd", "douyin"],
+    "terminal_code": ["终端代码", "终端编码", "terminal code"],
+    "terminal_region": ["终端区域", "大区", "区域", "terminal region", "sales region", "area"],
+    "default_flag": ["异常订单", "特殊订单", "异常", "abnormal", "anomalous", "anomaly", "default flag"],
+}
+
+# 单个汉字（天、月、件等）几乎出现在任何问题里（如“天猫”“条件”“超市”），不作为关键词；
+# 只在紧跟数字或时间限定词时计入，如“近7天”“上个月”“今年”“3件”
+CONTEXT_PATTERNS = {
+    "order_date": re.compile(r"(?:[0-9０-９一二两三四五六七八九十百]+个?|[每按本上下今去前昨近当]|上个|这个|下个)"
+                             r"(?:天|日|周|星期|月|年)"),
+    "item_qty": re.compile(r"[0-9０-９一二两三四五六七八九十百]+件"),
+}
+
+# 列名拆分后过于通用、不能单独作为匹配依据的片段
+_GENERIC_NAME_PARTS = {"order", "code", "name", "no", "cn", "flag", "arr", "type", "line", "is", "merged", "c",
+                       "first", "date", "level", "item", "sub"}
+
+_COLUMN_LINE = re.compile(r'^- "(\w+)" \((\w+)\): (.*)$')
+
+_OTHER_COLUMNS_TEXT = {
+    'zh': "其余可用列（未展开说明，确有需要时也可使用）：{columns}",
+    'en': "Other available columns (not described here; use them only if clearly needed): {columns}",
+}
+
+
+def _parse_schema(description: str) -> dict:
+    """把表结构说明拆成 表头 / 列描述行 / 指导原则 三部分"""
+    lines = description.strip("\n").split("\n")
+    positions = [i for i, line in enumerate(lines) if _COLUMN_LINE.match(line)]
+    columns = {}
+    for i in positions:
+        name, col_type, text = _COLUMN_LINE.match(lines[i]).groups()
+        columns[name] = {"line": lines[i], "type": col_type, "description": text}
+    return {
+        "header": "\n".join(lines[:positions[0]]),
+        "columns": columns,
+        "footer": "\n".join(lines[positions[-1] + 1:]),
+    }
+
+
+_SCHEMAS = {
+    'zh': _parse_schema(DATABASE_SCHEMA_DESCRIPTION),
+    'en': _parse_schema(DATABASE_SCHEMA_DESCRIPTION_EN),
+}
+_EXTENSIONS = {'zh': MULTI_TURN_SYSTEM_PROMPT_EXTENSION, 'en': MULTI_TURN_SYSTEM_PROMPT_EXTENSION_EN}
+_FULL_SCHEMAS = {'zh': DATABASE_SCHEMA_DESCRIPTION, 'en': DATABASE_SCHEMA_DESCRIPTION_EN}
+
+
+def _build_keyword_index() -> dict:
+    """关键词 -> 列名集合。来源：同义词表、列名片段、两种语言描述中逗号前的短标签"""
+    index = {}
+
+    def add(keyword, column):
+        keyword = keyword.strip().lower()
+        if keyword and (len(keyword) > 1 or keyword.isascii()):
+            index.setdefault(keyword, set()).add(column)
+
+    for column in _SCHEMAS['zh']["columns"]:
+        add(column, column)
+        for part in column.split("_"):
+            if part not in _GENERIC_NAME_PARTS and len(part) > 1:
+                add(part, column)
+        for lang in ('zh', 'en'):
+            label = re.split(r"[，,（(]", _SCHEMAS[lang]["columns"][column]["description"])[0]
+            add(label, column)
+        for synonym in COLUMN_SYNONYMS.get(column, []):
+            add(synonym, column)
+    return index
+
+
+_KEYWORD_INDEX = _build_keyword_index()
+_KEYWORD_PATTERNS = {
+    keyword: re.compile(rf"(?<![a-z0-9_]){re.escape(keyword)}(?![a-z0-9_])") if keyword.isascii() else None
+    for keyword in _KEYWORD_INDEX
+}
+
+
+def match_columns(text: str) -> dict:
+    """返回 {列名: 命中的关键词列表}"""
+    text = (text or "").lower()
+    matches = {}
+    for keyword, columns in _KEYWORD_INDEX.items():
+        pattern = _KEYWORD_PATTERNS[keyword]
+        hit = pattern.search(text) if pattern is not None else keyword in text
+        if hit:
+            for column in columns:
+                matches.setdefault(column, []).append(keyword)
+    for column, pattern in CONTEXT_PATTERNS.items():
+        hits = pattern.findall(text)
+        if hits:
+            matches.setdefault(column, []).extend(hits)
+    return matches
+
+
+def _history_columns(history: list) -> set:
+    """对话历史（此前生成的 SQL 等）中直接出现过的列名，保证追问时上一轮用到的列仍然可见"""
+    all_columns = _SCHEMAS['zh']["columns"]
+    found = set()
+    for message in history or []:
+        for token in re.findall(r"[a-z_0-9]+", str(message.get("content", "")).lower()):
+            if token in all_columns:
+                found.add(token)
+    return found
+
+
+def select_columns(question: str, history: list = None, extra_columns=()):
+    """
+    返回与问题相关的列名列表（按表结构原有顺序）；问题含义不明确时返回 None，表示使用完整表结构。
+    history 为此前的对话消息（不含当前问题也可），extra_columns 为调用方额外要求展开的列。
+    """
+    all_columns = list(_SCHEMAS['zh']["columns"])
+    matches = match_columns(question)
+    if not matches:
+        # 没有识别出任何字段相关的说法（如“帮我分析一下数据”），无法判断需要哪些列
+        return None
+
+    selected = set(REQUIRED_COLUMNS) | set(matches) | _history_columns(history) | set(extra_columns)
+    for column in list(selected):
+        selected.update(COMPANION_COLUMNS.get(column, ()))
+    selected &= set(all_columns)
+    if len(selected) > len(all_columns) * SCHEMA_SELECTION_MAX_RATIO:
+        return None
+    return [column for column in all_columns if column in selected]
+
+
+def build_schema_description(columns, lang: str = 'zh') -> str:
+    """只展开 columns 的描述；columns 为 None 时返回完整表结构说明"""
+    if columns is None:
+        return _FULL_SCHEMAS[lang]
+    schema = _SCHEMAS[lang]
+    other_columns = [name for name in schema["columns"] if name not in columns]
+    parts = [schema["header"]] + [schema["columns"][name]["line"] for name in columns]
+    if other_columns:
+        parts.append(_OTHER_COLUMNS_TEXT[lang].format(
+            columns=", ".join(f'"{name}" ({schema["columns"][name]["type"]})' for name in other_columns)))
+    return "\n" + "\n".join(parts) + "\n\n" + schema["footer"].lstrip("\n") + "\n"
+
+
+def build_system_prompt(question: str, lang: str = 'zh', history: list = None, extra_columns=()):
+    """
+    返回 (系统提示词, 选中的列名列表或 None)。
+    结构与 FULL_SYSTEM_PROMPT 相同：表结构说明 + 多轮对话规则，只是表结构按问题裁剪。
+    """
+    columns = select_columns(question, history, extra_columns) if SCHEMA_SELECTION_ENABLED else None
+    return f"{build_schema_description(columns, lang)}\n\n{_EXTENSIONS[lang]}", columns
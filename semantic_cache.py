@@ -0,0 +1,174 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter
+
+# 近似问题缓存：复用历史上成功执行过的 问题 -> LLM Call 1 结果（sql_query 与初步图表建议）
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "1") == "1"
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.9"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "2000"))
+_CACHE_DIR = os.getenv("BEAUTYYTICS_CACHE_DIR", ".cache")
+SEMANTIC_CACHE_PATH = os.getenv("SEMANTIC_CACHE_PATH", os.path.join(_CACHE_DIR, "semantic_cache.jsonl"))
+# 每次命中都记录到审计日志，便于人工复查匹配是否合理
+SEMANTIC_CACHE_AUDIT_PATH = os.getenv("SEMANTIC_CACHE_AUDIT_PATH", os.path.join(_CACHE_DIR, "semantic_cache_audit.jsonl"))
+
+NGRAM_SIZES = (1, 2, 3)
+
+# 不影响查询含义的口语化词汇，归一化时去掉
+_FILLER_WORDS = {
+    'zh': ["请问", "请", "帮我", "帮忙", "一下", "看看", "查询", "查看", "显示", "展示", "统计", "分析", "不同", "各个",
+           "各", "每个", "所有", "的", "了", "吗", "呢"],
+    'en': ["please", "show me", "show", "can you", "could you", "tell me", "give me", "what is", "what are",
+           "the", "a", "an", "of", "for", "each", "every", "all", "different", "by"],
+}
+_PUNCTUATION = re.compile(r"[\s　,.;:!?'\"，。；：！？、（）()【】\[\]“”‘’]+")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+def normalize_question(question: str, lang: str = 'zh') -> str:
+    text = question.lower().strip()
+    for word in sorted(_FILLER_WORDS.get(lang, []), key=len, reverse=True):
+        if lang == 'en':
+            text = re.sub(rf"\b{re.escape(word)}\b", " ", text)
+        else:
+            text = text.replace(word, "")
+    return _PUNCTUATION.sub(" " if lang == 'en' else "", text).strip()
+
+
+def _char_ngrams(text: str) -> Counter:
+    grams = Counter()
+    for n in NGRAM_SIZES:
+        for i in range(len(text) - n + 1):
+            gram = text[i:i + n]
+            if not gram.isspace():
+                grams[gram] += 1
+    return grams
+
+
+class SemanticQueryCache:
+    """
+    基于字符 n-gram TF-IDF 余弦相似度的本地问题索引，不依赖任何外部服务。
+    问题中的数字（年份、月份、TopN 等）必须完全一致才视为匹配，避免“2023年”命中“2024年”。
+    """
+
+    def __init__(self, path: str, audit_path: str, threshold: float, max_entries: int):
+        self.path = path
+        self.audit_path = audit_path
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self._entries = None
+        self._doc_freq = Counter()
+        self._lock = threading.Lock()
+        self._stats = {"hits": 0, "misses": 0, "stores": 0}
+
+    def _load(self):
+        if self._entries is not None:
+            return
+        self._entries = []
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    for line in f:
+                        if line.strip():
+                            self._append(json.loads(line))
+            except (OSError, ValueError) as e:
+                print(f"[SemanticCache] 读取索引失败，将重新建立: {e}")
+                self._entries, self._doc_freq = [], Counter()
+        self._entries = self._entries[-self.max_entries:]
+
+    def _append(self, record: dict):
+        normalized = normalize_question(record["question"], record["lang"])
+        entry = {**record, "grams": _char_ngrams(normalized), "numbers": sorted(_NUMBER.findall(record["question"]))}
+        self._entries.append(entry)
+        self._doc_freq.update(entry["grams"].keys())
+
+    def _idf(self, gram: str) -> float:
+        return math.log((1 + len(self._entries)) / (1 + self._doc_freq.get(gram, 0))) + 1.0
+
+    def _weights(self, grams: Counter) -> dict:
+        return {gram: count * self._idf(gram) for gram, count in grams.items()}
+
+    @staticmethod
+    def _cosine(a: dict, b: dict) -> float:
+        dot = sum(weight * b.get(gram, 0.0) for gram, weight in a.items())
+        norm = math.sqrt(sum(w * w for w in a.values())) * math.sqrt(sum(w * w for w in b.values()))
+        return dot / norm if norm else 0.0
+
+    def lookup(self, question: str, lang: str = 'zh', data_version: str = None):
+        """
+        返回 (缓存的 Call 1 结果, 相似度, 匹配到的历史问题)，未命中时返回 None。
+        只匹配同一数据集版本下记录的问题：SQL 中的日期范围等是按当时的数据写死的。
+        """
+        if not SEMANTIC_CACHE_ENABLED or not question.strip():
+            return None
+        with self._lock:
+            self._load()
+            grams = _char_ngrams(normalize_question(question, lang))
+            numbers = sorted(_NUMBER.findall(question))
+            query_weights = self._weights(grams)
+            best, best_score = None, 0.0
+            for entry in self._entries:
+                if entry["lang"] != lang or entry["numbers"] != numbers or entry.get("data_version") != data_version:
+                    continue
+                score = self._cosine(query_weights, self._weights(entry["grams"]))
+                if score > best_score:
+                    best, best_score = entry, score
+            if best is None or best_score < self.threshold:
+                self._stats["misses"] += 1
+                return None
+            self._stats["hits"] += 1
+        print(f"[SemanticCache] 命中 (相似度 {best_score:.3f}): '{question}' -> '{best['question']}'")
+        self._audit(question, lang, best, best_score)
+        return dict(best["response"]), best_score, best["question"]
+
+    def add(self, question: str, lang: str, response: dict, data_version: str = None):
+        """记录一次成功执行的 问题 -> Call 1 结果；相同问题只保留最新一条（旧数据版本下的记录被替换）"""
+        if not SEMANTIC_CACHE_ENABLED or not response or not response.get("sql_query"):
+            return
+        record = {"question": question, "lang": lang, "response": response, "data_version": data_version,
+                  "created_at": time.time()}
+        with self._lock:
+            self._load()
+            self._entries = [e for e in self._entries if not (e["question"] == question and e["lang"] == lang)]
+            self._append(record)
+            self._stats["stores"] += 1
+            self._persist()
+
+    def _persist(self):
+        self._entries = self._entries[-self.max_entries:]
+        self._doc_freq = Counter()
+        for entry in self._entries:
+            self._doc_freq.update(entry["grams"].keys())
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for entry in self._entries:
+                    record = {k: entry.get(k) for k in ("question", "lang", "response", "data_version", "created_at")}
+                    f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            print(f"[SemanticCache] 保存索引失败: {e}")
+
+    def _audit(self, question: str, lang: str, entry: dict, score: float):
+        try:
+            os.makedirs(os.path.dirname(self.audit_path) or ".", exist_ok=True)
+            with open(self.audit_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"time": time.time(), "lang": lang, "question": question,
+                                    "matched_question": entry["question"], "score": round(score, 4),
+                                    "sql_query": entry["response"].get("sql_query")}, ensure_ascii=False) + "\n")
+        except OSError as e:
+            print(f"[SemanticCache] 写入审计日志失败: {e}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self._stats["hits"] + self._stats["misses"]
+            return {**self._stats, "entries": len(self._entries or []),
+                    "hit_rate": self._stats["hits"] / lookups if lookups else 0.0}
+
+
+semantic_query_cache = SemanticQueryCache(SEMANTIC_CACHE_PATH, SEMANTIC_CACHE_AUDIT_PATH,
+                                          SEMANTIC_CACHE_THRESHOLD, SEMANTIC_CACHE_MAX_ENTRIES)
@@ -0,0 +1,119 @@
+import math
+import os
+import re
+
+import pandas as pd
+
+# 发送给 LLM 的查询结果所占的 token 预算（Call 2 / 规划阶段 / 每条证据）
+LLM_DATA_TOKEN_BUDGET = int(os.getenv("LLM_DATA_TOKEN_BUDGET", "1500"))
+LLM_EVIDENCE_TOKEN_BUDGET = int(os.getenv("LLM_EVIDENCE_TOKEN_BUDGET", "600"))
+LLM_DATA_FLOAT_DECIMALS = int(os.getenv("LLM_DATA_FLOAT_DECIMALS", "2"))
+TOP_K_VALUES = 5
+# 用于估算每行 token 数的样本行数；结果不超过该行数且在预算内时直接完整输出
+PROBE_ROWS = 50
+MIN_SAMPLE_ROWS = 5
+
+_CJK = re.compile(r"[\u3000-\u9fff\uff00-\uffef]")
+
+SECTION_TITLES = {
+    'zh': {
+        'full': "[完整数据，共 {rows} 行，CSV]",
+        'stats': "[列统计（基于全部 {rows} 行）]",
+        'sample': "[数据样本：{rows} 行中的 {shown} 行，取开头、均匀抽样与结尾，row 为原始行号，CSV]",
+        'empty': "[查询结果为空]",
+    },
+    'en': {
+        'full': "[Full data, {rows} rows, CSV]",
+        'stats': "[Column statistics (over all {rows} rows)]",
+        'sample': "[Data sample: {shown} of {rows} rows from the head, an even sample and the tail; row is the original row number; CSV]",
+        'empty': "[The query returned no rows]",
+    },
+}
+
+
+def estimate_tokens(text: str) -> int:
+    """粗略估算 token 数：中日韩字符按 1 个 token，其余按 4 个字符 1 个 token"""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk) // 4 + 1
+
+
+def _round_floats(df: pd.DataFrame) -> pd.DataFrame:
+    float_columns = df.select_dtypes(include="float").columns
+    if len(float_columns) == 0:
+        return df
+    df = df.copy()
+    df[float_columns] = df[float_columns].round(LLM_DATA_FLOAT_DECIMALS)
+    return df
+
+
+def _to_csv(df: pd.DataFrame) -> str:
+    return _round_floats(df).to_csv(index=False, lineterminator="\n").strip()
+
+
+def summarize_columns(df: pd.DataFrame, top_k: int = TOP_K_VALUES) -> str:
+    """按列计算统计量（向量化）：数值列给出 count/sum/min/max/mean，日期列给出范围，其他列给出去重数与 top-k"""
+    lines = ["column,dtype,non_null,distinct,sum,min,max,mean,top_values"]
+    numeric = df.select_dtypes(include="number")
+    numeric_stats = numeric.agg(["count", "sum", "min", "max", "mean"]).T if not numeric.empty else None
+    non_null = df.notna().sum()
+    for column in df.columns:
+        series = df[column]
+        if numeric_stats is not None and column in numeric_stats.index:
+            stats = numeric_stats.loc[column].round(LLM_DATA_FLOAT_DECIMALS)
+            lines.append(f"{column},{series.dtype},{int(stats['count'])},,{stats['sum']},{stats['min']},"
+                         f"{stats['max']},{stats['mean']},")
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            lines.append(f"{column},{series.dtype},{int(non_null[column])},{series.nunique()},,"
+                         f"{series.min()},{series.max()},,")
+        else:
+            counts = series.value_counts().head(top_k)
+            top_values = "|".join(f"{value}({count})" for value, count in counts.items())
+            lines.append(f"{column},{series.dtype},{int(non_null[column])},{series.nunique()},,,,,{top_values}")
+    return "\n".join(lines)
+
+
+def select_positions(n_total: int, n_rows: int) -> list:
+    """取开头一半、结尾四分之一，中间均匀抽样其余行，返回保持原有顺序的行位置（适合排序结果与时间序列）"""
+    if n_total <= n_rows:
+        return list(range(n_total))
+    head = n_rows // 2
+    tail = n_rows // 4
+    middle = n_rows - head - tail
+    middle_positions = [head + math.floor(i * (n_total - head - tail) / middle) for i in range(middle)] if middle else []
+    return sorted(set(range(head)) | set(middle_positions) | set(range(n_total - tail, n_total)))
+
+
+def serialize_frame(df: pd.DataFrame, token_budget: int = None, lang: str = 'zh') -> str:
+    """
+    在 token 预算内把查询结果序列化为紧凑文本：能完整放下时输出完整 CSV；
+    否则输出基于全部数据的列统计，再加上开头/抽样/结尾行组成的样本 CSV。
+    只对选中的行做格式化，因此开销与结果总行数基本无关。
+    """
+    titles = SECTION_TITLES.get(lang, SECTION_TITLES['en'])
+    budget = token_budget or LLM_DATA_TOKEN_BUDGET
+    if df is None or df.empty:
+        return titles['empty']
+
+    probe = _to_csv(df.head(PROBE_ROWS))
+    probe_rows = min(len(df), PROBE_ROWS)
+    header_tokens = estimate_tokens(probe.split("\n", 1)[0])
+    row_tokens = max(1.0, (estimate_tokens(probe) - header_tokens) / probe_rows)
+    if len(df) <= PROBE_ROWS and estimate_tokens(probe) <= budget:
+        return f"{titles['full'].format(rows=len(df))}\n{probe}"
+    if header_tokens + row_tokens * len(df) <= budget:
+        full_text = _to_csv(df)
+        if estimate_tokens(full_text) <= budget:
+            return f"{titles['full'].format(rows=len(df))}\n{full_text}"
+
+    stats_text = f"{titles['stats'].format(rows=len(df))}\n{summarize_columns(df)}"
+    remaining = budget - estimate_tokens(stats_text) - header_tokens
+    n_rows = max(MIN_SAMPLE_ROWS, int(remaining / row_tokens))
+    while True:
+        positions = select_positions(len(df), n_rows)
+        sample = df.iloc[positions].copy()
+        sample.insert(0, "row" if "row" not in df.columns else "_row", [p + 1 for p in positions])
+        sample_text = f"{titles['sample'].format(rows=len(df), shown=len(sample))}\n{_to_csv(sample)}"
+        text = f"{stats_text}\n\n{sample_text}"
+        if estimate_tokens(text) <= budget or n_rows <= MIN_SAMPLE_ROWS:
+            return text
+        n_rows = max(MIN_SAMPLE_ROWS, int(n_rows * 0.7))
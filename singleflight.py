@@ -0,0 +1,96 @@
+import asyncio
+import threading
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    合并同一时刻的相同请求（线程版）：同一 key 只有第一个调用者（leader）真正执行，
+    其余调用者等待并共享它的结果或异常。执行结束后 key 立即移除，不承担缓存职责。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {"executions": 0, "coalesced": 0}
+
+    def do(self, key: str, fn):
+        """返回 (结果, 是否共享了其他调用者的结果)"""
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self._stats["coalesced"] += 1
+                leader = False
+            else:
+                call = _Call()
+                self._calls[key] = call
+                self._stats["executions"] += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+        return call.result, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {**self._stats, "in_flight": len(self._calls)}
+
+
+class AsyncSingleFlight:
+    """SingleFlight 的协程版，只能在同一个事件循环中使用（见 llm_async.get_event_loop）"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls = {}
+        self._stats = {"executions": 0, "coalesced": 0}
+
+    async def do(self, key: str, coro_fn):
+        """返回 (结果, 是否共享了其他调用者的结果)"""
+        future = self._calls.get(key)
+        if future is not None:
+            self._stats["coalesced"] += 1
+            # shield：某个等待者被取消时不影响 leader 与其他等待者
+            return await asyncio.shield(future), True
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        self._stats["executions"] += 1
+        try:
+            result = await coro_fn()
+        except BaseException as e:
+            if not future.done():
+                if isinstance(e, asyncio.CancelledError):
+                    future.cancel()
+                else:
+                    future.set_exception(e)
+                    # 没有等待者时避免 "exception was never retrieved" 警告
+                    future.exception()
+            raise
+        else:
+            future.set_result(result)
+            return result, False
+        finally:
+            self._calls.pop(key, None)
+
+    def stats(self) -> dict:
+        return {**self._stats, "in_flight": len(self._calls)}
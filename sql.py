@@ -1,13 +1,31 @@
 import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 import duckdb
 import pandas as pd
 import streamlit as st
+from streamlit.runtime import Runtime
+from streamlit.runtime.scriptrunner import get_script_run_ctx
 
 from chart import generate_streamlit_chart
-from llm_response import get_llm_response_structured, get_final_analysis_and_chart_details, get_synthesized_report, get_analysis_plan
+from data_profile import format_data_profile, get_data_profile
+from db import ConnectionPool, fetch_bounded_result, get_connection_pool, get_data_version, query_watchdog
+from history import compact_history
+from jobs import cancel_job, create_job, get_job, is_cancel_requested, submit_job, update_job
+from llm_scheduler import PRIORITY_REPORT
+from load_data import CSV_COLUMN_NAMES
+from llm_response import clean_sql_query, get_llm_response_structured, get_final_analysis_and_chart_details, get_synthesized_report, get_analysis_plan, start_final_analysis
 from prompt.prompt import FULL_SYSTEM_PROMPT, DATA_ANALYSIS_PROMPT_TEMPLATE, DATA_CAVEATS_INSTRUCTIONS
 from prompt.prompt_en import FULL_SYSTEM_PROMPT_EN, DATA_ANALYSIS_PROMPT_TEMPLATE_EN, DATA_CAVEATS_INSTRUCTIONS_EN
+from query_cache import QUERY_CACHE_ENABLED, is_cacheable_sql, make_query_key, query_result_cache
+from rollup import ROLLUP_ENABLED, rewrite_query
+from schema_selector import ANALYSIS_DIMENSION_COLUMNS, build_system_prompt
+from semantic_cache import semantic_query_cache
+from singleflight import SingleFlight
+from serialize import LLM_EVIDENCE_TOKEN_BUDGET, serialize_frame
+from summarize import summarize_result
+from value_index import resolve_question_values
 
 # Language strings
 LANGUAGE_STRINGS = {
@@ -15,6 +33,8 @@ LANGUAGE_STRINGS = {
         'sql_empty': "SQL 查询为空或无效。",
         'data_not_loaded': "数据未能加载，无法执行SQL查询。",
         'sql_error': "SQL 查询执行错误: {error}\n尝试执行的 SQL: {query}",
+        'sql_timeout': "查询执行超过 {seconds} 秒，已被自动中止。请缩小查询范围（如增加筛选条件或聚合）后重试。",
+        'sql_cancelled': "查询已被取消。",
         'ai_thinking': "AI 思考中...",
         'ai_thinking_framework': "AI 根据 ({framework}) 框架思考中...",
         'ai_failed': "抱歉，AI未能生成有效的SQL查询或分析建议。请稍后再试或调整您的问题。",
@@ -27,6 +47,7 @@ LANGUAGE_STRINGS = {
         'analysis_failed': "AI未能完成数据分析。将尝试使用初步的图表建议（如果可用）。",
         'preliminary_chart': "📋 **查询结果与图表 (基于初步建议):**",
         'no_data': "查询已成功执行，但没有返回任何数据。",
+        'result_truncated': "查询结果共 {total} 行，超出显示上限，仅展示并分析前 {shown} 行。",
         'no_results': "查询未返回有效结果，也无明确错误信息。",
         'no_sql': "AI 未能生成 SQL 查询或提供明确指导。",
         'suggestions': "💡 或许您对以下分析方向感兴趣？",
@@ -36,6 +57,8 @@ LANGUAGE_STRINGS = {
         'sql_empty': "SQL query is empty or invalid.",
         'data_not_loaded': "Data failed to load, cannot execute SQL query.",
         'sql_error': "SQL query execution error: {error}\nAttempted SQL: {query}",
+        'sql_timeout': "The query ran longer than {seconds} seconds and was stopped. Please narrow it down (add filters or aggregation) and try again.",
+        'sql_cancelled': "The query was cancelled.",
         'ai_thinking': "AI is thinking...",
         'ai_thinking_framework': "AI is thinking using ({framework}) framework...",
         'ai_failed': "Sorry, the AI failed to generate a valid SQL query or analysis suggestion. Please try again later or adjust your question.",
@@ -48,6 +71,7 @@ LANGUAGE_STRINGS = {
         'analysis_failed': "AI failed to complete data analysis. Will try to use preliminary chart suggestion (if available).",
         'preliminary_chart': "📋 **Query Results & Chart (Preliminary):**",
         'no_data': "Query executed successfully but returned no data.",
+        'result_truncated': "The query returned {total} rows, which exceeds the limit. Only the first {shown} rows are shown and analyzed.",
         'no_results': "Query returned no valid results and no clear error message.",
         'no_sql': "AI failed to generate SQL query or provide clear guidance.",
         'suggestions': "💡 You might be interested in these analysis directions?",
@@ -56,30 +80,184 @@ LANGUAGE_STRINGS = {
 }
 
 
+# 查询超时（秒），交互问答与智能报告分别配置；0 表示不限制
+SQL_TIMEOUT_INTERACTIVE_SECONDS = float(os.getenv("SQL_TIMEOUT_INTERACTIVE_SECONDS", "30"))
+SQL_TIMEOUT_REPORT_SECONDS = float(os.getenv("SQL_TIMEOUT_REPORT_SECONDS", "60"))
+# 智能报告阶段三并发执行的 SQL 数量上限
+SMART_REPORT_SQL_PARALLELISM = int(os.getenv("SMART_REPORT_SQL_PARALLELISM", "4"))
+# 智能报告阶段三每条查询完成后立即并发执行 LLM Call 2，分析结果随证据一起交给阶段四
+SMART_REPORT_EVIDENCE_ANALYSIS_ENABLED = os.getenv("SMART_REPORT_EVIDENCE_ANALYSIS_ENABLED", "1") == "1"
+sql_singleflight = SingleFlight("sql")
+# 流式接收到 sql_query 后立即在后台执行（与 LLM 后续内容的生成重叠）
+SPECULATIVE_SQL_ENABLED = os.getenv("SPECULATIVE_SQL_ENABLED", "1") == "1"
+_speculative_executor = ThreadPoolExecutor(max_workers=int(os.getenv("SPECULATIVE_SQL_WORKERS", "4")),
+                                           thread_name_prefix="speculative-sql")
+
+
 def get_text(key, lang='zh', **kwargs):
     """Helper function to get localized text with optional formatting"""
     return LANGUAGE_STRINGS[lang][key].format(**kwargs)
 
 
-def execute_sql(sql_query: str, current_df_data: pd.DataFrame):
+def get_current_session_id():
+    """当前 Streamlit 会话 ID；在脚本线程之外调用时返回 None"""
+    ctx = get_script_run_ctx()
+    return ctx.session_id if ctx else None
+
+
+def _is_session_active(session_id: str) -> bool:
+    try:
+        return Runtime.instance().is_active_session(session_id)
+    except Exception:
+        return True
+
+
+def _is_owner_alive(owner: str) -> bool:
+    """查询的 owner 可以是 Streamlit 会话，也可以是后台任务（任务在被取消前一直有效）"""
+    job = get_job(owner)
+    if job is not None:
+        return not job.get("cancel_requested")
+    return _is_session_active(owner)
+
+
+query_watchdog.is_owner_alive = _is_owner_alive
+
+
+def cancel_session_queries(session_id: str = None) -> int:
+    """取消指定（默认为当前）会话正在执行的 SQL 查询，供 UI 在用户离开或开始新问题时调用"""
+    session_id = session_id or get_current_session_id()
+    if not session_id:
+        return 0
+    cancelled = query_watchdog.cancel(session_id)
+    if cancelled:
+        print(f"[SQL] 已取消会话 {session_id} 的 {cancelled} 个查询")
+    return cancelled
+
+
+def _run_query(cursor, sql_query: str, pool: ConnectionPool, data_version: str):
+    """能由汇总表回答的聚合查询改写到最小的汇总表上执行，否则（或改写后执行失败）查询 df_data"""
+    if ROLLUP_ENABLED and pool.rollups:
+        rewritten_sql, rollup_name = rewrite_query(sql_query, pool.rollups, CSV_COLUMN_NAMES, data_version)
+        if rewritten_sql:
+            try:
+                result_df = fetch_bounded_result(cursor, rewritten_sql)
+                print(f"[SQL] 查询已改写为使用汇总表 {rollup_name}")
+                return result_df
+            except duckdb.InterruptException:
+                raise
+            except duckdb.Error as e:
+                print(f"[SQL] 汇总表 {rollup_name} 查询失败，回退到 df_data: {e}")
+    return fetch_bounded_result(cursor, sql_query)
+
+
+def execute_sql(sql_query: str, current_df_data, timeout: float = None, owner: str = None):
+    """
+    current_df_data 可以是 pandas DataFrame（在当前线程的游标上注册为 df_data），
+    也可以是已持有原生 df_data 表的连接池（DuckDB 加载模式）。
+    查询使用进程级连接池中当前线程的游标，不再为每次查询新建数据库。
+    相同数据集版本下的重复查询直接从共享结果缓存返回；可由汇总表回答的聚合查询自动改写。
+    同一时刻多个会话发起的相同查询只执行一次，其余调用者共享结果。
+    timeout 默认为交互式超时；owner 默认为当前会话 ID，用于 cancel_session_queries。
+    """
     if not sql_query or not sql_query.strip():
         return None, get_text('sql_empty')
     if current_df_data is None:
         return None, get_text('data_not_loaded')
+    data_version = get_data_version(current_df_data)
+    if QUERY_CACHE_ENABLED:
+        cached_df = query_result_cache.get(sql_query, data_version)
+        if cached_df is not None:
+            return cached_df, None
+    if timeout is None:
+        timeout = SQL_TIMEOUT_INTERACTIVE_SECONDS
+    owner = owner or get_current_session_id()
+    if not data_version or not is_cacheable_sql(sql_query):
+        return _execute_uncached(sql_query, current_df_data, data_version, timeout, owner)[:2]
+
+    # 超时时长也是键的一部分：智能报告的查询不会继承交互式查询较短的超时
+    (result_df, error_message, abort_reason), shared = sql_singleflight.do(
+        f"{make_query_key(sql_query, data_version)}:{timeout:g}",
+        lambda: _execute_uncached(sql_query, current_df_data, data_version, timeout, owner))
+    if shared:
+        print("[SQL] 与正在执行的相同查询合并，共享其结果")
+        if abort_reason == 'cancelled':
+            # 被取消的是发起查询的其他会话，本会话自行重新执行
+            return _execute_uncached(sql_query, current_df_data, data_version, timeout, owner)[:2]
+    return result_df, error_message
+
+
+def _execute_uncached(sql_query: str, current_df_data, data_version: str, timeout: float, owner: str):
+    """返回 (结果, 错误信息, 中止原因)；中止原因为 'timeout' / 'cancelled' 或 None"""
+    token = None
+    abort_reason = None
     try:
-        con = duckdb.connect(database=':memory:', read_only=False)
-        con.register('df_data', current_df_data)
-        result_df = con.execute(sql_query).fetchdf()
-        con.close()
-        return result_df, None
+        if isinstance(current_df_data, ConnectionPool):
+            pool = current_df_data
+            cursor = pool.cursor()
+        else:
+            pool = get_connection_pool()
+            cursor = pool.cursor(current_df_data)
+        token = query_watchdog.start_query(cursor, timeout, owner)
+        try:
+            result_df = _run_query(cursor, sql_query, pool, data_version)
+        finally:
+            abort_reason = query_watchdog.finish_query(token)
+        if QUERY_CACHE_ENABLED:
+            query_result_cache.put(sql_query, data_version, result_df)
+        return result_df, None, None
     except Exception as e:
+        if token is not None and abort_reason == 'timeout':
+            e = get_text('sql_timeout', seconds=f"{timeout:g}")
+        elif token is not None and abort_reason == 'cancelled':
+            e = get_text('sql_cancelled')
         error_message = get_text('sql_error', error=e, query=sql_query)
-        return None, error_message
+        return None, error_message, abort_reason if token is not None else None
+
+
+def _with_data_context(system_prompt: str, data_source, lang: str, value_hints: str = "") -> str:
+    """在系统提示词后追加数据概况（每个数据版本固定）与问题的取值匹配结果"""
+    sections = [system_prompt, format_data_profile(get_data_profile(data_source), lang), value_hints]
+    return "\n\n".join(section for section in sections if section)
+
+
+def _chart_fields_ready(fields: dict) -> bool:
+    chart_type = fields.get("chart_type")
+    if chart_type == "table":
+        return True
+    if chart_type == "pie":
+        return bool(fields.get("category_column") and fields.get("value_column"))
+    return bool(chart_type and fields.get("x_axis") and fields.get("y_axis"))
+
+
+def _make_streaming_callbacks(result_df: pd.DataFrame, chart_placeholder, analysis_placeholder, lang='zh'):
+    """生成 Call 2 的流式回调：on_partial 逐步刷新分析文本，on_field 在图表参数齐全时绘制一次预览图表"""
+    fields = {}
+    state = {"chart_drawn": False}
+
+    def on_partial(key, text):
+        if key == "analysis_text":
+            analysis_placeholder.info(text + " ▌")
+
+    def on_field(key, value):
+        if key in ("chart_suggestion", "chart_suggestions") and isinstance(value, dict):
+            for sub_key, sub_value in value.items():
+                fields.setdefault(sub_key, sub_value)
+        else:
+            fields[key] = value
+        if key == "analysis_text" and value:
+            analysis_placeholder.info(value)
+        if not state["chart_drawn"] and _chart_fields_ready(fields):
+            state["chart_drawn"] = True
+            preview_params = {**fields, "title": fields.get("title") or ("分析结果图表" if lang == 'zh' else "Analysis Results Chart")}
+            with chart_placeholder.container():
+                st.markdown(get_text('results_chart', lang))
+                generate_streamlit_chart(fields["chart_type"], result_df, preview_params, lang=lang)
+
+    return on_field, on_partial
 
 
 def process_user_query(user_query: str, current_df_data: pd.DataFrame, active_analysis_framework_prompt: str = None,
                        lang='zh'):
-    system_prompt = FULL_SYSTEM_PROMPT_EN if lang == 'en' else FULL_SYSTEM_PROMPT
     analysis_prompt_template = DATA_ANALYSIS_PROMPT_TEMPLATE_EN if lang == 'en' else DATA_ANALYSIS_PROMPT_TEMPLATE
     data_caveats = DATA_CAVEATS_INSTRUCTIONS_EN if lang == 'en' else DATA_CAVEATS_INSTRUCTIONS
 
@@ -119,13 +297,52 @@ def process_user_query(user_query: str, current_df_data: pd.DataFrame, active_an
         if active_analysis_framework_prompt:
             spinner_text = get_text('ai_thinking_framework', lang, framework=selected_prompt_display_name)
 
-        with st.spinner(spinner_text):
-            llm_response_call1_data = get_llm_response_structured(
-                st.session_state.llm_conversation_history,
-                system_prompt,
-                active_analysis_framework_prompt=active_analysis_framework_prompt,
-                lang=lang
-            )
+        # sql_query 字段一完成就提前执行查询，LLM 继续生成 explanation / recommended_analyses
+        speculative = {}
+        session_id = get_current_session_id()
+
+        def start_speculative_sql(key, value):
+            if key == "sql_query" and isinstance(value, str) and value.strip() and "future" not in speculative:
+                speculative["sql"] = clean_sql_query(value)
+                speculative["future"] = _speculative_executor.submit(
+                    execute_sql, speculative["sql"], current_df_data, None, session_id)
+                print("[SQL] sql_query 已完成生成，提前开始执行查询")
+
+        # 独立问题（无上下文、未选分析框架）先查近似问题缓存，命中则跳过 LLM Call 1
+        is_standalone_question = len(st.session_state.llm_conversation_history) == 1 and not active_analysis_framework_prompt
+        semantic_match = semantic_query_cache.lookup(user_query, lang, get_data_version(current_df_data)) \
+            if is_standalone_question else None
+
+        if semantic_match:
+            llm_response_call1_data = semantic_match[0]
+        else:
+            # 历史按 token 预算压缩后再发送，会话中保留的仍是完整历史
+            history_for_llm, history_stats = compact_history(st.session_state.llm_conversation_history)
+            if history_stats["tokens_saved"] > 0:
+                print(f"[History] 压缩对话历史: {history_stats['original_tokens']} -> {history_stats['prompt_tokens']} tokens "
+                      f"(节省 {history_stats['tokens_saved']}，压缩 {history_stats['compacted_turns']} 轮，"
+                      f"丢弃 {history_stats['dropped_turns']} 轮)")
+            assistant_ui_msg["history_tokens_saved"] = history_stats["tokens_saved"]
+            # 问题中的商品、地区、店铺等说法先匹配为数据中的实际取值，写入提示词
+            value_hints, value_columns = resolve_question_values(user_query, current_df_data, lang)
+            # 表结构说明按问题裁剪；使用分析框架时问题范围较宽，保留完整表结构
+            if active_analysis_framework_prompt:
+                system_prompt = FULL_SYSTEM_PROMPT_EN if lang == 'en' else FULL_SYSTEM_PROMPT
+            else:
+                system_prompt, schema_columns = build_system_prompt(user_query, lang, history_for_llm[:-1],
+                                                                    extra_columns=value_columns)
+                if schema_columns:
+                    print(f"[Schema] 按问题裁剪表结构，展开 {len(schema_columns)} 列: {', '.join(schema_columns)}")
+            system_prompt = _with_data_context(system_prompt, current_df_data, lang, value_hints)
+            with st.spinner(spinner_text):
+                llm_response_call1_data = get_llm_response_structured(
+                    history_for_llm,
+                    system_prompt,
+                    active_analysis_framework_prompt=active_analysis_framework_prompt,
+                    lang=lang,
+                    on_field=start_speculative_sql if SPECULATIVE_SQL_ENABLED else None,
+                    user=session_id
+                )
 
         if not llm_response_call1_data:
             error_msg = get_text('ai_failed', lang)
@@ -160,13 +377,23 @@ def process_user_query(user_query: str, current_df_data: pd.DataFrame, active_an
 
         if generated_sql and generated_sql.strip():
             print(f"Generated SQL (from LLM Call 1 - hidden from UI): {generated_sql}")
-            query_result_df, error_msg_sql = execute_sql(generated_sql, current_df_data)
+            if speculative.get("sql") == generated_sql:
+                query_result_df, error_msg_sql = speculative["future"].result()
+            else:
+                query_result_df, error_msg_sql = execute_sql(generated_sql, current_df_data)
             assistant_ui_msg["query_result_df"] = query_result_df
             assistant_ui_msg["error_message"] = error_msg_sql
+            if is_standalone_question and not semantic_match and query_result_df is not None and not error_msg_sql:
+                semantic_query_cache.add(user_query, lang, llm_response_call1_data,
+                                         get_data_version(current_df_data))
 
             if error_msg_sql:
                 st.error(error_msg_sql)
             elif query_result_df is not None:
+                if query_result_df.attrs.get("truncated"):
+                    st.warning(get_text('result_truncated', lang,
+                                        total=query_result_df.attrs.get("total_rows") or "?",
+                                        shown=query_result_df.attrs.get("returned_rows")))
                 if not query_result_df.empty:
                     st.markdown("---")
                     st.markdown(get_text('data_insights', lang))
@@ -176,6 +403,11 @@ def process_user_query(user_query: str, current_df_data: pd.DataFrame, active_an
                         analysis_spinner_text = get_text('analyzing_data_framework', lang,
                                                          framework=selected_prompt_display_name)
 
+                    # 流式接收分析结果：analysis_text 边生成边显示，图表参数齐全后立即绘制预览
+                    chart_placeholder = st.empty()
+                    analysis_placeholder = st.empty()
+                    on_field, on_partial = _make_streaming_callbacks(query_result_df, chart_placeholder,
+                                                                     analysis_placeholder, lang)
                     with st.spinner(analysis_spinner_text):
                         llm_response_call2_data = get_final_analysis_and_chart_details(
                             data_df=query_result_df,
@@ -183,8 +415,14 @@ def process_user_query(user_query: str, current_df_data: pd.DataFrame, active_an
                             active_analysis_framework_prompt=active_analysis_framework_prompt,
                             base_data_analysis_prompt_template=analysis_prompt_template,
                             data_caveats_instructions=data_caveats,
-                            lang=lang
+                            lang=lang,
+                            on_field=on_field,
+                            on_partial=on_partial,
+                            user=get_current_session_id()
                         )
+                    # 完整结果到达后由下方统一渲染，清掉流式预览
+                    chart_placeholder.empty()
+                    analysis_placeholder.empty()
 
                     if llm_response_call2_data:
                         assistant_ui_msg["data_analysis_text"] = llm_response_call2_data.get("analysis_text")
@@ -259,126 +497,180 @@ def process_user_query(user_query: str, current_df_data: pd.DataFrame, active_an
         st.session_state.ui_messages.append(assistant_ui_msg)
 
 
-def process_user_query_orchestrator(user_query, df_data, lang='en'):
+def _run_plan_step(step: dict, df_data, owner: str):
+    evidence_df, error_msg = execute_sql(step.get('sql'), df_data, timeout=SQL_TIMEOUT_REPORT_SECONDS, owner=owner)
+    return {
+        "purpose": step.get("purpose"), "dataframe": evidence_df, "error": error_msg,
+        "data_text": serialize_frame(evidence_df, LLM_EVIDENCE_TOKEN_BUDGET) if evidence_df is not None else "查询失败或无数据。",
+        "digest": summarize_result(evidence_df) if evidence_df is not None else ""
+    }
+
+
+def run_plan_queries(plan: list, df_data, owner: str = None, on_progress=None) -> dict:
     """
-    【状态机模式】处理智能报告请求。
-    此函数现在作为状态路由器，根据当前 job_status 执行相应阶段。
+    并发执行分析计划中的全部 SQL（每个工作线程使用连接池中自己的游标），
+    各步骤独立成功或失败。on_progress(index, step, evidence) 在调用线程中按完成顺序回调。
+    返回按计划顺序排列的 {"evidence_N": {...}}。
     """
-    # 如果任务不存在，则初始化
-    if "current_analysis_job" not in st.session_state:
-        print("\n================== [智能报告流程初始化] ==================")
-        print(f"用户问题: {user_query}")
-        initial_status_message = "智能报告任务已启动..." if lang == 'zh' else "Smart Report task initiated..."
-        st.session_state.current_analysis_job = {
-            "job_status": "STARTED",  # 初始状态
-            "original_query": user_query,
-            "stages": {},
-            "status_message": initial_status_message,
-            "stage_info": "阶段 1/4：准备中..." if lang == 'zh' else "Stage 1/4: Preparing..."
-        }
-        st.rerun()
-        return
+    evidence = {}
+    if not plan:
+        return evidence
+    max_workers = max(1, min(SMART_REPORT_SQL_PARALLELISM, len(plan)))
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="report-sql") as executor:
+        futures = {executor.submit(_run_plan_step, step, df_data, owner): i for i, step in enumerate(plan)}
+        for future in as_completed(futures):
+            i = futures[future]
+            try:
+                item = future.result()
+            except Exception as e:
+                item = {"purpose": plan[i].get("purpose"), "dataframe": None, "error": str(e),
+                        "data_text": "查询失败或无数据。"}
+            evidence[f"evidence_{i + 1}"] = item
+            if on_progress:
+                on_progress(i, plan[i], item)
+    return {f"evidence_{i + 1}": evidence[f"evidence_{i + 1}"] for i in range(len(plan))}
 
-    # 获取当前任务和状态
-    job = st.session_state.current_analysis_job
-    status = job.get("job_status")
 
-    # --- 状态路由 ---
+def process_user_query_orchestrator(user_query, df_data, lang='en'):
+    """
+    启动智能报告任务：在后台线程池中运行 run_analysis_job，立即返回任务字典。
+    会话中只保存任务引用，UI 通过轮询任务状态渲染进度，不再依赖 st.rerun() 推进各阶段。
+    """
+    previous_job = st.session_state.get("current_analysis_job")
+    if previous_job:
+        cancel_job(previous_job["job_id"])
+    print("\n================== [智能报告流程初始化] ==================")
+    print(f"用户问题: {user_query}")
+    job = create_job(user_query, lang, session_id=get_current_session_id())
+    st.session_state.current_analysis_job = job
+    return submit_job(job, run_analysis_job, df_data)
+
 
-    # 阶段一：从 "STARTED" 状态开始，生成初步SQL
-    if status == "STARTED":
-        print("\n[Orchestrator] ==> STAGE 1: 生成初步SQL查询...")
-        job.update({
-            "status_message": "正在生成初步分析的SQL查询...",
-            "stage_info": "阶段 1/4：生成初步查询" if lang == 'zh' else "Stage 1/4: Generating Initial Query"
-        })
-        system_prompt = FULL_SYSTEM_PROMPT_EN if lang == 'en' else FULL_SYSTEM_PROMPT
-        llm_response1 = get_llm_response_structured(
-            [{"role": "user", "content": job["original_query"]}], system_prompt, lang=lang
-        )
-        print("[Orchestrator] <== STAGE 1: 完成")
-
-        if not llm_response1 or not llm_response1.get("sql_query"):
-            job.update({"job_status": "FAILED", "status_message": "未能生成初步SQL查询。"})
-            job.update({"job_status": "FAILED", "status_message": "未能生成初步SQL查询。"})
-            if llm_response1:
-                explanation = llm_response1.get("explanation")
+def run_analysis_job(job: dict, df_data):
+    """
+    在后台线程中依次执行智能报告的四个阶段，并把进度写回 job。
+    此函数不调用任何 Streamlit API；查询以 job_id 作为 owner，可通过 cancel_job 中止。
+    """
+    lang = job.get("lang", 'zh')
+    job_id = job["job_id"]
+    value_hints, value_columns = resolve_question_values(job["original_query"], df_data, lang)
+    system_prompt, _ = build_system_prompt(job["original_query"], lang, extra_columns=value_columns)
+    system_prompt = _with_data_context(system_prompt, df_data, lang, value_hints)
+    # 阶段三中已提交、尚未完成的各证据分析（evidence_N -> Future）
+    analysis_futures = {}
+
+    def cancelled():
+        if is_cancel_requested(job_id):
+            print(f"[Orchestrator] 任务 {job_id} 已取消")
+            for future in analysis_futures.values():
+                future.cancel()
+            update_job(job, job_status="CANCELLED",
+                       status_message="任务已取消。" if lang == 'zh' else "The task was cancelled.")
+            return True
+        return False
+
+    # 阶段一：生成初步SQL
+    print("\n[Orchestrator] ==> STAGE 1: 生成初步SQL查询...")
+    update_job(job, status_message="正在生成初步分析的SQL查询...",
+               stage_info="阶段 1/4：生成初步查询" if lang == 'zh' else "Stage 1/4: Generating Initial Query")
+    llm_response1 = get_llm_response_structured(
+        [{"role": "user", "content": job["original_query"]}], system_prompt, lang=lang,
+        priority=PRIORITY_REPORT, user=job.get("session_id")
+    )
+    print("[Orchestrator] <== STAGE 1: 完成")
+    if cancelled():
+        return
+    if not llm_response1 or not llm_response1.get("sql_query"):
+        if llm_response1:
+            explanation = llm_response1.get("explanation")
             recommended_analyses = llm_response1.get("recommended_analyses")
             if explanation:
                 print(f"LLM Explanation on failure: {explanation}")
             if recommended_analyses:
                 print(f"LLM Recommended Analyses on failure: {recommended_analyses}")
-        else:
-            baseline_df, error_msg = execute_sql(llm_response1["sql_query"], df_data)
-            if baseline_df is None:
-                job.update({"job_status": "FAILED", "status_message": "执行初步SQL查询失败。"})
-            else:
-                job["stages"]["stage1_baseline"] = {"data": baseline_df, "sql": llm_response1["sql_query"]}
-                job["job_status"] = "STAGE1_COMPLETE"  # 更新到下一状态
-        st.rerun()
-
-    # 阶段二：从 "STAGE1_COMPLETE" 状态开始，规划分析步骤
-    elif status == "STAGE1_COMPLETE":
-        print("\n[Orchestrator] ==> STAGE 2: 基于初步数据规划深度分析...")
-        job.update({
-            "status_message": "已发现关键信息，正在规划深度探查方案...",
-            "stage_info": "阶段 2/4：规划深度分析" if lang == 'zh' else "Stage 2/4: Planning Deep Dive"
-        })
-        baseline_df = job["stages"]["stage1_baseline"]["data"]
-
-        system_prompt = FULL_SYSTEM_PROMPT_EN if lang == 'en' else FULL_SYSTEM_PROMPT
-        analysis_plan_json = get_analysis_plan(job["original_query"], baseline_df.head(20), system_prompt, lang=lang)
-        print("[Orchestrator] <== STAGE 2: 完成")
-
-        if not analysis_plan_json or "plan" not in analysis_plan_json or not analysis_plan_json["plan"]:
-            job.update({"job_status": "FAILED", "status_message": "未能生成有效的分析计划。"})
-        else:
-            job["stages"]["stage2_plan"] = analysis_plan_json["plan"]
-            job["stages"]["stage3_evidence"] = {}  # 初始化用于存储证据
-            job["job_status"] = "STAGE2_COMPLETE"  # 更新到下一状态
-        st.rerun()
-
-    # 阶段三：从 "STAGE2_COMPLETE" 状态开始，执行计划
-    elif status == "STAGE2_COMPLETE":
-        print("\n[Orchestrator] ==> STAGE 3: 执行分析计划并收集数据...")
-        job.update(
-            {"stage_info": "阶段 3/4：执行并收集数据" if lang == 'zh' else "Stage 3/4: Executing & Gathering Data"})
-        plan = job["stages"]["stage2_plan"]
-
-        # 检查是否所有步骤都已执行
-        current_step_index = len(job["stages"]["stage3_evidence"])
-        if current_step_index < len(plan):
-            step = plan[current_step_index]
-            print(f"[Orchestrator]     - STAGE 3.{current_step_index + 1}: {step['purpose']}")
-            job["status_message"] = f"正在执行第 {current_step_index + 1}/{len(plan)} 步: {step['purpose']}"
-            evidence_df, error_msg = execute_sql(step['sql'], df_data)
-            job["stages"]["stage3_evidence"][f"evidence_{current_step_index + 1}"] = {
-                "purpose": step["purpose"], "dataframe": evidence_df,
-                "data_markdown": evidence_df.to_markdown(index=False) if evidence_df is not None else "查询失败或无数据。"
-            }
-            # 保持状态不变，以便循环执行下一步
-        else:
-            print("[Orchestrator] <== STAGE 3: 所有步骤完成")
-            job["job_status"] = "STAGE3_COMPLETE"  # 所有步骤完成后，更新到下一状态
-        st.rerun()
-
-    # 阶段四：从 "STAGE3_COMPLETE" 状态开始，生成报告
-    elif status == "STAGE3_COMPLETE":
-        print("\n[Orchestrator] ==> STAGE 4: 综合所有信息生成最终报告...")
-        job.update({
-            "status_message": "所有数据已收集，正在撰写最终分析报告...",
-            "stage_info": "阶段 4/4：综合分析报告" if lang == 'zh' else "Stage 4/4: Synthesizing Report"
-        })
-        # evidence_for_llm = {k: {"purpose": v["purpose"], "data": v["data_markdown"]} for k, v in
-        #                     job["stages"]["stage3_evidence"].items()}
-        evidence_for_llm = job["stages"]["stage3_evidence"]
-        final_report_json = get_synthesized_report(job["original_query"], evidence_for_llm, lang=lang)
-        print("[Orchestrator] <== STAGE 4: 完成")
-        print("\n================== [智能报告流程结束] ==================")
-
-        if not final_report_json:
-            job.update({"job_status": "FAILED", "status_message": "未能生成最终报告。"})
-        else:
-            job["stages"]["stage4_report"] = final_report_json
-            job["job_status"] = "DONE"  # 任务最终完成
-        st.rerun()
\ No newline at end of file
+        update_job(job, job_status="FAILED", status_message="未能生成初步SQL查询。")
+        return
+    baseline_df, error_msg = execute_sql(llm_response1["sql_query"], df_data,
+                                         timeout=SQL_TIMEOUT_REPORT_SECONDS, owner=job_id)
+    if cancelled():
+        return
+    if baseline_df is None:
+        update_job(job, job_status="FAILED", status_message="执行初步SQL查询失败。")
+        return
+    job["stages"]["stage1_baseline"] = {"data": baseline_df, "sql": llm_response1["sql_query"]}
+    update_job(job, job_status="STAGE1_COMPLETE")
+
+    # 阶段二：基于初步数据规划分析步骤
+    print("\n[Orchestrator] ==> STAGE 2: 基于初步数据规划深度分析...")
+    update_job(job, status_message="已发现关键信息，正在规划深度探查方案...",
+               stage_info="阶段 2/4：规划深度分析" if lang == 'zh' else "Stage 2/4: Planning Deep Dive")
+    # 规划阶段需要从其他维度展开分析，在初步查询用到的列之外再展开常用分析维度
+    planner_system_prompt, _ = build_system_prompt(
+        job["original_query"], lang, [{"role": "assistant", "content": llm_response1["sql_query"]}],
+        extra_columns=ANALYSIS_DIMENSION_COLUMNS + tuple(value_columns))
+    planner_system_prompt = _with_data_context(planner_system_prompt, df_data, lang, value_hints)
+    analysis_plan_json = get_analysis_plan(job["original_query"], baseline_df, planner_system_prompt, lang=lang,
+                                           priority=PRIORITY_REPORT, user=job.get("session_id"))
+    print("[Orchestrator] <== STAGE 2: 完成")
+    if cancelled():
+        return
+    if not analysis_plan_json or "plan" not in analysis_plan_json or not analysis_plan_json["plan"]:
+        update_job(job, job_status="FAILED", status_message="未能生成有效的分析计划。")
+        return
+    plan = analysis_plan_json["plan"]
+    job["stages"]["stage2_plan"] = plan
+    job["stages"]["stage3_progress"] = {f"evidence_{i + 1}": "running" for i in range(len(plan))}
+    update_job(job, job_status="STAGE2_COMPLETE")
+
+    # 阶段三：并发执行计划，单个步骤失败不影响其他步骤
+    print("\n[Orchestrator] ==> STAGE 3: 执行分析计划并收集数据...")
+    update_job(job, status_message=f"正在并行执行 {len(plan)} 个分析步骤...",
+               stage_info="阶段 3/4：执行并收集数据" if lang == 'zh' else "Stage 3/4: Executing & Gathering Data")
+
+    def report_progress(index, step, item):
+        key = f"evidence_{index + 1}"
+        job["stages"]["stage3_progress"][key] = "failed" if item.get("error") else "done"
+        print(f"[Orchestrator]     - STAGE 3.{index + 1} {job['stages']['stage3_progress'][key]}: {step.get('purpose')}")
+        update_job(job)
+        evidence_df = item.get("dataframe")
+        if SMART_REPORT_EVIDENCE_ANALYSIS_ENABLED and evidence_df is not None and not evidence_df.empty:
+            # 不等待其余查询，立即开始这一条证据的 Call 2；多条分析在后台事件循环中并发执行
+            analysis_futures[key] = start_final_analysis(
+                data_df=evidence_df,
+                user_query_for_analysis=f"{job['original_query']}\n{step.get('purpose') or ''}",
+                base_data_analysis_prompt_template=DATA_ANALYSIS_PROMPT_TEMPLATE_EN if lang == 'en' else DATA_ANALYSIS_PROMPT_TEMPLATE,
+                data_caveats_instructions=DATA_CAVEATS_INSTRUCTIONS_EN if lang == 'en' else DATA_CAVEATS_INSTRUCTIONS,
+                lang=lang, priority=PRIORITY_REPORT, user=job.get("session_id"))
+
+    evidence = run_plan_queries(plan, df_data, owner=job_id, on_progress=report_progress)
+    if cancelled():
+        return
+    for key, future in analysis_futures.items():
+        try:
+            analysis = future.result()
+        except Exception as e:
+            print(f"[Orchestrator]     - {key} 的数据分析失败，仅使用原始数据: {e}")
+            continue
+        if analysis and analysis.get("analysis_text"):
+            evidence[key]["analysis"] = analysis["analysis_text"]
+    job["stages"]["stage3_evidence"] = evidence
+    print("[Orchestrator] <== STAGE 3: 所有步骤完成")
+    if cancelled():
+        return
+    update_job(job, job_status="STAGE3_COMPLETE")
+
+    # 阶段四：综合所有信息生成报告
+    print("\n[Orchestrator] ==> STAGE 4: 综合所有信息生成最终报告...")
+    update_job(job, status_message="所有数据已收集，正在撰写最终分析报告...",
+               stage_info="阶段 4/4：综合分析报告" if lang == 'zh' else "Stage 4/4: Synthesizing Report")
+    final_report_json = get_synthesized_report(job["original_query"], job["stages"]["stage3_evidence"], lang=lang,
+                                               priority=PRIORITY_REPORT, user=job.get("session_id"))
+    print("[Orchestrator] <== STAGE 4: 完成")
+    print("\n================== [智能报告流程结束] ==================")
+    if cancelled():
+        return
+    if not final_report_json:
+        update_job(job, job_status="FAILED", status_message="未能生成最终报告。")
+        return
+    job["stages"]["stage4_report"] = final_report_json
+    update_job(job, job_status="DONE")
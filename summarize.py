@@ -0,0 +1,176 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+# 结果行数达到该值时才生成摘要；小结果直接完整发送即可
+SUMMARY_MIN_ROWS = int(os.getenv("SUMMARY_MIN_ROWS", "30"))
+SUMMARY_TOP_N = int(os.getenv("SUMMARY_TOP_N", "5"))
+# 摘要中最多覆盖的度量列/分类列数量，保证摘要大小与结果行数无关
+SUMMARY_MAX_MEASURES = 3
+SUMMARY_MAX_CATEGORIES = 3
+SUMMARY_MAX_OUTLIER_EXAMPLES = 3
+# 修正 z 分数（基于中位数与 MAD）超过该值视为异常值
+OUTLIER_Z_THRESHOLD = 3.5
+
+_TIME_NAME = re.compile(r"(date|time|day|week|month|year|quarter|period|日期|时间|年|月|周|季度)", re.IGNORECASE)
+_ID_NAME = re.compile(r"(^id$|_id$|_no$|_code$|编号|单号)", re.IGNORECASE)
+
+
+def _round(value, digits: int = 2):
+    if value is None or (isinstance(value, float) and not np.isfinite(value)):
+        return None
+    return round(float(value), digits)
+
+
+def detect_columns(df: pd.DataFrame) -> dict:
+    """识别时间列、分类列与度量列"""
+    time_columns, category_columns, measure_columns = [], [], []
+    for column in df.columns:
+        series = df[column]
+        name = str(column)
+        if pd.api.types.is_datetime64_any_dtype(series):
+            time_columns.append(column)
+        elif pd.api.types.is_bool_dtype(series):
+            category_columns.append(column)
+        elif pd.api.types.is_numeric_dtype(series):
+            if _TIME_NAME.search(name) and pd.api.types.is_integer_dtype(series):
+                # 如 year / month 这类整数时间列
+                time_columns.append(column)
+            elif not _ID_NAME.search(name):
+                measure_columns.append(column)
+        elif _TIME_NAME.search(name):
+            parsed = pd.to_datetime(series.head(200), errors="coerce")
+            if parsed.notna().mean() >= 0.9:
+                time_columns.append(column)
+            else:
+                category_columns.append(column)
+        else:
+            category_columns.append(column)
+    return {"time": time_columns, "category": category_columns, "measure": measure_columns[:SUMMARY_MAX_MEASURES]}
+
+
+def gini(values: np.ndarray) -> float:
+    """基尼系数（0 表示完全均匀，越接近 1 越集中），仅对非负值有意义"""
+    values = np.sort(values[np.isfinite(values)])
+    if len(values) == 0 or values.sum() <= 0 or values.min() < 0:
+        return None
+    n = len(values)
+    return float(2 * np.sum(np.arange(1, n + 1) * values) / (n * values.sum()) - (n + 1) / n)
+
+
+def _time_key(series: pd.Series) -> pd.Series:
+    if pd.api.types.is_numeric_dtype(series) or pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    return pd.to_datetime(series, errors="coerce")
+
+
+def _trend(df: pd.DataFrame, time_column, measure) -> dict:
+    grouped = df.assign(_t=_time_key(df[time_column])).dropna(subset=["_t"]).groupby("_t")[measure].sum().sort_index()
+    if len(grouped) < 2:
+        return None
+    y = grouped.to_numpy(dtype=float)
+    slope = np.polyfit(np.arange(len(y)), y, 1)[0]
+    previous, last = y[-2], y[-1]
+    return {
+        "time_column": time_column,
+        "periods": len(y),
+        "first_period": str(grouped.index[0]), "last_period": str(grouped.index[-1]),
+        "first_value": _round(y[0]), "last_value": _round(last),
+        "slope_per_period": _round(slope),
+        "slope_pct_of_mean": _round(slope / y.mean() * 100) if y.mean() else None,
+        "total_change_pct": _round((last - y[0]) / abs(y[0]) * 100) if y[0] else None,
+        "last_period_change_pct": _round((last - previous) / abs(previous) * 100) if previous else None,
+        "peak_period": str(grouped.idxmax()), "peak_value": _round(y.max()),
+        "trough_period": str(grouped.idxmin()), "trough_value": _round(y.min()),
+    }
+
+
+def _concentration(df: pd.DataFrame, category, measure) -> dict:
+    grouped = df.groupby(category, dropna=False)[measure].sum().sort_values(ascending=False)
+    if len(grouped) < 2:
+        return None
+    total = grouped.sum()
+    top = grouped.head(SUMMARY_TOP_N)
+    return {
+        "measure": measure,
+        "distinct_values": len(grouped),
+        "top": [{"value": str(k), "total": _round(v), "share_pct": _round(v / total * 100) if total else None}
+                for k, v in top.items()],
+        "top_n_share_pct": _round(top.sum() / total * 100) if total else None,
+        "bottom": {"value": str(grouped.index[-1]), "total": _round(grouped.iloc[-1])},
+        "gini": _round(gini(grouped.to_numpy(dtype=float)), 3),
+    }
+
+
+def _outliers(df: pd.DataFrame, measure, label_columns: list) -> dict:
+    values = df[measure].astype(float)
+    median = values.median()
+    mad = (values - median).abs().median()
+    if not mad or not np.isfinite(mad):
+        return None
+    z = 0.6745 * (values - median) / mad
+    mask = z.abs() > OUTLIER_Z_THRESHOLD
+    if not mask.any():
+        return {"count": 0}
+    top_index = z[mask].abs().sort_values(ascending=False).head(SUMMARY_MAX_OUTLIER_EXAMPLES).index
+    examples = []
+    for idx in top_index:
+        example = {str(c): str(df.at[idx, c]) for c in label_columns[:2]}
+        example.update({"value": _round(values.at[idx]), "robust_z": _round(z.at[idx])})
+        examples.append(example)
+    return {"count": int(mask.sum()), "median": _round(median), "examples": examples}
+
+
+def build_digest(df: pd.DataFrame) -> dict:
+    """
+    基于全部结果行计算结构化摘要：合计、趋势斜率与环比、集中度（Top-N 占比、基尼系数）、异常值。
+    摘要条目数量有上限，大小与结果行数无关。结果行数不足 SUMMARY_MIN_ROWS 时返回 None。
+    """
+    if df is None or len(df) < SUMMARY_MIN_ROWS:
+        return None
+    columns = detect_columns(df)
+    digest = {"rows": len(df), "time_columns": [str(c) for c in columns["time"]],
+              "category_columns": [str(c) for c in columns["category"]],
+              "measure_columns": [str(c) for c in columns["measure"]]}
+    if df.attrs.get("truncated"):
+        digest["note"] = f"result truncated: digest covers the first {len(df)} of {df.attrs.get('total_rows')} rows"
+
+    totals, trends, concentration, outliers = {}, {}, {}, {}
+    label_columns = columns["time"][:1] + columns["category"][:1]
+    for measure in columns["measure"]:
+        series = df[measure]
+        totals[str(measure)] = {"sum": _round(series.sum()), "mean": _round(series.mean()),
+                                "min": _round(series.min()), "max": _round(series.max())}
+        if columns["time"]:
+            trend = _trend(df, columns["time"][0], measure)
+            if trend:
+                trends[str(measure)] = trend
+        result = _outliers(df, measure, label_columns)
+        if result:
+            outliers[str(measure)] = result
+    if columns["measure"]:
+        primary = columns["measure"][0]
+        for category in columns["category"][:SUMMARY_MAX_CATEGORIES]:
+            result = _concentration(df, category, primary)
+            if result:
+                concentration[str(category)] = result
+
+    digest.update({"totals": totals, "trends": trends, "concentration": concentration, "outliers": outliers})
+    return digest
+
+
+def format_digest(digest: dict) -> str:
+    return json.dumps(digest, ensure_ascii=False, default=str, separators=(",", ":"))
+
+
+def summarize_result(df: pd.DataFrame) -> str:
+    """生成摘要文本；结果太小或计算失败时返回空字符串（摘要只是补充信息，不能影响主流程）"""
+    try:
+        digest = build_digest(df)
+    except Exception as e:
+        print(f"[Summarize] 生成结果摘要失败: {e}")
+        return ""
+    return format_digest(digest) if digest else ""
@@ -0,0 +1,129 @@
+"""
+llm_resilience 的行为测试：真实的 AsyncOpenAI 客户端通过 httpx.MockTransport 连接本地假服务端，
+由假服务端按脚本返回 5xx / 4xx / 正常响应或延迟响应。
+"""
+import asyncio
+import json
+
+import httpx
+import openai
+import pytest
+
+import llm_resilience
+from llm_resilience import CircuitBreaker, CircuitOpenError, call_with_resilience
+
+COMPLETION = {
+    "id": "chatcmpl-test", "object": "chat.completion", "created": 0, "model": "fake-model",
+    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "{\"ok\": true}"}}],
+}
+
+
+class FakeServer:
+    """按顺序返回脚本中的响应：整数为状态码（200 返回正常结果），浮点数为延迟秒数后返回正常结果"""
+
+    def __init__(self, *script):
+        self.script = list(script)
+        self.requests = 0
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        self.requests += 1
+        step = self.script.pop(0) if self.script else 200
+        if isinstance(step, float):
+            await asyncio.sleep(step)
+            step = 200
+        if step == 200:
+            return httpx.Response(200, json=COMPLETION)
+        return httpx.Response(step, json={"error": {"message": f"fake {step}", "type": "fake"}})
+
+    def client(self) -> openai.AsyncOpenAI:
+        return openai.AsyncOpenAI(api_key="test", base_url="http://fake-llm.local/v1", max_retries=0,
+                                  http_client=httpx.AsyncClient(transport=httpx.MockTransport(self.handle)))
+
+
+@pytest.fixture(autouse=True)
+def resilience_settings(monkeypatch):
+    monkeypatch.setattr(llm_resilience, "LLM_MAX_RETRIES", 2)
+    monkeypatch.setattr(llm_resilience, "LLM_BACKOFF_BASE_SECONDS", 0.0)
+    monkeypatch.setattr(llm_resilience, "LLM_HEDGE_AFTER_SECONDS", 0.0)
+    monkeypatch.setattr(llm_resilience, "llm_circuit_breaker", CircuitBreaker(3, 60))
+
+
+def call(server: FakeServer, **kwargs):
+    client = server.client()
+
+    async def request():
+        return await client.chat.completions.create(model="fake-model", messages=[{"role": "user", "content": "hi"}])
+
+    async def run():
+        try:
+            return await call_with_resilience(request, **kwargs)
+        finally:
+            await client.close()
+
+    return asyncio.run(run())
+
+
+def test_retries_5xx_until_success():
+    server = FakeServer(500, 503, 200)
+    completion = call(server)
+    assert json.loads(completion.choices[0].message.content) == {"ok": True}
+    assert server.requests == 3
+    assert llm_resilience.llm_circuit_breaker.stats()["state"] == "closed"
+
+
+def test_gives_up_after_max_retries():
+    server = FakeServer(500, 500, 500, 200)
+    with pytest.raises(openai.InternalServerError):
+        call(server)
+    assert server.requests == 3
+
+
+def test_does_not_retry_4xx():
+    server = FakeServer(400, 200)
+    with pytest.raises(openai.BadRequestError):
+        call(server)
+    assert server.requests == 1
+    # 请求本身有误不计入熔断器的失败次数
+    assert llm_resilience.llm_circuit_breaker.stats()["consecutive_failures"] == 0
+
+
+def test_breaker_opens_and_rejects_without_request(monkeypatch):
+    monkeypatch.setattr(llm_resilience, "LLM_MAX_RETRIES", 0)
+    server = FakeServer(500, 500, 500, 200)
+    for _ in range(3):
+        with pytest.raises(openai.InternalServerError):
+            call(server)
+    assert llm_resilience.llm_circuit_breaker.stats()["state"] == "open"
+    with pytest.raises(CircuitOpenError):
+        call(server)
+    assert server.requests == 3
+
+
+def test_breaker_half_open_trial_closes_it(monkeypatch):
+    monkeypatch.setattr(llm_resilience, "LLM_MAX_RETRIES", 0)
+    monkeypatch.setattr(llm_resilience, "llm_circuit_breaker", CircuitBreaker(1, 0.05))
+    server = FakeServer(500, 200)
+    with pytest.raises(openai.InternalServerError):
+        call(server)
+    assert llm_resilience.llm_circuit_breaker.stats()["state"] == "open"
+    asyncio.run(asyncio.sleep(0.06))
+    call(server)
+    assert llm_resilience.llm_circuit_breaker.stats()["state"] == "closed"
+
+
+def test_deadline_cancels_slow_call_and_releases_trial():
+    server = FakeServer(1.0)
+    with pytest.raises(asyncio.TimeoutError):
+        call(server, deadline=0.1)
+    breaker = llm_resilience.llm_circuit_breaker
+    assert breaker.stats()["consecutive_failures"] == 1
+    # 超时后试探名额已释放，下一次请求仍可发出
+    assert call(server).choices[0].message.content == "{\"ok\": true}"
+
+
+def test_hedged_request_wins_over_slow_first(monkeypatch):
+    monkeypatch.setattr(llm_resilience, "LLM_HEDGE_AFTER_SECONDS", 0.05)
+    server = FakeServer(1.0, 200)
+    completion = call(server, deadline=0.5)
+    assert completion.choices[0].message.content == "{\"ok\": true}"
+    assert server.requests == 2
@@ -0,0 +1,323 @@
+import bisect
+import functools
+import os
+import re
+import threading
+import time
+
+try:
+    from pypinyin import Style, lazy_pinyin
+except ImportError:  # 未安装 pypinyin 时不做拼音匹配，其余匹配方式不受影响
+    lazy_pinyin = None
+
+from db import ConnectionPool, get_connection_pool, get_data_version
+
+# 问题中的商品、地区、店铺等说法 -> 数据中的实际取值，在 LLM Call 1 之前解析并写入提示词
+VALUE_INDEX_ENABLED = os.getenv("VALUE_INDEX_ENABLED", "1") == "1"
+VALUE_INDEX_COLUMNS = [c.strip() for c in os.getenv(
+    "VALUE_INDEX_COLUMNS", "province_name,line_city_name,terminal_name,material_name_cn").split(",") if c.strip()]
+# 模糊匹配：取值的字符二元组被问题覆盖的比例下限
+VALUE_INDEX_MIN_SCORE = float(os.getenv("VALUE_INDEX_MIN_SCORE", "0.75"))
+# 每个说法最多写入提示词的取值个数（按出现次数排序）
+VALUE_INDEX_MAX_VALUES_PER_TERM = int(os.getenv("VALUE_INDEX_MAX_VALUES_PER_TERM", "8"))
+# 出现在过多取值中的二元组（如“精华”“旗舰”）区分度低，不参与模糊匹配
+VALUE_INDEX_MAX_POSTINGS = int(os.getenv("VALUE_INDEX_MAX_POSTINGS", "2000"))
+# 只为较短的取值计算拼音（地名、店铺名），长商品名的同音错字意义不大且构建耗时
+VALUE_INDEX_PINYIN_MAX_CHARS = int(os.getenv("VALUE_INDEX_PINYIN_MAX_CHARS", "12"))
+# 前缀匹配最多取出的候选取值个数（按字典序），再从中按出现次数挑选；超出部分只计数，由 LIKE 提示覆盖
+VALUE_INDEX_PREFIX_CANDIDATES = int(os.getenv("VALUE_INDEX_PREFIX_CANDIDATES", "64"))
+
+_MAX_TERM_CHARS = 24
+
+# 地区简称：别名 -> (列, 归一化后的取值)
+REGION_ALIASES = {
+    "江浙沪": ("province_name", ["江苏", "浙江", "上海"]),
+    "江浙": ("province_name", ["江苏", "浙江"]),
+    "长三角": ("province_name", ["上海", "江苏", "浙江", "安徽"]),
+    "京津冀": ("province_name", ["北京", "天津", "河北"]),
+    "东三省": ("province_name", ["辽宁", "吉林", "黑龙江"]),
+    "东北": ("province_name", ["辽宁", "吉林", "黑龙江"]),
+    "川渝": ("province_name", ["四川", "重庆"]),
+    "两广": ("province_name", ["广东", "广西"]),
+    "港澳": ("province_name", ["香港", "澳门"]),
+    "北上广深": ("line_city_name", ["北京", "上海", "广州", "深圳"]),
+    "北上广": ("line_city_name", ["北京", "上海", "广州"]),
+    "珠三角": ("line_city_name", ["广州", "深圳", "珠海", "佛山", "惠州", "东莞", "中山", "江门", "肇庆"]),
+}
+
+# 归一化时去掉的行政区划后缀（按长度降序匹配）
+_LOCATION_SUFFIXES = sorted(["省", "市", "自治区", "壮族自治区", "回族自治区", "维吾尔自治区", "特别行政区", "自治州",
+                             "地区", "盟"], key=len, reverse=True)
+_LOCATION_COLUMNS = {"province_name", "line_city_name"}
+_SPACES = re.compile(r"[\s　]+")
+_ASCII_WORD = re.compile(r"[a-z][a-z0-9]+")
+
+
+def normalize_value(value: str, column: str = None) -> str:
+    """小写、去空白；地区列再去掉“省/市/自治区”等后缀，使“广东”与“广东省”一致"""
+    text = _SPACES.sub("", str(value).lower())
+    if column in _LOCATION_COLUMNS:
+        for suffix in _LOCATION_SUFFIXES:
+            if text.endswith(suffix) and len(text) > len(suffix) + 1:
+                return text[:-len(suffix)]
+    return text
+
+
+def _bigrams(text: str) -> set:
+    return {text[i:i + 2] for i in range(len(text) - 1)}
+
+
+@functools.lru_cache(maxsize=None)
+def _pinyin_of(ch: str) -> str:
+    return (lazy_pinyin(ch, style=Style.NORMAL, errors="ignore") or [ch])[0]
+
+
+def _char_pinyin(text: str) -> list:
+    """逐字拼音（不带声调），非汉字保持原样，保证与问题子串的拼音逐字对齐；按字缓存，构建大索引时不重复转换"""
+    return [_pinyin_of(ch) for ch in text]
+
+
+class _ColumnIndex:
+    """单列的取值索引：归一化精确匹配、有序前缀表、二元组倒排表、拼音表"""
+
+    def __init__(self, column: str, value_counts: list):
+        self.column = column
+        self.values = [value for value, _ in value_counts]
+        self.counts = [count for _, count in value_counts]
+        self.exact = {}
+        self.pinyin = {}
+        self.postings = {}
+        self.bigram_counts = []
+        for i, value in enumerate(self.values):
+            key = normalize_value(value, column)
+            self.exact.setdefault(key, []).append(i)
+            grams = _bigrams(key)
+            self.bigram_counts.append(len(grams))
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(i)
+            if lazy_pinyin and len(key) <= VALUE_INDEX_PINYIN_MAX_CHARS:
+                self.pinyin.setdefault("".join(_char_pinyin(key)), []).append(i)
+        self.sorted_keys = sorted(self.exact)
+        # 有序键对应取值 id 个数的前缀和，前缀区间内的取值总数可 O(1) 得到
+        self.key_offsets = [0]
+        for key in self.sorted_keys:
+            self.key_offsets.append(self.key_offsets[-1] + len(self.exact[key]))
+
+    def ranked(self, ids) -> list:
+        """按出现次数降序返回取值"""
+        return [self.values[i] for i in sorted(set(ids), key=lambda i: -self.counts[i])]
+
+    def prefix(self, text: str):
+        """
+        以 text 开头的取值：返回 (取值总数, 最多 VALUE_INDEX_PREFIX_CANDIDATES 个候选 id)。
+        bisect 定位区间，总数由前缀和得到，只取出区间开头的候选，不随匹配数增长。
+        """
+        low = bisect.bisect_left(self.sorted_keys, text)
+        high = bisect.bisect_left(self.sorted_keys, text + "\U0010ffff", low)
+        if low == high:
+            return 0, []
+        stop = min(high, low + VALUE_INDEX_PREFIX_CANDIDATES)
+        return (self.key_offsets[high] - self.key_offsets[low],
+                [i for key in self.sorted_keys[low:stop] for i in self.exact[key]])
+
+    def fuzzy(self, text: str) -> list:
+        """取值的二元组有足够比例出现在 text 中时视为匹配，返回 [(score, id)]"""
+        hits = {}
+        for gram in _bigrams(text):
+            posting = self.postings.get(gram)
+            if posting and len(posting) <= VALUE_INDEX_MAX_POSTINGS:
+                for i in posting:
+                    hits[i] = hits.get(i, 0) + 1
+        return [(hit / self.bigram_counts[i], i) for i, hit in hits.items()
+                if hit >= 2 and hit / self.bigram_counts[i] >= VALUE_INDEX_MIN_SCORE]
+
+
+class ValueIndex:
+    """
+    分类列取值的内存索引，数据加载时构建一次。
+    resolve(question) 依次尝试：地区别名、问题子串与取值的精确/前缀匹配、拼音匹配（同音错字、拼音输入）、
+    二元组模糊匹配，返回 [{"term", "column", "values", "match"}]。
+    """
+
+    def __init__(self, columns: dict, data_version: str = None):
+        self.columns = columns
+        self.data_version = data_version
+
+    def _alias_matches(self, text: str, covered: list) -> list:
+        results = []
+        for alias in sorted(REGION_ALIASES, key=len, reverse=True):
+            start = text.find(alias)
+            column, keys = REGION_ALIASES[alias]
+            if start < 0 or column not in self.columns or any(covered[start:start + len(alias)]):
+                continue
+            index = self.columns[column]
+            ids = [i for key in keys for i in index.exact.get(key, [])]
+            if ids:
+                covered[start:start + len(alias)] = [True] * len(alias)
+                results.append({"term": alias, "column": column, "values": index.ranked(ids), "match": "alias"})
+        return results
+
+    def _substring_matches(self, text: str, covered: list) -> list:
+        """从长到短枚举问题子串做精确匹配；较长的匹配优先占用对应位置"""
+        results = []
+        # 逐字拼音只计算一次，子串的拼音直接拼接
+        char_pinyin = _char_pinyin(text) if lazy_pinyin else None
+        for length in range(min(len(text), _MAX_TERM_CHARS), 1, -1):
+            for start in range(len(text) - length + 1):
+                if any(covered[start:start + length]):
+                    continue
+                term = text[start:start + length]
+                for column, index in self.columns.items():
+                    key = normalize_value(term, column)
+                    ids = index.exact.get(key)
+                    match = "exact"
+                    like = None
+                    total = None
+                    if ids or length >= 3:
+                        # 精确命中时同样查看以该说法开头的取值（如“小黑瓶”与“小黑瓶50ml”），不能只给出精确值
+                        family_total, family = index.prefix(key)
+                        if family_total > len(ids or []):
+                            # 精确值排在前缀区间开头，一定包含在候选中
+                            ids, match, like, total = family, "prefix", key, family_total
+                    if not ids and char_pinyin and length <= VALUE_INDEX_PINYIN_MAX_CHARS and not term.isascii():
+                        # 归一化只会截掉末尾的行政区划后缀
+                        key_length = len(normalize_value(term, column))
+                        ids = index.pinyin.get("".join(char_pinyin[start:start + key_length]))
+                        match = "pinyin"
+                    if ids:
+                        covered[start:start + length] = [True] * length
+                        results.append({"term": term, "column": column, "values": index.ranked(ids), "match": match,
+                                        "like": like, "total": total})
+                        break
+        return results
+
+    def _ascii_pinyin_matches(self, text: str) -> list:
+        """问题中直接输入的拼音（如 guangzhou）"""
+        results = []
+        if not lazy_pinyin:
+            return results
+        for word in _ASCII_WORD.findall(text):
+            for column, index in self.columns.items():
+                ids = index.pinyin.get(word)
+                if ids:
+                    results.append({"term": word, "column": column, "values": index.ranked(ids), "match": "pinyin"})
+                    break
+        return results
+
+    def _fuzzy_matches(self, text: str, covered: list) -> list:
+        # 只对尚未被精确匹配占用的部分做模糊匹配
+        remaining = "".join(" " if covered[i] else ch for i, ch in enumerate(text))
+        results = []
+        for column, index in self.columns.items():
+            scored = sorted(index.fuzzy(remaining), key=lambda item: (-item[0], -index.counts[item[1]]))
+            if scored:
+                best = scored[0][0]
+                ids = [i for score, i in scored if score >= best - 1e-9]
+                results.append({"term": None, "column": column, "values": index.ranked(ids), "match": "fuzzy"})
+        return results
+
+    def resolve(self, question: str) -> list:
+        text = normalize_value(question)
+        covered = [False] * len(text)
+        results = self._alias_matches(text, covered)
+        results += self._substring_matches(text, covered)
+        results += self._ascii_pinyin_matches(question.lower())
+        results += self._fuzzy_matches(text, covered)
+        for result in results:
+            # total 记录截断前的取值个数，提示词据此标明列表是否完整；前缀匹配的总数已由 prefix() 给出
+            result["total"] = result.get("total") or len(result["values"])
+            result["values"] = result["values"][:VALUE_INDEX_MAX_VALUES_PER_TERM]
+        return results
+
+    def stats(self) -> dict:
+        return {column: len(index.values) for column, index in self.columns.items()}
+
+
+def _distinct_values(cursor, column: str) -> list:
+    return cursor.execute(
+        f'SELECT "{column}", COUNT(*) FROM "df_data" WHERE "{column}" IS NOT NULL '
+        f'GROUP BY 1 ORDER BY 2 DESC').fetchall()
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def build_value_index(data_source) -> ValueIndex:
+    """由数据源（DataFrame 或连接池）构建取值索引，并按数据集版本登记供 get_value_index 使用"""
+    started = time.perf_counter()
+    if isinstance(data_source, ConnectionPool):
+        cursor = data_source.cursor()
+    else:
+        cursor = get_connection_pool().cursor(data_source)
+    columns = {}
+    for column in VALUE_INDEX_COLUMNS:
+        value_counts = [(str(value), count) for value, count in _distinct_values(cursor, column) if str(value).strip()]
+        columns[column] = _ColumnIndex(column, value_counts)
+    data_version = get_data_version(data_source)
+    index = ValueIndex(columns, data_version)
+    with _indexes_lock:
+        # 只保留当前数据版本的索引
+        _indexes.clear()
+        _indexes[data_version] = index
+    print(f"[ValueIndex] 取值索引构建完成 ({time.perf_counter() - started:.2f}s): {index.stats()}"
+          + ("" if lazy_pinyin else "，未安装 pypinyin，跳过拼音匹配"))
+    return index
+
+
+def get_value_index(data_source):
+    """返回数据源当前版本的取值索引；尚未构建时返回 None"""
+    if not VALUE_INDEX_ENABLED:
+        return None
+    with _indexes_lock:
+        return _indexes.get(get_data_version(data_source))
+
+
+_RESOLVED_VALUES_TEXT = {
+    'zh': {
+        "header": "【问题中的取值匹配】以下说法已匹配到 \"df_data\" 中的实际取值，生成 SQL 时请直接使用这些值（如 IN (...)），不要自行猜测或改写；"
+                  "标明“列表不完整”的说法不能用 IN 列举，请按给出的条件筛选：",
+        "term": "“{term}”",
+        "fuzzy": "（近似匹配）",
+        "truncated": "（列表不完整：共 {total} 个匹配取值，仅列出其中 {shown} 个）",
+        "like": "，筛选全部匹配取值请使用 \"{column}\" ILIKE '{pattern}%'",
+    },
+    'en': {
+        "header": "[Resolved values] The following terms in the question were matched to actual values in \"df_data\". Use these exact values in the SQL (e.g. IN (...)) instead of guessing; "
+                  "lists marked incomplete must not be enumerated with IN, use the given condition instead:",
+        "term": "\"{term}\"",
+        "fuzzy": " (approximate match)",
+        "truncated": " (incomplete list: {total} matching values, only {shown} of them are shown)",
+        "like": "; to include all of them filter with \"{column}\" ILIKE '{pattern}%'",
+    },
+}
+
+
+def format_resolved_values(resolutions: list, lang: str = 'zh') -> str:
+    if not resolutions:
+        return ""
+    texts = _RESOLVED_VALUES_TEXT[lang]
+    lines = [texts["header"]]
+    for item in resolutions:
+        values = ", ".join("'" + value.replace("'", "''") + "'" for value in item["values"])
+        term = texts["term"].format(term=item["term"]) + " -> " if item["term"] else ""
+        suffix = texts["fuzzy"] if item["match"] in ("fuzzy", "pinyin") else ""
+        if item.get("total", len(item["values"])) > len(item["values"]):
+            suffix += texts["truncated"].format(total=item["total"], shown=len(item["values"]))
+            if item.get("like"):
+                suffix += texts["like"].format(column=item["column"], pattern=item["like"].replace("'", "''"))
+        lines.append(f'- {term}"{item["column"]}": {values}{suffix}')
+    return "\n".join(lines)
+
+
+def resolve_question_values(question: str, data_source, lang: str = 'zh'):
+    """返回 (写入提示词的取值匹配说明, 涉及的列)；索引不可用或没有匹配时返回 ("", [])"""
+    index = get_value_index(data_source)
+    if index is None:
+        return "", []
+    started = time.perf_counter()
+    resolutions = index.resolve(question)
+    if resolutions:
+        print(f"[ValueIndex] 匹配到 {len(resolutions)} 个取值说法 ({(time.perf_counter() - started) * 1000:.2f}ms): "
+              + "; ".join(f'{item["term"] or "~"} -> {item["column"]}' for item in resolutions))
+    return format_resolved_values(resolutions, lang), [item["column"] for item in resolutions]